@@ -1,8 +1,10 @@
 import os
 import json
+import atexit
+import asyncio
 import tempfile
 import markdown
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -11,66 +13,312 @@ load_dotenv()
 from database import db, init_db
 from session_service import DatabaseSessionService
 from memory_service import DatabaseMemoryService
+from response_cache import PersistentLRUCache, TTLCache
+from streaming import JsonFieldStream, format_sse
+from document_loader import SmartLoader, PdfPageExtractor, read_source
+from image_preprocessing import ImageNormalizer
+from job_queue import JobQueue
+from genai_client import get_client, warm_up_in_background
+from llm_scheduler import LLMScheduler, ScheduledClient, is_transient_failure, track_llm_failures
+from model_router import ModelRouter, RoutedClient
+import metrics
+from metrics import MeteredClient, track_stage
+from tracing import tracer
+from prompt_builder import track_truncation
 
 try:
     from multimodel_medical_agent import MultimodalMedicalAgent
     from patient_advisor import PatientConsultantAgent
     from patient_advisor import ConsultationSummaryJSON 
+    from patient_advisor import CONSULTATION_MARKDOWN_HEADER, render_consultation_section, render_key_finding
     from prescription_reader import PrescriptionReaderAgent
-    from doctor_agent import DoctorAssistant
+    from doctor_agent import DoctorAssistant, SymptomAnalysisResult
     
 except ImportError as e:
     print(f"Error importing agents: {e}")
     print("Please make sure all necessary files are in the current directory.")
     exit(1)
 
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+class SpooledUploadRequest(Request):
+    """
+    Keeps multipart uploads in memory and only spills them to disk above
+    UPLOAD_SPOOL_MAX_BYTES (werkzeug's default spills anything over 500 KB).
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, mode="rb+")
+
+
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
 CORS(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "A_SECURE_FALLBACK_KEY_")
 
 init_db(app)
+with app.app_context():
+    metrics.instrument_app(app, db.engine)
+
+# Per-request span trees for /analyze_reports, /analyze_prescription, /doctor_assistant and their jobs.
+tracer.configure(
+    capacity=int(os.getenv("TRACE_BUFFER_SIZE", "100")),
+    enabled=os.getenv("TRACE_ENABLED", "true").lower() == "true"
+)
 
 session_service = DatabaseSessionService(app_name="medical_agent")
-memory_service = DatabaseMemoryService(app_name="medical_agent")
+if os.getenv("EVENT_WRITE_BEHIND", "false").lower() == "true":
+    session_service.enable_write_behind(
+        app,
+        max_queue_size=int(os.getenv("EVENT_QUEUE_MAX_SIZE", "10000")),
+        batch_size=int(os.getenv("EVENT_BATCH_SIZE", "200")),
+        flush_timeout=float(os.getenv("EVENT_FLUSH_TIMEOUT", "30"))
+    )
+memory_service = DatabaseMemoryService(
+    app_name="medical_agent",
+    retrieval=os.getenv("MEMORY_RETRIEVAL", "fts"),
+    max_tfidf_users=int(os.getenv("MEMORY_TFIDF_MAX_USERS", "256"))
+)
 
 if not os.getenv("GOOGLE_API_KEY") and not os.getenv("GEMINI_API_KEY"):
     print("Warning: GOOGLE_API_KEY or GEMINI_API_KEY not found in environment variables.")
 
+extraction_cache = None
+if os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true":
+    extraction_cache = PersistentLRUCache(
+        path=os.getenv("EXTRACTION_CACHE_PATH", os.path.join(os.path.dirname(__file__), "extraction_cache.db")),
+        namespace="medical_record_extraction",
+        max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "2000")),
+        max_bytes=int(os.getenv("EXTRACTION_CACHE_MAX_MB", "200")) * 1024 * 1024
+    )
+
+pdf_page_extractor = None
+pdf_extract_workers = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+if pdf_extract_workers > 1:
+    pdf_page_extractor = PdfPageExtractor(
+        workers=pdf_extract_workers,
+        min_pages=int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32")),
+        timeout=float(os.getenv("PDF_EXTRACT_TIMEOUT", "60"))
+    )
+    atexit.register(pdf_page_extractor.shutdown)
+
+medicine_cache = None
+if os.getenv("MEDICINE_CACHE_ENABLED", "true").lower() == "true":
+    medicine_cache = PersistentLRUCache(
+        path=os.getenv("EXTRACTION_CACHE_PATH", os.path.join(os.path.dirname(__file__), "extraction_cache.db")),
+        namespace="medicine_knowledge",
+        max_entries=int(os.getenv("MEDICINE_CACHE_MAX_ENTRIES", "5000")),
+        ttl_seconds=float(os.getenv("MEDICINE_CACHE_TTL_DAYS", "30")) * 86400
+    )
+
+symptom_cache = None
+if os.getenv("SYMPTOM_CACHE_ENABLED", "true").lower() == "true":
+    symptom_cache = TTLCache(
+        max_entries=int(os.getenv("SYMPTOM_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("SYMPTOM_CACHE_TTL_SECONDS", "3600"))
+    )
+
+image_normalizer = None
+if os.getenv("IMAGE_NORMALIZE_ENABLED", "true").lower() == "true":
+    image_normalizer = ImageNormalizer(
+        max_dimension=int(os.getenv("IMAGE_MAX_DIMENSION", "2048")),
+        quality=int(os.getenv("IMAGE_QUALITY", "85")),
+        grayscale=os.getenv("IMAGE_GRAYSCALE", "false").lower() == "true",
+        autocontrast=os.getenv("IMAGE_AUTOCONTRAST", "false").lower() == "true",
+        output_format=os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG")
+    )
+
+llm_scheduler = None
+if os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() == "true":
+    llm_scheduler = LLMScheduler.from_env()
+
+model_router = None
+if os.getenv("LLM_ROUTER_ENABLED", "true").lower() == "true":
+    model_router = ModelRouter.from_env()
+    atexit.register(model_router.shutdown)
+
+def agent_client(client, agent, priority):
+    """
+    Routes the agent's model calls through the shared rate limiter with the given priority class,
+    and through the latency-aware router (hedged duplicates are rate limited too); latency and
+    token usage are recorded under the agent's name.
+    """
+    if llm_scheduler:
+        client = ScheduledClient(client, llm_scheduler, priority)
+    if model_router:
+        client = RoutedClient(client, model_router)
+    return MeteredClient(client, agent, priority)
+
 try:
-    extractor_agent = MultimodalMedicalAgent()
-    consultant_agent = PatientConsultantAgent()
-    prescription_agent = PrescriptionReaderAgent()
-    symptom_agent = DoctorAssistant()
+    # One pooled client for every agent: shared keep-alive connections and explicit timeouts.
+    genai_client = get_client()
+    report_loader = SmartLoader(page_extractor=pdf_page_extractor, image_normalizer=image_normalizer)
+    extractor_agent = MultimodalMedicalAgent(cache=extraction_cache, loader=report_loader, client=agent_client(genai_client, "report_extractor", "standard"))
+    consultant_agent = PatientConsultantAgent(client=agent_client(genai_client, "consultant", "standard"))
+    prescription_agent = PrescriptionReaderAgent(image_normalizer=image_normalizer, knowledge_cache=medicine_cache, client=agent_client(genai_client, "prescription_reader", "standard"))
+    # Symptom checks are interactive: under quota pressure they go ahead of reports and batch work.
+    symptom_agent = DoctorAssistant(cache=symptom_cache, client=agent_client(genai_client, "doctor_assistant", "interactive"))
+    # Batch uploads and background jobs share the caches but queue behind everything else.
+    batch_extractor_agent = MultimodalMedicalAgent(cache=extraction_cache, loader=report_loader, client=agent_client(genai_client, "report_extractor", "batch"))
+    batch_consultant_agent = PatientConsultantAgent(client=agent_client(genai_client, "consultant", "batch"))
+    batch_prescription_agent = PrescriptionReaderAgent(image_normalizer=image_normalizer, knowledge_cache=medicine_cache, client=agent_client(genai_client, "prescription_reader", "batch"))
+
+    if os.getenv("GENAI_WARMUP", "true").lower() == "true":
+        warm_up_in_background(genai_client)
 
 except Exception as e:
     print(f"Failed to initialize agents: {e}")
 
+def read_upload(file):
+    with track_stage("upload_read", file=file.filename) as span:
+        data = read_source(file.stream)
+        span.set(bytes=len(data))
+        return data
+
+def cache_counters():
+    """Hit/miss counters of every enabled cache, read at scrape time."""
+    caches = {"extraction": extraction_cache, "medicine_knowledge": medicine_cache, "symptom_analysis": symptom_cache}
+    values = {}
+    for name, cache in caches.items():
+        if cache is not None:
+            stats = cache.stats()
+            values[(name, "hit")] = stats["hits"]
+            values[(name, "miss")] = stats["misses"]
+    return values
+
+def cache_hit_ratios():
+    counters = cache_counters()
+    names = {name for name, _ in counters}
+    return {(name,): counters[(name, "hit")] / ((counters[(name, "hit")] + counters[(name, "miss")]) or 1) for name in names}
+
+metrics.registry.callback("cache_requests_total", "Cache lookups by result.", "counter", ["cache", "result"], cache_counters)
+metrics.registry.callback("cache_hit_ratio", "Cache hits / lookups since startup.", "gauge", ["cache"], cache_hit_ratios)
+metrics.registry.callback(
+    "image_normalization_bytes_saved_total", "Bytes removed from images before Vision calls.", "counter", [],
+    lambda: {(): image_normalizer.stats()["bytes_saved"]} if image_normalizer else {})
+
 def generate_error_response(message, status_code=400):
     return jsonify({
         "status": "error",
         "message": message
     }), status_code
 
+async def run_db(func, *args, **kwargs):
+    """
+    Runs a blocking database call on a worker thread inside its own app context
+    (and therefore its own SQLAlchemy session), so it can overlap with LLM calls.
+    """
+    def call():
+        with app.app_context():
+            return func(*args, **kwargs)
+    return await asyncio.to_thread(call)
+
+async def write_exchange(user_id, session_id, user_content, assistant_content):
+    """record_exchange() on a worker thread, traced as the request's session write."""
+    with tracer.span("session.write", session_id=session_id):
+        await run_db(record_exchange, user_id, session_id, user_content, assistant_content)
+
+def record_exchange(user_id, session_id, user_content, assistant_content):
+    """Logs a user/assistant event pair in order (creating the session if needed) as one batch."""
+    session_service.log_events(user_id, session_id, [
+        {"role": "user", "content": user_content},
+        {"role": "assistant", "content": assistant_content}
+    ])
+
+SYMPTOM_SECTION_ORDER = [
+    'disclaimer_and_urgency',
+    'current_condition_analysis',
+    'possible_medical_problems',
+    'immediate_actions',
+    'recommended_specialist',
+    'final_statement'
+]
+
+def render_symptom_section(field, data):
+    if field == 'disclaimer_and_urgency':
+        return f"**{data.get('disclaimer_and_urgency', 'Disclaimer: No professional medical advice provided.')}**\n\n"
+
+    if field == 'current_condition_analysis':
+        return f"## 1. What You Might Be Experiencing\n{data.get('current_condition_analysis', 'N/A')}\n\n"
+
+    if field == 'possible_medical_problems':
+        problems = data.get('possible_medical_problems', [])
+        md = "## 2. Possible Medical Problems\n"
+        md += "\n".join([f"- {p}" for p in problems]) if problems else "- N/A\n"
+        return md + "\n\n"
+
+    if field == 'immediate_actions':
+        actions = data.get('immediate_actions', [])
+        md = "## 3. Immediate Actions to Take\n"
+        md += "\n".join([f"- {a}" for a in actions]) if actions else "- N/A\n"
+        return md + "\n\n"
+
+    if field == 'recommended_specialist':
+        return f"## 4. Recommended Specialist\n**Specialist:** {data.get('recommended_specialist', 'General Practitioner (GP)')}\n\n"
+
+    if field == 'final_statement':
+        return f"***\n{data.get('final_statement', 'N/A')}"
+
+    return ""
+
 def format_symptom_analysis_to_markdown(data):
-    md = f"**{data.get('disclaimer_and_urgency', 'Disclaimer: No professional medical advice provided.')}**\n\n"
-    md += "## 1. What You Might Be Experiencing\n"
-    md += f"{data.get('current_condition_analysis', 'N/A')}\n\n"
-    
-    md += "## 2. Possible Medical Problems\n"
-    problems = data.get('possible_medical_problems', [])
-    md += "\n".join([f"- {p}" for p in problems]) if problems else "- N/A\n"
-    md += "\n\n"
-    
-    md += "## 3. Immediate Actions to Take\n"
-    actions = data.get('immediate_actions', [])
-    md += "\n".join([f"- {a}" for a in actions]) if actions else "- N/A\n"
-    md += "\n\n"
-    
-    md += "## 4. Recommended Specialist\n"
-    md += f"**Specialist:** {data.get('recommended_specialist', 'General Practitioner (GP)')}\n\n"
-    
-    md += f"***\n{data.get('final_statement', 'N/A')}"
-    return md
+    return "".join(render_symptom_section(field, data) for field in SYMPTOM_SECTION_ORDER)
+
+def build_symptom_payload(symptoms, analysis_data, memory_context, session_id, prompt_truncated=False):
+    return {
+        "status": "success",
+        "service": "Symptom Analysis",
+        "input_symptoms": symptoms,
+        "analysis_json": analysis_data,
+        "analysis_markdown": format_symptom_analysis_to_markdown(analysis_data),
+        "memory_context_used": memory_context if memory_context else None,
+        "prompt_truncated": prompt_truncated,
+        "session_id": session_id
+    }
+
+def build_report_payload(patient_profile, structured_data, consultation, session_id, prompt_truncated=False):
+    return {
+        "status": "success",
+        "service": "Medical Consultation",
+        "patient_profile": patient_profile,
+        "structured_medical_data": structured_data,
+        "consultation_summary_markdown": consultation["markdown"],
+        "consultation_summary_html": markdown.markdown(consultation["markdown"]),
+        "consultation_summary_json": consultation["json"],
+        # True when an agent's prompt input had to be shortened to fit its token budget.
+        "prompt_truncated": prompt_truncated,
+        "session_id": session_id
+    }
+
+def read_patient_profile(form):
+    return {
+        "name": form.get('name', 'Unknown'),
+        "age": form.get('age', ''), 
+        "gender": form.get('gender', 'Unknown'),
+        "history": form.get('history', 'None'),
+        "complaints": form.get('complaints', 'None')
+    }
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+async def extract_report(semaphore, filename, data):
+    """Runs one batch file through the extraction agent; failures become a per-file error entry."""
+    async with semaphore:
+        raw_json_str = await batch_extractor_agent.analyze_bytes_async(data, filename)
+
+    try:
+        structured_data = json.loads(raw_json_str)
+    except json.JSONDecodeError:
+        return {"filename": filename, "status": "error", "message": "Extraction Error: The AI failed to generate valid JSON data."}
+
+    if "error" in structured_data:
+        return {"filename": filename, "status": "error", "message": f"Extraction Agent Failed: {structured_data['error']}"}
+
+    return {"filename": filename, "status": "success", "structured_medical_data": structured_data}
 
 
 @app.route('/sessions', methods=['POST'])
@@ -88,10 +336,16 @@ def create_session():
 
 @app.route('/sessions/<user_id>', methods=['GET'])
 def list_sessions(user_id):
-    sessions = session_service.list_sessions(user_id)
+    if request.args.get('include_events', 'false').lower() == 'true':
+        sessions = session_service.list_sessions(user_id, include_events=True)
+        return jsonify({
+            "status": "success",
+            "sessions": [s.to_dict() for s in sessions]
+        }), 200
+
     return jsonify({
         "status": "success",
-        "sessions": [s.to_dict() for s in sessions]
+        "sessions": session_service.list_session_summaries(user_id)
     }), 200
 
 @app.route('/sessions/<user_id>/<session_id>', methods=['GET'])
@@ -172,6 +426,7 @@ def add_session_to_memory(user_id, session_id):
     data = request.get_json(silent=True) or {}
     summary = data.get('summary')
     
+    session_service.flush_pending_events(user_id, session_id)
     memory = memory_service.add_session_to_memory(user_id, session_id, summary)
     if not memory:
         return generate_error_response("Session not found or has no events", 404)
@@ -215,8 +470,116 @@ def delete_memory(user_id, memory_id):
     }), 200
 
 
+async def run_report_analysis(data, filename, patient_profile, user_id, session_id, batch=False):
+    """
+    Extraction + consultation for one uploaded report, shared by /analyze_reports and its jobs.
+    batch=True uses the batch-priority agents. Returns the response payload, or {"error": ..., "status_code": ...}.
+    """
+    with track_truncation() as truncated:
+        extractor, consultant = (batch_extractor_agent, batch_consultant_agent) if batch else (extractor_agent, consultant_agent)
+        with tracer.span("extraction", file=filename, bytes=len(data)):
+            raw_json_str = await extractor.analyze_bytes_async(data, filename)
+
+        try:
+            with tracer.span("parse_extraction", chars=len(raw_json_str)):
+                structured_data = json.loads(raw_json_str)
+        except json.JSONDecodeError:
+            return {"error": "Extraction Error: The AI failed to generate valid JSON data.", "status_code": 500}
+
+        if "error" in structured_data:
+            return {"error": f"Extraction Agent Failed: {structured_data['error']}", "status_code": 500}
+
+        with tracer.span("consultation"):
+            consultation = await consultant.generate_consultation_summary_async(
+                report_analysis=structured_data,
+                patient_profile=patient_profile
+            )
+
+        if "error" in consultation:
+            return {"error": f"Consultant Agent Failed: {consultation['error']}", "status_code": 500}
+
+        if session_id:
+            await write_exchange(user_id, session_id, f"Analyzed report: {filename}", consultation["markdown"][:500])
+
+        with tracer.span("render_html"):
+            return build_report_payload(patient_profile, structured_data, consultation, session_id, prompt_truncated=bool(truncated))
+
+async def run_prescription_analysis(data, filename, user_id, session_id, batch=False):
+    """Prescription analysis for one uploaded image, shared by /analyze_prescription and its jobs."""
+    with track_truncation() as truncated:
+        agent = batch_prescription_agent if batch else prescription_agent
+        with tracer.span("prescription_analysis", file=filename, bytes=len(data)):
+            analysis_result = await agent.analyze_prescription_image_async(data)
+
+        if "error" in analysis_result:
+            return {"error": f"Prescription Analysis Failed: {analysis_result['error']}", "status_code": 500}
+
+        if session_id:
+            await write_exchange(user_id, session_id, f"Analyzed prescription: {filename}", json.dumps(analysis_result.get('raw_extraction', {}))[:500])
+
+        return {
+            "status": "success",
+            "service": "Prescription Analysis",
+            "raw_extraction": analysis_result["raw_extraction"],
+            "analysis": analysis_result["analysis"],
+            "image_normalization": analysis_result.get("image_normalization"),
+            "prompt_truncated": bool(truncated),
+            "session_id": session_id
+        }
+
+def mark_retryable(result, failures):
+    """
+    Flags a failed result for retry by the job queue when an LLM call behind it failed
+    with quota, overload, a timeout or an open breaker (judged by the exceptions the
+    agents caught, see track_llm_failures, not by the error text).
+    """
+    if "error" in result and any(is_transient_failure(error) for error in failures):
+        result["retryable"] = True
+    return result
+
+def report_job(payload, data):
+    with tracer.trace("job:analyze_report", file=payload["filename"]), track_llm_failures() as failures:
+        return mark_retryable(asyncio.run(run_report_analysis(data, payload["filename"], payload["patient_profile"], payload["user_id"], payload["session_id"], batch=True)), failures)
+
+def prescription_job(payload, data):
+    with tracer.trace("job:analyze_prescription", file=payload["filename"]), track_llm_failures() as failures:
+        return mark_retryable(asyncio.run(run_prescription_analysis(data, payload["filename"], payload["user_id"], payload["session_id"], batch=True)), failures)
+
+# Built at import so routes can submit jobs; the workers are started by the server
+# entry points (start_background_workers), not as a side effect of importing the app.
+job_queue = None
+if int(os.getenv("JOB_WORKERS", "2")) > 0:
+    job_queue = JobQueue(
+        app,
+        handlers={"analyze_report": report_job, "analyze_prescription": prescription_job},
+        workers=int(os.getenv("JOB_WORKERS", "2")),
+        lease_seconds=int(os.getenv("JOB_LEASE_SECONDS", "600")),
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+        result_ttl_seconds=int(os.getenv("JOB_RESULT_TTL_SECONDS", "86400"))
+    )
+    atexit.register(job_queue.shutdown)
+
+def start_background_workers():
+    """Starts the job queue workers; called once by whatever serves the app (__main__, asgi.py)."""
+    if job_queue is not None:
+        job_queue.start()
+
+def wants_job():
+    """Submit-and-poll mode is requested with async=true (query string or form field)."""
+    return (request.args.get('async') or request.form.get('async', 'false')).lower() == 'true'
+
+async def submit_job(kind, payload, data):
+    if job_queue is None:
+        return generate_error_response("Asynchronous jobs are disabled (JOB_WORKERS=0).", 503)
+    job_id = await asyncio.to_thread(job_queue.submit, kind, payload, data)
+    response = jsonify({"status": "accepted", "job_id": job_id, "status_url": f"/jobs/{job_id}"})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+
 @app.route('/analyze_reports', methods=['GET', 'POST'])
-def index():
+@tracer.traced_view("analyze_reports")
+async def index():
     if request.method == 'POST':
         if 'file' not in request.files:
             return generate_error_response('No file part in the request.')
@@ -232,75 +595,27 @@ def index():
         user_id = request.form.get('user_id', 'default_user')
         session_id = request.form.get('session_id')
         
-        if session_id:
-            session = session_service.create_session(user_id, session_id)
-        
-        tmp_path = None
         try:
-            suffix = os.path.splitext(file.filename)[1]
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-                file.save(tmp_file.name)
-                tmp_path = tmp_file.name
-
-            patient_profile = {
-                "name": request.form.get('name', 'Unknown'),
-                "age": request.form.get('age', ''), 
-                "gender": request.form.get('gender', 'Unknown'),
-                "history": request.form.get('history', 'None'),
-                "complaints": request.form.get('complaints', 'None')
-            }
+            patient_profile = read_patient_profile(request.form)
+            # The upload is read once from its spooled buffer; no temp-file round trip.
+            data = read_upload(file)
 
-            raw_json_str = extractor_agent.analyze_file(tmp_path)
-            
-            try:
-                structured_data = json.loads(raw_json_str)
-            except json.JSONDecodeError:
-                return generate_error_response("Extraction Error: The AI failed to generate valid JSON data.", 500)
+            if wants_job():
+                return await submit_job("analyze_report", {
+                    "filename": file.filename,
+                    "patient_profile": patient_profile,
+                    "user_id": user_id,
+                    "session_id": session_id
+                }, data)
 
-            if "error" in structured_data:
-                return generate_error_response(f"Extraction Agent Failed: {structured_data['error']}", 500)
+            result = await run_report_analysis(data, file.filename, patient_profile, user_id, session_id)
+            if "error" in result:
+                return generate_error_response(result["error"], result["status_code"])
 
-            doctor_summary_md = consultant_agent.generate_consultation(
-                report_analysis=structured_data,
-                patient_profile=patient_profile,
-                json_output=False
-            )
-
-            doctor_summary_json_str = consultant_agent.generate_consultation(
-                report_analysis=structured_data,
-                patient_profile=patient_profile,
-                json_output=True
-            )
-            
-            if doctor_summary_md.startswith("Error generating consultation:"):
-                return generate_error_response(f"Consultant Agent Failed (Markdown): {doctor_summary_md}", 500)
-            
-            try:
-                doctor_summary_json = json.loads(doctor_summary_json_str)
-                ConsultationSummaryJSON.model_validate(doctor_summary_json)
-            except Exception as e:
-                 return generate_error_response(f"Consultant Agent Failed (JSON parsing/validation): {str(e)}", 500)
-
-            if session_id:
-                session_service.add_event(user_id, session_id, "user", f"Analyzed report: {file.filename}")
-                session_service.add_event(user_id, session_id, "assistant", doctor_summary_md[:500])
-
-            return jsonify({
-                "status": "success",
-                "service": "Medical Consultation",
-                "patient_profile": patient_profile,
-                "structured_medical_data": structured_data,
-                "consultation_summary_markdown": doctor_summary_md,
-                "consultation_summary_html": markdown.markdown(doctor_summary_md),
-                "consultation_summary_json": doctor_summary_json,
-                "session_id": session_id
-            }), 200
+            return jsonify(result), 200
 
         except Exception as e:
             return generate_error_response(f"An unexpected server error occurred: {str(e)}", 500)
-        finally:
-            if tmp_path and os.path.exists(tmp_path):
-                os.remove(tmp_path)
 
     return jsonify({
         "status": "info",
@@ -308,8 +623,148 @@ def index():
     }), 200
 
 
+@app.route('/analyze_reports/stream', methods=['POST'])
+def analyze_reports_stream():
+    """
+    Streaming variant of /analyze_reports over Server-Sent Events.
+    Events: start, extraction, markdown (per section), finding (per key finding),
+    field (per completed JSON field), then result (same payload as /analyze_reports) or error.
+    """
+    if 'file' not in request.files:
+        return generate_error_response('No file part in the request.')
+
+    file = request.files['file']
+
+    if file.filename == '':
+        return generate_error_response('No selected file.')
+
+    if 'extractor_agent' not in globals() or 'consultant_agent' not in globals():
+        return generate_error_response("System Error: AI agents failed to initialize. Check GOOGLE_API_KEY.", 500)
+
+    user_id = request.form.get('user_id', 'default_user')
+    session_id = request.form.get('session_id')
+    patient_profile = read_patient_profile(request.form)
+    filename = file.filename
+    # Read before the request context (and its spooled upload) is torn down.
+    data = read_upload(file)
+
+    def generate():
+        try:
+            with track_truncation() as truncated:
+                yield format_sse("start", {"service": "Medical Consultation", "session_id": session_id})
+
+                raw_json_str = extractor_agent.analyze_bytes(data, filename)
+                try:
+                    structured_data = json.loads(raw_json_str)
+                except json.JSONDecodeError:
+                    yield format_sse("error", {"status": "error", "message": "Extraction Error: The AI failed to generate valid JSON data."})
+                    return
+
+                if "error" in structured_data:
+                    yield format_sse("error", {"status": "error", "message": f"Extraction Agent Failed: {structured_data['error']}"})
+                    return
+
+                yield format_sse("extraction", {"structured_medical_data": structured_data})
+                yield format_sse("markdown", {"field": None, "markdown": CONSULTATION_MARKDOWN_HEADER})
+
+                streamer = JsonFieldStream()
+                for chunk in consultant_agent.generate_consultation_stream(structured_data, patient_profile):
+                    for kind, field, value in streamer.feed(chunk):
+                        if kind == "item" and field == "key_findings":
+                            yield format_sse("finding", {"finding": value, "markdown": render_key_finding(value)})
+                        elif kind == "field":
+                            yield format_sse("field", {"field": field, "value": value})
+                            yield format_sse("markdown", {"field": field, "markdown": render_consultation_section(field, value)})
+
+                consultation = PatientConsultantAgent.parse_summary(streamer.text)
+                if "error" in consultation:
+                    yield format_sse("error", {"status": "error", "message": f"Consultant Agent Failed: {consultation['error']}"})
+                    return
+
+                if session_id:
+                    record_exchange(user_id, session_id, f"Analyzed report: {filename}", consultation["markdown"][:500])
+
+                yield format_sse("result", build_report_payload(patient_profile, structured_data, consultation, session_id, prompt_truncated=bool(truncated)))
+
+        except Exception as e:
+            yield format_sse("error", {"status": "error", "message": f"An unexpected server error occurred: {str(e)}"})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.route('/analyze_reports/batch', methods=['POST'])
+async def analyze_reports_batch():
+    """
+    Analyzes many reports in one request. Files (form field 'files') are extracted
+    concurrently, at most BATCH_MAX_CONCURRENCY at a time, so wall time tracks the
+    slowest file rather than the sum. Returns one entry per file in upload order;
+    with consultation=true (default) a single consultation covers every extracted document.
+    """
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return generate_error_response("No files in the request (use the 'files' form field).")
+
+    if len(files) > BATCH_MAX_FILES:
+        return generate_error_response(f"Too many files: {len(files)} (maximum {BATCH_MAX_FILES}).")
+
+    if 'extractor_agent' not in globals() or 'consultant_agent' not in globals():
+        return generate_error_response("System Error: AI agents failed to initialize. Check GOOGLE_API_KEY.", 500)
+
+    user_id = request.form.get('user_id', 'default_user')
+    session_id = request.form.get('session_id')
+    include_consultation = request.form.get('consultation', 'true').lower() == 'true'
+    try:
+        concurrency = max(1, min(int(request.form.get('concurrency', BATCH_MAX_CONCURRENCY)), BATCH_MAX_CONCURRENCY))
+    except ValueError:
+        return generate_error_response("'concurrency' must be an integer.")
+
+    try:
+        patient_profile = read_patient_profile(request.form)
+        uploads = [(file.filename, read_upload(file)) for file in files]
+
+        with track_truncation() as truncated:
+            semaphore = asyncio.Semaphore(concurrency)
+            results = await asyncio.gather(*(extract_report(semaphore, filename, data) for filename, data in uploads))
+            extracted = [result for result in results if result["status"] == "success"]
+
+            payload = {
+                "status": "success" if extracted else "error",
+                "service": "Batch Report Analysis",
+                "patient_profile": patient_profile,
+                "results": results,
+                "succeeded": len(extracted),
+                "failed": len(results) - len(extracted),
+                "session_id": session_id
+            }
+
+            if include_consultation and extracted:
+                consultation = await batch_consultant_agent.generate_consultation_summary_async(
+                    report_analysis={"documents": [
+                        {"filename": result["filename"], "data": result["structured_medical_data"]} for result in extracted
+                    ]},
+                    patient_profile=patient_profile
+                )
+                if "error" in consultation:
+                    payload["consultation_error"] = f"Consultant Agent Failed: {consultation['error']}"
+                else:
+                    payload["consultation_summary_markdown"] = consultation["markdown"]
+                    payload["consultation_summary_html"] = markdown.markdown(consultation["markdown"])
+                    payload["consultation_summary_json"] = consultation["json"]
+
+                    if session_id:
+                        filenames = ", ".join(result["filename"] for result in extracted)
+                        await write_exchange(user_id, session_id, f"Analyzed {len(extracted)} reports: {filenames}"[:500], consultation["markdown"][:500])
+
+        payload["prompt_truncated"] = bool(truncated)
+        return jsonify(payload), 200 if extracted else 500
+
+    except Exception as e:
+        return generate_error_response(f"An unexpected server error occurred: {str(e)}", 500)
+
+
 @app.route('/analyze_prescription', methods=['POST'])
-def analyze_prescription():
+@tracer.traced_view("analyze_prescription")
+async def analyze_prescription():
     if 'file' not in request.files:
         return generate_error_response("No file part"), 400
     
@@ -324,42 +779,29 @@ def analyze_prescription():
     user_id = request.form.get('user_id', 'default_user')
     session_id = request.form.get('session_id')
     
-    if session_id:
-        session_service.create_session(user_id, session_id)
-    
-    tmp_path = None
     try:
-        suffix = os.path.splitext(file.filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            file.save(tmp_file.name)
-            tmp_path = tmp_file.name
+        data = read_upload(file)
 
-        analysis_result = prescription_agent.analyze_prescription_image(tmp_path)
-        
-        if "error" in analysis_result:
-            return generate_error_response(f"Prescription Analysis Failed: {analysis_result['error']}", 500)
+        if wants_job():
+            return await submit_job("analyze_prescription", {
+                "filename": file.filename,
+                "user_id": user_id,
+                "session_id": session_id
+            }, data)
 
-        if session_id:
-            session_service.add_event(user_id, session_id, "user", f"Analyzed prescription: {file.filename}")
-            session_service.add_event(user_id, session_id, "assistant", json.dumps(analysis_result.get('raw_extraction', {}))[:500])
+        result = await run_prescription_analysis(data, file.filename, user_id, session_id)
+        if "error" in result:
+            return generate_error_response(result["error"], result["status_code"])
 
-        return jsonify({
-            "status": "success",
-            "service": "Prescription Analysis",
-            "raw_extraction": analysis_result["raw_extraction"],
-            "analysis": analysis_result["analysis"],
-            "session_id": session_id
-        }), 200
+        return jsonify(result), 200
 
     except Exception as e:
         return generate_error_response(f"An unexpected server error occurred during prescription analysis: {str(e)}", 500)
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
 
 
 @app.route('/doctor_assistant', methods=['POST'])
-def analyze_symptoms_route():
+@tracer.traced_view("doctor_assistant")
+async def analyze_symptoms_route():
     data = request.get_json(silent=True)
     if not data or 'symptoms' not in data:
         return generate_error_response("Missing 'symptoms' field in request JSON.", 400)
@@ -373,19 +815,18 @@ def analyze_symptoms_route():
 
     user_id = data.get('user_id', 'default_user')
     session_id = data.get('session_id')
-    
-    if session_id:
-        session_service.create_session(user_id, session_id)
-
-    memory_context = ""
-    if user_id:
-        memory_context = memory_service.get_context_for_agent(user_id, symptoms)
 
     try:
-        analysis_json_str = symptom_agent.analyze(symptoms)
+        # The LLM call and the memory lookup are independent, so run them together.
+        with track_truncation() as truncated:
+            analysis_json_str, memory_context = await asyncio.gather(
+                tracer.traced("symptom_analysis", symptom_agent.analyze_async(symptoms, use_cache=data.get('use_cache', True) is not False)),
+                tracer.traced("memory.lookup", run_db(memory_service.get_context_for_agent, user_id, symptoms)) if user_id else asyncio.sleep(0, result="")
+            )
         
         try:
-            analysis_data = json.loads(analysis_json_str)
+            with tracer.span("parse_analysis", chars=len(analysis_json_str)):
+                analysis_data = json.loads(analysis_json_str)
         except json.JSONDecodeError:
             return generate_error_response("Analysis Error: AI failed to generate valid JSON.", 500)
 
@@ -393,23 +834,141 @@ def analyze_symptoms_route():
             return generate_error_response(f"Symptom Analysis Failed: {analysis_data['error']}", 500)
 
         if session_id:
-            session_service.add_event(user_id, session_id, "user", f"Symptoms: {symptoms}")
-            session_service.add_event(user_id, session_id, "assistant", format_symptom_analysis_to_markdown(analysis_data)[:500])
+            await write_exchange(user_id, session_id, f"Symptoms: {symptoms}", format_symptom_analysis_to_markdown(analysis_data)[:500])
 
-        return jsonify({
-            "status": "success",
-            "service": "Symptom Analysis",
-            "input_symptoms": symptoms,
-            "analysis_json": analysis_data,
-            "analysis_markdown": format_symptom_analysis_to_markdown(analysis_data),
-            "memory_context_used": memory_context if memory_context else None,
-            "session_id": session_id
-        }), 200
+        with tracer.span("render_markdown"):
+            payload = build_symptom_payload(symptoms, analysis_data, memory_context, session_id, prompt_truncated=bool(truncated))
+        return jsonify(payload), 200
 
     except Exception as e:
         return generate_error_response(f"An unexpected server error occurred during symptom analysis: {str(e)}", 500)
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if job_queue is None:
+        return generate_error_response("Asynchronous jobs are disabled (JOB_WORKERS=0).", 503)
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return generate_error_response("Job not found or its result has expired.", 404)
+
+    return jsonify({
+        "status": "success",
+        "job": job
+    }), 200
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "status": "success",
+        "caches": {
+            "extraction": extraction_cache.stats() if extraction_cache else None,
+            "medicine_knowledge": medicine_cache.stats() if medicine_cache else None,
+            "symptom_analysis": symptom_cache.stats() if symptom_cache else None
+        }
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/llm/stats', methods=['GET'])
+def llm_stats():
+    return jsonify({
+        "status": "success",
+        "backend": {"name": os.getenv("LLM_BACKEND", "live"), **(genai_client.stats() if hasattr(genai_client, "stats") else {})},
+        "scheduler": llm_scheduler.stats() if llm_scheduler else None,
+        "router": model_router.stats() if model_router else None
+    }), 200
+
+
+@app.route('/debug/traces', methods=['GET'])
+def list_traces():
+    """Most recent traces first (?limit=N); ?format=chrome returns them as one Chrome trace-event file."""
+    limit = request.args.get('limit', 20, type=int)
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracer.to_chrome([summary["trace_id"] for summary in tracer.recent(limit)])), 200
+    return jsonify({
+        "status": "success",
+        "enabled": tracer.enabled,
+        "traces": tracer.recent(limit)
+    }), 200
+
+
+@app.route('/debug/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    trace = tracer.get(trace_id)
+    if trace is None:
+        return generate_error_response("Trace not found (it may have left the ring buffer).", 404)
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracer.to_chrome([trace_id])), 200
+    return jsonify({"status": "success", "trace": trace.to_dict()}), 200
+
+
+@app.route('/images/stats', methods=['GET'])
+def image_stats():
+    return jsonify({
+        "status": "success",
+        "image_normalization": image_normalizer.stats() if image_normalizer else None
+    }), 200
+
+
+@app.route('/doctor_assistant/stream', methods=['POST'])
+def analyze_symptoms_stream_route():
+    """
+    Streaming variant of /doctor_assistant over Server-Sent Events.
+    Events: start, field + markdown (per completed JSON field, disclaimer first),
+    then result (same payload as /doctor_assistant) or error.
+    """
+    data = request.get_json(silent=True)
+    if not data or 'symptoms' not in data:
+        return generate_error_response("Missing 'symptoms' field in request JSON.", 400)
+
+    symptoms = data['symptoms']
+    if not symptoms or not isinstance(symptoms, str):
+        return generate_error_response("Symptoms must be a non-empty string.", 400)
+
+    if 'symptom_agent' not in globals():
+        return generate_error_response("System Error: Symptom Analysis Agent failed to initialize.", 500)
+
+    user_id = data.get('user_id', 'default_user')
+    session_id = data.get('session_id')
+    use_cache = data.get('use_cache', True) is not False
+
+    def generate():
+        try:
+            with track_truncation() as truncated:
+                yield format_sse("start", {"service": "Symptom Analysis", "session_id": session_id})
+
+                streamer = JsonFieldStream()
+                for chunk in symptom_agent.analyze_stream(symptoms, use_cache=use_cache):
+                    for kind, field, value in streamer.feed(chunk):
+                        if kind == "field":
+                            yield format_sse("field", {"field": field, "value": value})
+                            yield format_sse("markdown", {"field": field, "markdown": render_symptom_section(field, {field: value})})
+
+                try:
+                    analysis_data = SymptomAnalysisResult.model_validate_json(streamer.text).model_dump()
+                except Exception as e:
+                    yield format_sse("error", {"status": "error", "message": f"Analysis Error: AI failed to generate valid JSON. {str(e)}"})
+                    return
+
+                memory_context = memory_service.get_context_for_agent(user_id, symptoms) if user_id else ""
+                if session_id:
+                    record_exchange(user_id, session_id, f"Symptoms: {symptoms}", format_symptom_analysis_to_markdown(analysis_data)[:500])
+
+                yield format_sse("result", build_symptom_payload(symptoms, analysis_data, memory_context, session_id, prompt_truncated=bool(truncated)))
+
+        except Exception as e:
+            yield format_sse("error", {"status": "error", "message": f"An unexpected server error occurred during symptom analysis: {str(e)}"})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
 @app.route('/', methods=['GET'])
 def health_check():
     return jsonify({
@@ -419,12 +978,13 @@ def health_check():
         "features": {
             "sessions": "Database-backed session management",
             "memory": "Long-term memory storage and retrieval",
-            "agents": ["report_analyzer", "prescription_reader", "doctor_assistant"]
+            "agents": ["report_analyzer", "prescription_reader", "doctor_assistant"],
+            "caching": "Persistent content-addressed extraction cache"
         },
         "endpoints": {
             "sessions": {
                 "POST /sessions": "Create a new session",
-                "GET /sessions/<user_id>": "List all sessions for a user",
+                "GET /sessions/<user_id>": "List session summaries for a user (?include_events=true for full events)",
                 "GET /sessions/<user_id>/<session_id>": "Get a specific session",
                 "DELETE /sessions/<user_id>/<session_id>": "Delete a session",
                 "POST /sessions/<user_id>/<session_id>/events": "Add an event to a session",
@@ -441,11 +1001,34 @@ def health_check():
             "agents": {
                 "POST /analyze_reports": "Analyze medical reports",
                 "POST /analyze_prescription": "Analyze prescription images",
-                "POST /doctor_assistant": "Analyze symptoms"
+                "POST /doctor_assistant": "Analyze symptoms",
+                "POST /analyze_reports/stream": "Analyze medical reports (Server-Sent Events)",
+                "POST /doctor_assistant/stream": "Analyze symptoms (Server-Sent Events)",
+                "POST /analyze_reports/batch": "Analyze many reports concurrently, with one merged consultation"
+            },
+            "jobs": {
+                "POST /analyze_reports?async=true": "Submit a report analysis job (202 + job id)",
+                "POST /analyze_prescription?async=true": "Submit a prescription analysis job (202 + job id)",
+                "GET /jobs/<job_id>": "Job status and, once finished, its result"
+            },
+            "cache": {
+                "GET /cache/stats": "Cache sizes and hit/miss counters",
+                "GET /images/stats": "Image normalization totals (bytes in/out/saved)"
+            },
+            "metrics": {
+                "GET /metrics": "Prometheus metrics: route/agent latency histograms, LLM tokens, cache ratios, loader paths, DB queries"
+            },
+            "llm": {
+                "GET /llm/stats": "Rate limiter state per model, rolling latency/error rates, hedge rate and cost overhead"
+            },
+            "debug": {
+                "GET /debug/traces": "Recent request traces (?limit=N, ?format=chrome for chrome://tracing / Perfetto)",
+                "GET /debug/traces/<trace_id>": "Span tree of one trace (id from the X-Trace-Id response header)"
             }
         }
     }), 200
 
 
 if __name__ == '__main__':
+    start_background_workers()
     app.run(debug=True, host='0.0.0.0', port=5001)
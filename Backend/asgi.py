@@ -0,0 +1,52 @@
+"""
+ASGI entry point.
+
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 5001 --workers 4
+
+This is a thread-per-request adapter, not an async server: the app is still
+a Flask (WSGI) app, served through asgiref's WSGI adapter, so every in-flight
+request holds one thread for its whole duration, including while its
+`async def` view awaits the genai client. One process runs at most
+ASGI_THREADS (default 64) requests at a time and queues the rest; scale out
+with --workers. With a server database, keep DB_POOL_SIZE + DB_MAX_OVERFLOW
+at least as large as ASGI_THREADS (SQLite, the default, is not pooled).
+
+asgiref's adapter on its own runs every request on one shared thread, which
+serializes them. Opening a ThreadSensitiveContext per request (asgiref's
+public hook for this) gives each request its own thread instead.
+"""
+import os
+import asyncio
+import weakref
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, start_background_workers
+
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "64"))
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that runs each request on its own thread, at most `max_threads` at a time."""
+
+    def __init__(self, wsgi_application, max_threads: int = ASGI_THREADS, **kwargs):
+        super().__init__(wsgi_application, **kwargs)
+        self.max_threads = max_threads
+        # One semaphore per event loop: asyncio primitives cannot be shared across loops.
+        self._limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        limit = self._limits.get(loop)
+        if limit is None:
+            limit = self._limits[loop] = asyncio.Semaphore(self.max_threads)
+        return limit
+
+    async def __call__(self, scope, receive, send):
+        async with self._limit(), ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+
+asgi_app = PooledWsgiToAsgi(app)
+start_background_workers()
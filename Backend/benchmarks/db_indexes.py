@@ -0,0 +1,121 @@
+"""
+Benchmark for the composite indexes added by migration 0001.
+
+Builds a synthetic SQLite database shaped like agent_data.db without the
+indexes, prints the query plan and median latency of the hot queries, then
+runs the migrations and prints the same numbers again.
+
+    cd Backend && python -m benchmarks.db_indexes --events 300000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, run_migrations
+
+APP_NAME = "medical_agent"
+
+HOT_QUERIES = {
+    "list_sessions": (
+        "SELECT * FROM sessions WHERE app_name = :app_name AND user_id = :user_id ORDER BY updated_at DESC",
+        lambda rng, args: {"app_name": APP_NAME, "user_id": f"user-{rng.randrange(args.users)}"}
+    ),
+    "get_events": (
+        "SELECT * FROM events WHERE session_id = :session_id ORDER BY timestamp, id",
+        lambda rng, args: {"session_id": f"session-{rng.randrange(args.users * args.sessions_per_user)}"}
+    ),
+    "get_memories_by_type": (
+        "SELECT * FROM memories WHERE user_id = :user_id AND app_name = :app_name AND memory_type = :memory_type ORDER BY created_at DESC",
+        lambda rng, args: {"user_id": f"user-{rng.randrange(args.users)}", "app_name": APP_NAME, "memory_type": "session_summary"}
+    ),
+}
+
+
+def populate(engine, args, rng):
+    sessions_total = args.users * args.sessions_per_user
+    start = datetime(2025, 1, 1)
+
+    sessions = [
+        {"id": f"session-{i}", "app_name": APP_NAME, "user_id": f"user-{i % args.users}", "state": "{}",
+         "created_at": start + timedelta(minutes=i), "updated_at": start + timedelta(minutes=i)}
+        for i in range(sessions_total)
+    ]
+    events = [
+        {"session_id": f"session-{rng.randrange(sessions_total)}", "role": "user" if i % 2 == 0 else "assistant",
+         "content": f"event {i}", "timestamp": start + timedelta(seconds=i), "event_metadata": "{}"}
+        for i in range(args.events)
+    ]
+    memories = [
+        {"user_id": f"user-{rng.randrange(args.users)}", "app_name": APP_NAME, "content": f"memory {i}",
+         "memory_type": rng.choice(["general", "session_summary"]), "source_session_id": None,
+         "created_at": start + timedelta(seconds=i)}
+        for i in range(args.memories)
+    ]
+
+    with engine.begin() as conn:
+        conn.execute(db.Model.metadata.tables["sessions"].insert(), sessions)
+        conn.execute(db.Model.metadata.tables["events"].insert(), events)
+        conn.execute(db.Model.metadata.tables["memories"].insert(), memories)
+
+
+def measure(engine, args, label):
+    print(f"\n=== {label} ===")
+    rng = random.Random(1)
+    with engine.connect() as conn:
+        for name, (sql, make_params) in HOT_QUERIES.items():
+            plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), make_params(rng, args)).fetchall()
+            timings = []
+            for _ in range(args.repeats):
+                params = make_params(rng, args)
+                t0 = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - t0) * 1000)
+            print(f"{name:<22} median {statistics.median(timings):8.3f} ms   p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:8.3f} ms")
+            for row in plan:
+                print(f"    plan: {row[-1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--sessions-per-user", type=int, default=10)
+    parser.add_argument("--events", type=int, default=300000)
+    parser.add_argument("--memories", type=int, default=50000)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        db.Model.metadata.create_all(engine)
+        # Start from a pre-index database, like an existing agent_data.db.
+        with engine.begin() as conn:
+            for table in db.Model.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.drop(bind=conn)
+
+        t0 = time.perf_counter()
+        populate(engine, args, random.Random(0))
+        print(f"Populated {args.users * args.sessions_per_user} sessions, {args.events} events, "
+              f"{args.memories} memories in {time.perf_counter() - t0:.1f} s")
+
+        measure(engine, args, "before (no secondary indexes)")
+
+        t0 = time.perf_counter()
+        applied = run_migrations(engine)
+        print(f"\nMigrations {applied} took {time.perf_counter() - t0:.2f} s")
+
+        measure(engine, args, "after migrations")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Load simulation for the LLM scheduler (token buckets, priorities, retries).
+
+Runs a burst of batch report extractions and a trickle of interactive symptom
+checks against the local FakeGenAIClient, with a deliberately small
+requests-per-minute quota and injected 429s, and prints per-class latency,
+retry counts and the breaker state. Interactive calls should finish well
+ahead of the batch backlog; no request should fail unless the injected error
+rate exceeds what the retry budget can absorb.
+
+    cd Backend && python -m benchmarks.llm_scheduler --rpm 30 --batch 40 --interactive 5 --error-rate 0.1
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm import FakeGenAIClient
+from llm_scheduler import LLMScheduler, ScheduledClient
+
+MODEL = "gemini-2.0-flash"
+
+
+async def timed_call(client, prompt, latencies, failures):
+    t0 = time.perf_counter()
+    try:
+        await client.aio.models.generate_content(model=MODEL, contents=[prompt])
+        latencies.append(time.perf_counter() - t0)
+    except Exception as e:
+        failures.append(str(e))
+
+
+async def run(args):
+    fake = FakeGenAIClient(latency=args.latency, jitter=args.latency / 2, error_rate=args.error_rate, seed=0)
+    scheduler = LLMScheduler(default_rpm=args.rpm, default_tpm=args.tpm, max_retries=args.retries,
+                             base_backoff=args.backoff, failure_threshold=args.breaker_threshold)
+    batch_client = ScheduledClient(fake, scheduler, "batch")
+    interactive_client = ScheduledClient(fake, scheduler, "interactive")
+
+    results = {"batch": ([], []), "interactive": ([], [])}
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(timed_call(batch_client, f"report {i}", *results["batch"])) for i in range(args.batch)]
+    for i in range(args.interactive):
+        # Symptom checks arrive while the batch backlog is queued.
+        await asyncio.sleep(args.interactive_gap)
+        tasks.append(asyncio.create_task(timed_call(interactive_client, f"symptoms {i}", *results["interactive"])))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+
+    print(f"{args.batch} batch + {args.interactive} interactive calls, rpm={args.rpm}, error_rate={args.error_rate}: {elapsed:.2f} s\n")
+    print(f"{'class':>12} {'ok':>4} {'failed':>6} {'p50 s':>8} {'max s':>8}")
+    for name, (latencies, failures) in results.items():
+        p50 = statistics.median(latencies) if latencies else float("nan")
+        worst = max(latencies) if latencies else float("nan")
+        print(f"{name:>12} {len(latencies):>4} {len(failures):>6} {p50:8.3f} {worst:8.3f}")
+
+    stats = scheduler.stats()
+    print(f"\nmodel calls={fake.calls} injected errors={fake.errors} retries={stats['retries']} "
+          f"failures={stats['failures']} circuit={stats['models'][MODEL]['circuit']} trips={stats['models'][MODEL]['circuit_trips']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rpm", type=int, default=30)
+    parser.add_argument("--tpm", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=40)
+    parser.add_argument("--interactive", type=int, default=5)
+    parser.add_argument("--interactive-gap", type=float, default=1.0, help="Seconds between interactive arrivals")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--backoff", type=float, default=0.2)
+    parser.add_argument("--breaker-threshold", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+End-to-end load test for the agent endpoints.
+
+Drives /analyze_reports, /analyze_prescription and /doctor_assistant with the
+sample files in Images/ (and a fixed set of symptom descriptions) at a given
+concurrency, then prints throughput and p50/p95/p99 latency per endpoint.
+Point it at a running server, or use --in-process to load the Flask app
+directly. Run the app with LLM_BACKEND=replay (or fake) so the test does not
+spend Gemini quota; record the replay set once with LLM_BACKEND=record.
+
+    cd Backend && LLM_BACKEND=replay python app.py
+    cd Backend && python -m benchmarks.loadtest --url http://localhost:5001 --requests 300 --concurrency 16
+
+    cd Backend && LLM_BACKEND=fake python -m benchmarks.loadtest --in-process --requests 100
+"""
+import os
+import sys
+import glob
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "Images")
+
+SYMPTOMS = [
+    "fever and headache for two days",
+    "dry cough, sore throat and mild fever",
+    "sharp lower back pain after lifting",
+    "itchy red rash on both arms",
+    "dizziness when standing up quickly",
+    "burning stomach pain after meals",
+    "shortness of breath while climbing stairs",
+    "frequent urination and constant thirst"
+]
+
+ENDPOINTS = ("reports", "prescriptions", "symptoms")
+
+
+def percentile(sorted_values, quantile):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(round(quantile * (len(sorted_values) - 1))))]
+
+
+class HttpTarget:
+    def __init__(self, url, timeout):
+        import httpx
+        self.client = httpx.Client(base_url=url, timeout=timeout, limits=httpx.Limits(max_connections=256, max_keepalive_connections=256))
+
+    def upload(self, path, filename, data):
+        response = self.client.post(path, files={"file": (filename, data, "image/png")})
+        return response.status_code
+
+    def post_json(self, path, body):
+        return self.client.post(path, json=body).status_code
+
+
+class InProcessTarget:
+    def __init__(self):
+        import io
+        import app as flask_app
+        self.io = io
+        self.client = flask_app.app.test_client()
+
+    def upload(self, path, filename, data):
+        return self.client.post(path, data={"file": (self.io.BytesIO(data), filename)}, content_type="multipart/form-data").status_code
+
+    def post_json(self, path, body):
+        return self.client.post(path, json=body).status_code
+
+
+def make_call(target, endpoint, images, rng):
+    if endpoint == "symptoms":
+        return lambda: target.post_json("/doctor_assistant", {"symptoms": rng.choice(SYMPTOMS), "use_cache": False})
+    filename, data = rng.choice(images)
+    path = "/analyze_reports" if endpoint == "reports" else "/analyze_prescription"
+    return lambda: target.upload(path, filename, data)
+
+
+def parse_mix(text):
+    weights = {}
+    for entry in text.split(","):
+        name, _, weight = entry.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' in --mix (expected {', '.join(ENDPOINTS)})")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--in-process", action="store_true", help="Import the Flask app instead of calling a server")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default="reports=1,prescriptions=1,symptoms=2", help="Relative weights per endpoint")
+    parser.add_argument("--images", default=IMAGES_DIR)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    images = [(os.path.basename(path), open(path, "rb").read()) for path in sorted(glob.glob(os.path.join(args.images, "*.png")))]
+    if not images:
+        raise SystemExit(f"No sample images found in {args.images}")
+
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    plan = rng.choices(list(weights), weights=list(weights.values()), k=args.requests)
+    target = InProcessTarget() if args.in_process else HttpTarget(args.url, args.timeout)
+    calls = [(endpoint, make_call(target, endpoint, images, rng)) for endpoint in plan]
+
+    results = {endpoint: [] for endpoint in weights}  # (seconds, status)
+    lock = threading.Lock()
+
+    def run(item):
+        endpoint, call = item
+        t0 = time.perf_counter()
+        try:
+            status = call()
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - t0
+        with lock:
+            results[endpoint].append((elapsed, status))
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {len(images)} sample images, "
+          f"target {'in-process app' if args.in_process else args.url}")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run, calls))
+    wall = time.perf_counter() - t0
+
+    print(f"\n{'endpoint':>14} {'count':>6} {'errors':>6} {'req/s':>7} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}")
+    everything = []
+    for endpoint, samples in results.items():
+        latencies = sorted(seconds for seconds, _ in samples)
+        errors = sum(1 for _, status in samples if status != 200)
+        everything.extend(samples)
+        print(f"{endpoint:>14} {len(samples):>6} {errors:>6} {len(samples) / wall:7.2f} "
+              f"{percentile(latencies, 0.5):8.3f} {percentile(latencies, 0.95):8.3f} {percentile(latencies, 0.99):8.3f}")
+    latencies = sorted(seconds for seconds, _ in everything)
+    errors = sum(1 for _, status in everything if status != 200)
+    print(f"{'total':>14} {len(everything):>6} {errors:>6} {len(everything) / wall:7.2f} "
+          f"{percentile(latencies, 0.5):8.3f} {percentile(latencies, 0.95):8.3f} {percentile(latencies, 0.99):8.3f}")
+    print(f"\nWall time {wall:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Tail-latency benchmark for hedged requests (ModelRouter).
+
+The primary model is simulated with a slow tail (most calls take --base
+seconds, a fraction --spike-rate take --spike seconds) and the fallback with a
+lognormal distribution, all against the local FakeGenAIClient. The same
+workload runs with hedging off and on; p50/p95/p99 latency, the hedge rate
+and the cost overhead of losing calls are printed for both.
+
+    cd Backend && python -m benchmarks.model_router --requests 400 --spike-rate 0.08
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.genai import types
+from fake_llm import FakeGenAIClient, spike_latency, lognormal_latency
+from model_router import ModelRouter, RoutedClient, percentile
+from doctor_agent import SymptomAnalysisResult
+
+PRIMARY = "gemini-2.5-flash"
+FALLBACK = "gemini-2.0-flash"
+
+
+async def run_workload(args, hedging):
+    fake = FakeGenAIClient(
+        model_latency={
+            PRIMARY: spike_latency(args.base, args.spike, args.spike_rate),
+            FALLBACK: lognormal_latency(args.fallback_median, 0.3)
+        },
+        invalid_rate=args.invalid_rate,
+        seed=1
+    )
+    router = ModelRouter(fallbacks={PRIMARY: FALLBACK}, hedging=hedging, min_samples=20, min_hedge_delay=args.min_hedge_delay)
+    client = RoutedClient(fake, router)
+    config = types.GenerateContentConfig(response_mime_type="application/json", response_schema=SymptomAnalysisResult)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                await client.aio.models.generate_content(model=PRIMARY, contents=[f"symptoms {i}"], config=config)
+                latencies.append(time.perf_counter() - t0)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    router.shutdown()
+    return sorted(latencies), failures, router.stats(), fake.calls_by_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--base", type=float, default=0.05, help="Primary latency (s) outside spikes")
+    parser.add_argument("--spike", type=float, default=1.0, help="Primary latency (s) during a spike")
+    parser.add_argument("--spike-rate", type=float, default=0.08)
+    parser.add_argument("--fallback-median", type=float, default=0.08)
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Fraction of answers that fail schema validation")
+    parser.add_argument("--min-hedge-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{'hedging':>8} {'ok':>5} {'failed':>6} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'hedge %':>8} {'wins':>5} {'cost +%':>8}  calls per model")
+    for hedging in (False, True):
+        latencies, failures, stats, calls = asyncio.run(run_workload(args, hedging))
+        print(f"{'on' if hedging else 'off':>8} {len(latencies):>5} {failures:>6} "
+              f"{percentile(latencies, 0.5):7.3f} {percentile(latencies, 0.95):7.3f} {percentile(latencies, 0.99):7.3f} "
+              f"{stats['hedge_rate'] * 100:8.1f} {stats['hedge_wins']:>5} {stats['cost_overhead_ratio'] * 100:8.1f}  {calls}")
+
+
+if __name__ == "__main__":
+    main()
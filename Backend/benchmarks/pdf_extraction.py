@@ -0,0 +1,87 @@
+"""
+Benchmark for parallel PDF text extraction (PdfPageExtractor).
+
+Builds a synthetic corpus of large text-layer PDFs shaped like multi-page
+discharge summaries, extracts them in-process as a baseline, then with a
+process pool of increasing size, and prints wall time and speedup per worker
+count. Page order is checked against the baseline on every run.
+
+    cd Backend && python -m benchmarks.pdf_extraction --docs 4 --pages 200
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+import pymupdf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_loader import PdfPageExtractor, extract_page_texts
+
+LAB_ITEMS = ["Hemoglobin", "WBC Count", "Platelets", "Creatinine", "Sodium", "Potassium",
+             "ALT", "AST", "Bilirubin", "HbA1c", "TSH", "LDL Cholesterol", "CRP", "Ferritin"]
+
+
+def make_pdf(rng: random.Random, pages: int, lines_per_page: int) -> bytes:
+    doc = pymupdf.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        lines = [f"Discharge summary - page {page_number + 1}"]
+        for _ in range(lines_per_page):
+            item = rng.choice(LAB_ITEMS)
+            lines.append(f"{item}: {rng.uniform(0.1, 300):.2f} units  ref {rng.uniform(0, 10):.1f}-{rng.uniform(10, 200):.1f}  "
+                         f"{rng.choice(['High', 'Low', 'Normal'])}")
+        page.insert_text((36, 36), "\n".join(lines), fontsize=7)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def time_run(func, corpus, repeats):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = [func(data, pages) for data, pages in corpus]
+        timings.append(time.perf_counter() - t0)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--lines-per-page", type=int, default=80)
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="Worker counts to try (default: 2, 4, ... up to the number of cores)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({w for w in (2, 4, 8, 16, cores) if 1 < w <= max(cores, 2)})
+
+    rng = random.Random(0)
+    t0 = time.perf_counter()
+    corpus = [(make_pdf(rng, args.pages, args.lines_per_page), args.pages) for _ in range(args.docs)]
+    size_mb = sum(len(data) for data, _ in corpus) / (1024 * 1024)
+    print(f"Built {args.docs} PDFs x {args.pages} pages ({size_mb:.1f} MB) in {time.perf_counter() - t0:.1f} s, {cores} core(s)")
+
+    baseline_time, baseline = time_run(lambda data, pages: extract_page_texts(data, 0, pages), corpus, args.repeats)
+    print(f"\n{'workers':>14} {'median s':>10} {'speedup':>8}")
+    print(f"{'1 (in-process)':>14} {baseline_time:10.3f} {1.0:8.2f}")
+
+    for workers in worker_counts:
+        extractor = PdfPageExtractor(workers=workers, min_pages=1, timeout=600)
+        extractor.extract(*corpus[0])  # start the pool outside the timed runs
+        elapsed, result = time_run(extractor.extract, corpus, args.repeats)
+        extractor.shutdown()
+        if result != baseline:
+            raise SystemExit(f"Page texts differ from the in-process baseline with {workers} workers")
+        print(f"{workers:>14} {elapsed:10.3f} {baseline_time / elapsed:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
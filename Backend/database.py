@@ -1,5 +1,9 @@
 import os
+from typing import Optional, Dict, Any
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
 from datetime import datetime
 import json
 
@@ -7,6 +11,10 @@ db = SQLAlchemy()
 
 class Session(db.Model):
     __tablename__ = 'sessions'
+    __table_args__ = (
+        # list_sessions / list_session_summaries: filter by app and user, newest first
+        db.Index('ix_sessions_app_user_updated', 'app_name', 'user_id', 'updated_at'),
+    )
     
     id = db.Column(db.String(100), primary_key=True)
     app_name = db.Column(db.String(100), nullable=False)
@@ -28,8 +36,23 @@ class Session(db.Model):
             'events': [event.to_dict() for event in self.events]
         }
 
+    def to_summary_dict(self, event_count=0, last_event=None):
+        return {
+            'id': self.id,
+            'app_name': self.app_name,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'event_count': event_count,
+            'last_event': last_event
+        }
+
 class Event(db.Model):
     __tablename__ = 'events'
+    __table_args__ = (
+        # get_events / history / compaction: one session's events in timestamp order
+        db.Index('ix_events_session_timestamp', 'session_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     session_id = db.Column(db.String(100), db.ForeignKey('sessions.id'), nullable=False)
@@ -50,6 +73,10 @@ class Event(db.Model):
 
 class Memory(db.Model):
     __tablename__ = 'memories'
+    __table_args__ = (
+        # get_all_memories (optionally by type) and per-user search filters
+        db.Index('ix_memories_user_app_type', 'user_id', 'app_name', 'memory_type', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String(100), nullable=False)
@@ -70,11 +97,176 @@ class Memory(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
-def init_db(app):
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # JobQueue claim: next runnable job, and running jobs whose lease has expired
+        db.Index('ix_jobs_status_available', 'status', 'available_at'),
+        # Expiry sweep
+        db.Index('ix_jobs_expires_at', 'expires_at'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    payload = db.Column(db.Text, default='{}')
+    input_data = db.Column(db.LargeBinary, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    worker_id = db.Column(db.String(100), nullable=True)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error
+        }
+
+def _migration_composite_indexes(conn):
+    """Adds the composite indexes declared on the models to databases created before them."""
+    for table in (Session.__table__, Event.__table__, Memory.__table__):
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text("ANALYZE"))
+
+# Ordered, append-only list of (name, function). Each runs once per database.
+MIGRATIONS = [
+    ("0001_composite_indexes", _migration_composite_indexes),
+]
+
+def run_migrations(engine) -> list:
+    """Applies pending MIGRATIONS in order, recording each in schema_migrations. Returns the names applied."""
+    applied_now = []
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+        for name, migration in MIGRATIONS:
+            if name in applied:
+                continue
+            migration(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :applied_at)"),
+                {"name": name, "applied_at": datetime.utcnow()}
+            )
+            applied_now.append(name)
+    for name in applied_now:
+        print(f"[Database] Applied migration {name}")
+    return applied_now
+
+# External-content FTS5 index over memories.content, kept in sync by triggers.
+MEMORY_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+        content, content='memories', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS memories_fts_ai AFTER INSERT ON memories BEGIN
+        INSERT INTO memories_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS memories_fts_ad AFTER DELETE ON memories BEGIN
+        INSERT INTO memories_fts(memories_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS memories_fts_au AFTER UPDATE OF content ON memories BEGIN
+        INSERT INTO memories_fts(memories_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO memories_fts(rowid, content) VALUES (new.id, new.content);
+    END"""
+]
+
+def init_memory_fts(engine) -> bool:
+    """
+    Creates the memories full-text index (SQLite FTS5 only) and backfills it
+    from existing rows the first time. Returns False when FTS5 is unavailable.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'memories_fts'"
+            )).first()
+            for ddl in MEMORY_FTS_DDL:
+                conn.execute(text(ddl))
+            if not exists:
+                conn.execute(text("INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')"))
+        return True
+    except OperationalError as e:
+        print(f"[Database] FTS5 unavailable, memory search falls back to scanning: {e}")
+        return False
+
+def default_database_url() -> str:
     db_path = os.path.join(os.path.dirname(__file__), 'agent_data.db')
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    return f'sqlite:///{db_path}'
+
+def engine_options_for(database_url: str) -> Dict[str, Any]:
+    """
+    Engine options per backend. SQLite gets a busy timeout on the driver (its
+    pragmas are applied per connection in set_sqlite_pragmas); server databases
+    get a sized, pre-pinged, recycled connection pool.
+    """
+    if make_url(database_url).get_backend_name() == 'sqlite':
+        return {
+            "connect_args": {
+                "timeout": int(os.getenv("DB_SQLITE_BUSY_TIMEOUT_MS", "5000")) / 1000,
+                "check_same_thread": False
+            }
+        }
+
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True
+    }
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run alongside the writer, synchronous=NORMAL is durable
+    under WAL with far fewer fsyncs, and busy_timeout makes concurrent writers
+    wait instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('DB_SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+    cursor.execute(f"PRAGMA cache_size=-{int(os.getenv('DB_SQLITE_CACHE_SIZE_KB', '20000'))}")
+    cursor.execute(f"PRAGMA mmap_size={int(os.getenv('DB_SQLITE_MMAP_SIZE_MB', '256')) * 1024 * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def init_db(app, database_url: Optional[str] = None):
+    """
+    Binds the database to the app. The URL comes from the argument, then
+    DATABASE_URL, then the bundled SQLite file, so the same services run on
+    SQLite locally and on e.g. postgresql+psycopg://... in production.
+    """
+    database_url = database_url or os.getenv("DATABASE_URL") or default_database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_for(database_url)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.init_app(app)
     
     with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, "connect", set_sqlite_pragmas)
         db.create_all()
+        run_migrations(db.engine)
+        app.config['MEMORY_FTS_ENABLED'] = init_memory_fts(db.engine)
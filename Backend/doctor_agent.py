@@ -1,10 +1,15 @@
 import os
+import re
 import json
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 from pydantic import BaseModel, Field # NEW: Import Pydantic
-from typing import List, Optional # NEW: Import List
+from typing import List, Optional, Dict, Any, Iterator # NEW: Import List
+
+from response_cache import TTLCache
+from prompt_builder import PromptBuilder, dedent_prompt
+from llm_scheduler import note_llm_failure
 
 load_dotenv()
 
@@ -19,6 +24,39 @@ class SymptomAnalysisResult(BaseModel):
     recommended_specialist: str = Field(..., description="The most appropriate specialist or hospital department to visit.")
     final_statement: str = Field(..., description="Must be the exact phrase: 'Connect the doctor/hospital near your location.'")
 
+SYMPTOM_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SYMPTOM_CLAUSE_PATTERN = re.compile(r"[,;.!?\n]+")
+SYMPTOM_STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "with", "of", "in", "on", "at", "to", "for", "from", "since",
+    "i", "im", "me", "my", "have", "has", "had", "having", "am", "is", "are", "was", "been", "got", "some",
+    "also", "very", "really", "bit", "little", "lot", "please", "help", "experiencing"
+}
+# A clause containing one of these is never split on "and": in "no fever and cough" the negation may cover both.
+SYMPTOM_NEGATIONS = {"no", "not", "without", "never", "denies", "dont", "doesnt", "isnt", "cannot", "cant"}
+
+def canonicalize_symptoms(symptoms: str) -> str:
+    """
+    Canonical form used as the cache key. The text is split into phrases at
+    punctuation and at "and" (unless the clause is negated); each phrase is
+    lowercased with stopwords removed but keeps its word order, and the
+    distinct phrases are sorted. "Headache, fever" and "fever and headache"
+    match, while "pain in left arm, no pain in chest" and "pain in chest, no
+    pain in left arm" do not.
+    """
+    phrases = set()
+    for clause in SYMPTOM_CLAUSE_PATTERN.split(symptoms.lower()):
+        tokens = SYMPTOM_TOKEN_PATTERN.findall(clause)
+        if SYMPTOM_NEGATIONS.isdisjoint(tokens):
+            parts = " ".join(tokens).split(" and ")
+        else:
+            parts = [" ".join(tokens)]
+        for part in parts:
+            phrase = " ".join(token for token in part.split() if token not in SYMPTOM_STOPWORDS)
+            if phrase:
+                phrases.add(phrase)
+    return "; ".join(sorted(phrases))
+
+
 class DoctorAssistant:
     """
     AI Agent for preliminary symptom analysis and guidance.
@@ -26,23 +64,16 @@ class DoctorAssistant:
     a safe, structured, non-diagnostic response.
     """
 
-    def __init__(self, model_name: str = "gemini-2.5-flash"):
+    def __init__(self, model_name: str = "gemini-2.5-flash", cache: Optional[TTLCache] = None, client: Optional[genai.Client] = None,
+                 prompt_builder: Optional[PromptBuilder] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
-        self.client = genai.Client(api_key=self.api_key)
+        # A shared client (genai_client.get_client) pools connections across agents.
+        self.client = client or genai.Client(api_key=self.api_key)
         self.model = model_name
-
-    def analyze(self, symptoms: str) -> str:
-        """
-        Analyzes user-provided symptoms and generates a structured advisory response in JSON format.
-        
-        Args:
-            symptoms: A string describing the user's symptoms.
-            
-        Returns:
-            A JSON string conforming to the SymptomAnalysisResult schema.
-        """
-        
-        prompt = f"""
+        self.cache = cache
+        # Keeps pasted-in symptom descriptions within the agent's token budget.
+        self.prompt_builder = prompt_builder or PromptBuilder.from_env("doctor_assistant", client=self.client, model=model_name)
+        self.prompt_template = dedent_prompt("""
         ### SYSTEM ROLE: Structured Medical Advisor
         You are an expert medical assistant providing preliminary, non-diagnostic guidance. Your response must be highly structured, cautious, and helpful. You MUST start your analysis by generating the **disclaimer_and_urgency** field first.
 
@@ -52,21 +83,107 @@ class DoctorAssistant:
         ### INSTRUCTIONS
         1. Fill all fields of the required JSON schema.
         2. Ensure the "final_statement" field contains the exact phrase: "Connect the doctor/hospital near your location."
-        """
+        """)
+
+    def _cache_key(self, symptoms: str, use_cache: bool) -> Optional[str]:
+        """Returns the cache key, or None when caching is off for this call or nothing is left to key on."""
+        if self.cache is None or not use_cache:
+            return None
+        canonical = canonicalize_symptoms(symptoms)
+        return f"{self.model}:{canonical}" if canonical else None
+
+    def _cached(self, cache_key: Optional[str]) -> Optional[str]:
+        return self.cache.get(cache_key) if cache_key is not None else None
 
+    def _store_in_cache(self, cache_key: Optional[str], response_text: str) -> None:
+        """Only responses that validate against SymptomAnalysisResult are cached (re-serialized compactly)."""
+        if cache_key is None:
+            return
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.7,
-                    # NEW: Request strict JSON output using the Pydantic schema
-                    response_mime_type="application/json",
-                    response_schema=SymptomAnalysisResult
-                )
+            result = SymptomAnalysisResult.model_validate_json(response_text)
+        except Exception:
+            return
+        self.cache.set(cache_key, result.model_dump_json())
+
+    def _request_for(self, symptoms: str) -> Dict[str, Any]:
+        """The generate_content arguments for symptoms already fitted to the budget."""
+        return {
+            "model": self.model,
+            "contents": self.prompt_template.format(symptoms=symptoms),
+            "config": types.GenerateContentConfig(
+                temperature=0.7,
+                # NEW: Request strict JSON output using the Pydantic schema
+                response_mime_type="application/json",
+                response_schema=SymptomAnalysisResult
             )
+        }
+
+    def _build_request(self, symptoms: str) -> Dict[str, Any]:
+        """Builds the generate_content arguments for the sync paths."""
+        overhead = self.prompt_builder.count(self.prompt_template)
+        return self._request_for(self.prompt_builder.fit_text(symptoms, overhead=overhead))
+
+    async def _build_request_async(self, symptoms: str) -> Dict[str, Any]:
+        """Async variant of _build_request(); exact token counts (if enabled) use the async client."""
+        overhead = await self.prompt_builder.count_async(self.prompt_template)
+        return self._request_for(await self.prompt_builder.fit_text_async(symptoms, overhead=overhead))
+
+    def analyze(self, symptoms: str, use_cache: bool = True) -> str:
+        """
+        Analyzes user-provided symptoms and generates a structured advisory response in JSON format.
+        
+        Args:
+            symptoms: A string describing the user's symptoms.
+            use_cache: Set to False to bypass the response cache for this call.
+            
+        Returns:
+            A JSON string conforming to the SymptomAnalysisResult schema.
+        """
+        cache_key = self._cache_key(symptoms, use_cache)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            response = self.client.models.generate_content(**self._build_request(symptoms))
+            self._store_in_cache(cache_key, response.text)
             # The model returns a JSON string that conforms to the schema
             return response.text
         except Exception as e:
             # Handle error and return a JSON string containing the error for reliable parsing in the Flask app
-            return json.dumps({"error": f"Error analyzing symptoms: {str(e)}"})
\ No newline at end of file
+            note_llm_failure(e)
+            return json.dumps({"error": f"Error analyzing symptoms: {str(e)}"})
+
+    async def analyze_async(self, symptoms: str, use_cache: bool = True) -> str:
+        """Async variant of analyze() on the genai async client."""
+        cache_key = self._cache_key(symptoms, use_cache)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            response = await self.client.aio.models.generate_content(**await self._build_request_async(symptoms))
+            self._store_in_cache(cache_key, response.text)
+            return response.text
+        except Exception as e:
+            note_llm_failure(e)
+            return json.dumps({"error": f"Error analyzing symptoms: {str(e)}"})
+
+    def analyze_stream(self, symptoms: str, use_cache: bool = True) -> Iterator[str]:
+        """
+        Streaming variant of analyze(): yields the JSON text chunk by chunk as the
+        model generates it (a cached answer is yielded as a single chunk).
+        Errors are raised to the caller, which owns the open stream.
+        """
+        cache_key = self._cache_key(symptoms, use_cache)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        for chunk in self.client.models.generate_content_stream(**self._build_request(symptoms)):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+        self._store_in_cache(cache_key, "".join(chunks))
@@ -1,96 +1,364 @@
 import os
 import io
-from typing import Union, List, Any
-from pypdf import PdfReader
+import math
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Union, List, Dict, Set, Sequence, Optional, BinaryIO
+import pymupdf
 import docx
 from PIL import Image
 from google.genai import types
 
+from image_preprocessing import ImageNormalizer
+from metrics import LOADER_PATHS
+from tracing import tracer
+
+# Anything the loaders accept as file content: a path, raw bytes/memoryview, or a readable binary stream.
+Source = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+# A PDF page counts as text when its text layer has at least this many characters.
+PDF_MIN_TEXT_CHARS = 50
+# Pages sampled (spread over the document) to detect fully scanned PDFs early.
+PDF_SAMPLE_PAGES = 5
+# Rendering of scanned pages sent to Vision.
+PDF_RENDER_DPI = 150
+PDF_JPEG_QUALITY = 75
+# Minimum pages per shard handed to a process-pool worker.
+PDF_MIN_SHARD_PAGES = 8
+
+def read_source(source: Source) -> bytes:
+    """
+    Returns the content of a source as bytes, reading it exactly once.
+    bytes are returned as-is (no copy); memoryview/bytearray/streams are copied
+    once, because the Gemini Part payload must be bytes anyway.
+    """
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source.read()
+
+def extract_page_texts(data: bytes, start: int, end: int) -> List[str]:
+    """Extracts the text layer of pages [start, end). Module-level so pool workers can run it."""
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        return [doc[index].get_text("text") for index in range(start, end)]
+
+
+def _report_worker_pid(pids) -> None:
+    """Pool worker initializer: tells the parent which processes belong to the pool."""
+    pids.put(os.getpid())
+
+
+class _WorkerPool:
+    """A process pool, the PIDs of its workers and the number of documents still using it."""
+
+    def __init__(self, workers: int, context):
+        self.pid_queue = context.SimpleQueue()
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                            initializer=_report_worker_pid, initargs=(self.pid_queue,))
+        self.pids: Set[int] = set()
+        self.active = 0
+        self.retired = False
+
+    def worker_pids(self) -> Set[int]:
+        while not self.pid_queue.empty():
+            self.pids.add(self.pid_queue.get())
+        return set(self.pids)
+
+    def kill(self) -> None:
+        """Cancels queued shards and kills the workers; shutdown() alone would let running shards finish."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for pid in self.worker_pids():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+class PdfPageExtractor:
+    """
+    Parallel text extraction for large PDFs.
+
+    Page ranges are sharded across a process pool (text extraction is CPU-bound
+    and would otherwise hold the GIL for the whole request) and reassembled in
+    page order. Documents below `min_pages` are not worth the IPC and should be
+    extracted in-process.
+
+    If a document exceeds `timeout` seconds its queued shards are cancelled and
+    the pool is retired: new documents go to a fresh pool, documents already
+    on the old one finish there, and once the last has, its workers are killed
+    to stop the stuck shards. So one pathological file can neither keep every
+    worker busy nor break other requests. A pool broken by a dead worker (e.g.
+    OOM-killed) is retired the same way and the document retried once.
+
+    Workers are started with "forkserver" where available, else "spawn":
+    forking the multi-threaded server itself can copy held locks into the
+    child and deadlock it. The fork server preloads only this module, so
+    neither it nor the workers import the app.
+    """
+
+    def __init__(self, workers: int, min_pages: int = 32, timeout: float = 60.0, start_method: Optional[str] = None):
+        self.workers = max(1, workers)
+        self.min_pages = min_pages
+        self.timeout = timeout
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            self._context.set_forkserver_preload([__name__])
+        self._pool: Optional[_WorkerPool] = None
+        self._lock = threading.Lock()
+
+    def enabled_for(self, page_count: int) -> bool:
+        return self.workers > 1 and page_count >= self.min_pages
+
+    def _checkout(self) -> _WorkerPool:
+        """The current pool, counted as in use until the matching _checkin()."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = _WorkerPool(self.workers, self._context)
+            self._pool.active += 1
+            return self._pool
+
+    def _checkin(self, pool: _WorkerPool, retire: bool = False) -> None:
+        """Releases `pool`; `retire` replaces it for new documents. A retired pool is killed once unused."""
+        with self._lock:
+            pool.active -= 1
+            if retire:
+                pool.retired = True
+                if self._pool is pool:
+                    self._pool = None
+            unused = pool.retired and pool.active == 0
+        if unused:
+            pool.kill()
+
+    def shard(self, page_count: int) -> List[range]:
+        """Splits pages into contiguous ranges, about two per worker for load balancing."""
+        shards = max(1, min(self.workers * 2, page_count // PDF_MIN_SHARD_PAGES))
+        size = math.ceil(page_count / shards)
+        return [range(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+    def extract(self, data: bytes, page_count: int) -> List[str]:
+        """
+        Returns the text of every page, in page order.
+        Raises TimeoutError past `timeout`, and BrokenProcessPool if a worker dies on a fresh pool too.
+        """
+        try:
+            return self._extract_once(data, page_count)
+        except BrokenProcessPool as e:
+            print(f"[Loader] PDF worker pool broke ({e}); retrying on a fresh pool.")
+        return self._extract_once(data, page_count)
+
+    def _extract_once(self, data: bytes, page_count: int) -> List[str]:
+        pool = self._checkout()
+        retire = False
+        try:
+            futures = [pool.executor.submit(extract_page_texts, data, pages.start, pages.stop) for pages in self.shard(page_count)]
+            _, not_done = wait(futures, timeout=self.timeout)
+            if not_done:
+                for future in not_done:
+                    future.cancel()
+                retire = True
+                raise TimeoutError(f"PDF text extraction exceeded {self.timeout}s")
+
+            texts: List[str] = []
+            for future in futures:
+                texts.extend(future.result())
+            return texts
+        except BrokenProcessPool:
+            retire = True
+            raise
+        finally:
+            self._checkin(pool, retire)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.executor.shutdown(wait=True)
+
+
 class SmartLoader:
     """
     Handles loading of various file types for the Medical Agent.
     Strategies:
     - DOCX: Always text extraction.
-    - PDF:  Try text extraction first. If text is sparse (scanned), use Multimodal (Vision).
+    - PDF:  Per page: text-layer pages as text, scanned pages as rendered images (Vision).
     - IMG:  Always Multimodal (Vision).
+
+    Loaders work on in-memory bytes: parsers get a BytesIO view over the same
+    buffer that becomes the Vision payload, so an upload is read only once.
+    Large PDFs are extracted in parallel when a PdfPageExtractor is given, and
+    images are downscaled/re-encoded when an ImageNormalizer is given.
     """
-    
+
+    def __init__(self, page_extractor: Optional[PdfPageExtractor] = None, image_normalizer: Optional[ImageNormalizer] = None):
+        self.page_extractor = page_extractor
+        self.image_normalizer = image_normalizer
+
+    def settings(self) -> Dict[str, object]:
+        """
+        Everything besides the file bytes that decides what the loader produces:
+        the PDF routing thresholds and the image normalization options.
+        Parallel extraction is left out; it yields the same text as the serial path.
+        """
+        return {
+            "pdf_min_text_chars": PDF_MIN_TEXT_CHARS,
+            "pdf_sample_pages": PDF_SAMPLE_PAGES,
+            "pdf_render_dpi": PDF_RENDER_DPI,
+            "pdf_jpeg_quality": PDF_JPEG_QUALITY,
+            "image_normalizer": self.image_normalizer.settings() if self.image_normalizer is not None else None,
+        }
+
     @staticmethod
-    def load_docx(file_path: str) -> str:
-        """Extracts text from a .docx file."""
-        doc = docx.Document(file_path)
+    def load_docx(data: bytes) -> str:
+        """Extracts text from .docx content."""
+        doc = docx.Document(io.BytesIO(data))
         full_text = []
         for para in doc.paragraphs:
             full_text.append(para.text)
         return "\n".join(full_text)
 
     @staticmethod
-    def load_pdf(file_path: str) -> Union[str, types.Part]:
+    def classify_pdf_pages(doc: "pymupdf.Document", pages: Sequence[int]) -> Dict[int, str]:
+        """Returns {page_index: text} for pages with a usable text layer; scanned pages are left out."""
+        return SmartLoader.select_text_pages((index, doc[index].get_text("text")) for index in pages)
+
+    @staticmethod
+    def select_text_pages(page_texts) -> Dict[int, str]:
+        """Keeps the (page_index, text) pairs whose text layer is long enough to count as a text page."""
+        return {index: text for index, text in page_texts if len(text.strip()) >= PDF_MIN_TEXT_CHARS}
+
+    @staticmethod
+    def render_pdf_page(doc: "pymupdf.Document", index: int) -> types.Part:
+        """Rasterizes one scanned page to JPEG for Gemini Vision."""
+        pixmap = doc[index].get_pixmap(dpi=PDF_RENDER_DPI)
+        return types.Part.from_bytes(data=pixmap.tobytes("jpeg", jpg_quality=PDF_JPEG_QUALITY), mime_type="image/jpeg")
+
+    def load_pdf(self, data: bytes, name: str = "document.pdf") -> Union[str, types.Part, List[Union[str, types.Part]], None]:
         """
-        Smart PDF Loader:
-        1. Tries to extract text using pypdf.
-        2. If text length is sufficient, returns text (Save tokens).
-        3. If text is sparse (likely scanned), returns raw PDF bytes for Gemini Vision.
+        Smart PDF Loader (per page):
+        1. Samples a few pages; if none has a text layer, the document is treated as
+           scanned and the raw PDF bytes go to Gemini Vision (no rendering needed).
+        2. Otherwise every page is classified: text-layer pages are sent as text,
+           scanned pages are rendered to JPEG.
+        3. Returns plain text when every page has text, else a mixed multi-part
+           payload in page order (consecutive text pages merged into one part).
+        If parallel extraction times out or keeps losing workers, the raw PDF goes to Vision as in 1.
+        Returns None when the PDF cannot be read.
         """
         try:
-            reader = PdfReader(file_path)
-            text_content = ""
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text_content += extracted + "\n"
-            
-            # HEURISTIC: If we extracted less than 50 chars per page on average, 
-            # it's likely a scanned document or image-heavy. Use Vision.
-            if len(text_content) < (50 * len(reader.pages)):
-                print(f"[Loader] PDF '{os.path.basename(file_path)}' appears scanned. Using Gemini Vision.")
-                with open(file_path, "rb") as f:
-                    pdf_bytes = f.read()
-                return types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")
-            
-            print(f"[Loader] PDF '{os.path.basename(file_path)}' processed as text.")
-            return text_content
+            with pymupdf.open(stream=data, filetype="pdf") as doc:
+                page_count = doc.page_count
+                tracer.annotate(page_count=page_count)
+                if page_count == 0:
+                    LOADER_PATHS.inc(path="pdf_empty")
+                    return ""
+
+                sample = sorted({round(i * (page_count - 1) / max(PDF_SAMPLE_PAGES - 1, 1)) for i in range(PDF_SAMPLE_PAGES)})
+                if not self.classify_pdf_pages(doc, sample):
+                    print(f"[Loader] PDF '{name}' appears scanned. Using Gemini Vision.")
+                    LOADER_PATHS.inc(path="pdf_vision")
+                    tracer.annotate(path="pdf_vision", scanned_pages=page_count)
+                    return types.Part.from_bytes(data=data, mime_type="application/pdf")
+
+                if self.page_extractor is not None and self.page_extractor.enabled_for(page_count):
+                    try:
+                        texts = self.page_extractor.extract(data, page_count)
+                    except (TimeoutError, BrokenProcessPool) as e:
+                        print(f"[Loader] Parallel extraction failed for '{name}' ({e}). Using Gemini Vision.")
+                        path = "pdf_timeout_vision" if isinstance(e, TimeoutError) else "pdf_broken_pool_vision"
+                        LOADER_PATHS.inc(path=path)
+                        tracer.annotate(path=path)
+                        return types.Part.from_bytes(data=data, mime_type="application/pdf")
+                    text_pages = self.select_text_pages(enumerate(texts))
+                else:
+                    text_pages = self.classify_pdf_pages(doc, range(page_count))
+                if len(text_pages) == page_count:
+                    print(f"[Loader] PDF '{name}' processed as text.")
+                    LOADER_PATHS.inc(path="pdf_text")
+                    tracer.annotate(path="pdf_text", text_pages=page_count)
+                    return "".join(text_pages[i] + "\n" for i in range(page_count))
+
+                parts: List[Union[str, types.Part]] = []
+                text_run: List[str] = []
+                for index in range(page_count):
+                    if index in text_pages:
+                        text_run.append(f"[Page {index + 1}]\n{text_pages[index]}")
+                        continue
+                    if text_run:
+                        parts.append("\n".join(text_run))
+                        text_run = []
+                    parts.append(f"[Page {index + 1}: scanned image]")
+                    parts.append(self.render_pdf_page(doc, index))
+                if text_run:
+                    parts.append("\n".join(text_run))
+
+                scanned = page_count - len(text_pages)
+                print(f"[Loader] PDF '{name}' is mixed: {len(text_pages)} text page(s), {scanned} scanned page(s) sent to Vision.")
+                LOADER_PATHS.inc(path="pdf_mixed")
+                tracer.annotate(path="pdf_mixed", text_pages=len(text_pages), scanned_pages=scanned)
+                return parts
 
         except Exception as e:
             print(f"Error reading PDF: {e}")
-            return ""
+            LOADER_PATHS.inc(path="pdf_error")
+            return None
 
-    @staticmethod
-    def load_image(file_path: str) -> types.Part:
+    def load_image(self, data: bytes, name: str = "image") -> types.Part:
         """Loads an image for Gemini Vision."""
         try:
-            # Verify it's a valid image
-            with Image.open(file_path) as img:
-                img.verify() 
-            
-            with open(file_path, "rb") as f:
-                img_bytes = f.read()
-            
-            # Determine mime type (default to jpeg if unknown/png)
-            mime_type = "image/jpeg"
-            if file_path.lower().endswith(".png"):
-                mime_type = "image/png"
-                
-            return types.Part.from_bytes(data=img_bytes, mime_type=mime_type)
+            if self.image_normalizer is not None:
+                normalized = self.image_normalizer.normalize(data, name)
+                return types.Part.from_bytes(data=normalized["data"], mime_type=normalized["mime_type"])
+
+            # Verify it's a valid image (and learn its real format) without re-reading
+            with Image.open(io.BytesIO(data)) as img:
+                img.verify()
+                mime_type = Image.MIME.get(img.format, "image/jpeg")
+
+            return types.Part.from_bytes(data=data, mime_type=mime_type)
         except Exception as e:
             print(f"Error reading Image: {e}")
             return None
 
-    def process_file(self, file_path: str) -> Union[str, types.Part, None]:
-        """Main entry point to route file to correct handler."""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
-            
-        ext = os.path.splitext(file_path)[1].lower()
-        
+    def process(self, source: Source, filename: str) -> Union[str, types.Part, List[Union[str, types.Part]], None]:
+        """
+        Routes in-memory content to the correct handler based on filename's extension.
+        `source` may be bytes, a memoryview, a binary stream or a path.
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in [".docx", ".pdf", ".jpg", ".jpeg", ".png", ".txt"]:
+            raise ValueError(f"Unsupported file format: {ext}")
+
+        data = read_source(source)
+        name = os.path.basename(filename)
+
         if ext == ".docx":
-            return self.load_docx(file_path)
+            LOADER_PATHS.inc(path="docx")
+            tracer.annotate(path="docx")
+            return self.load_docx(data)
         elif ext == ".pdf":
-            return self.load_pdf(file_path)
+            return self.load_pdf(data, name)
         elif ext in [".jpg", ".jpeg", ".png"]:
-            return self.load_image(file_path)
-        elif ext == ".txt":
-            with open(file_path, "r") as f:
-                return f.read()
+            LOADER_PATHS.inc(path="image")
+            tracer.annotate(path="image")
+            return self.load_image(data, name)
         else:
-            raise ValueError(f"Unsupported file format: {ext}")
\ No newline at end of file
+            LOADER_PATHS.inc(path="text")
+            tracer.annotate(path="text")
+            return data.decode("utf-8", errors="replace")
+
+    def process_file(self, file_path: str) -> Union[str, types.Part, List[Union[str, types.Part]], None]:
+        """Main entry point to route a file on disk to the correct handler."""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        return self.process(file_path, file_path)
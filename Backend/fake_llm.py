@@ -0,0 +1,192 @@
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+from typing import Optional, Dict, Any, Callable, Iterator, Union
+
+from google.genai import errors, types
+
+from llm_scheduler import estimate_tokens
+
+# Signature of a custom responder: (model, contents, config) -> response text.
+Responder = Callable[[str, Any, Optional[types.GenerateContentConfig]], str]
+
+# A latency is either fixed seconds or a distribution: (rng) -> seconds.
+Latency = Union[float, Callable[[random.Random], float]]
+
+
+def lognormal_latency(median: float, sigma: float = 0.5) -> Callable[[random.Random], float]:
+    """Right-skewed latency typical of LLM APIs; `median` in seconds."""
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+
+def spike_latency(base: float, spike: float, probability: float) -> Callable[[random.Random], float]:
+    """`base` seconds, except `spike` seconds with the given probability (a slow-tail model)."""
+    return lambda rng: spike if rng.random() < probability else base
+
+
+def sample_from_schema(schema: Dict[str, Any], defs: Optional[Dict[str, Any]] = None) -> Any:
+    """Builds a minimal value that conforms to a JSON schema (as produced by pydantic)."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return sample_from_schema(options[0], defs) if options else None
+
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: sample_from_schema(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), defs)]
+    if kind == "number":
+        return 0.9
+    if kind == "integer":
+        return 1
+    if kind == "boolean":
+        return False
+    return schema.get("title", "sample")
+
+
+def default_responder(model: str, contents: Any, config: Optional[types.GenerateContentConfig]) -> str:
+    """Schema-conforming JSON when the request has a response_schema, a generic JSON object or text otherwise."""
+    schema = getattr(config, "response_schema", None) if config is not None else None
+    if schema is not None and hasattr(schema, "model_json_schema"):
+        return json.dumps(sample_from_schema(schema.model_json_schema()))
+    if config is not None and config.response_mime_type == "application/json":
+        return json.dumps({"medicines": [{"name": "Paracetamol", "form": "Tablet"}]})
+    return "This is a simulated response from the fake LLM backend."
+
+
+class FakeGenAIClient:
+    """
+    Local stand-in for genai.Client used to exercise the scheduler, caches and
+    routes without network access or quota.
+
+    Each call sleeps for `latency` seconds (plus up to `jitter`); `latency` can
+    be a distribution such as lognormal_latency(), and `model_latency` sets one
+    per model. The call then fails with a 429 RESOURCE_EXHAUSTED ClientError
+    with probability `error_rate` (or a 503 ServerError with probability
+    `server_error_rate`), returns text that does not match the requested format
+    with probability `invalid_rate`, and otherwise returns a real
+    GenerateContentResponse with usage_metadata. Responses are built from the
+    request's response_schema unless a `responder` is given. Call counts are
+    kept in `calls`, `calls_by_model`, `errors` and `max_in_flight`.
+    """
+
+    def __init__(self, latency: Latency = 0.05, jitter: float = 0.0, error_rate: float = 0.0, server_error_rate: float = 0.0,
+                 responder: Optional[Responder] = None, seed: Optional[int] = None,
+                 model_latency: Optional[Dict[str, Latency]] = None, invalid_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.invalid_rate = invalid_rate
+        self.model_latency = model_latency or {}
+        self.responder = responder or default_responder
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.calls = 0
+        self.calls_by_model: Dict[str, int] = {}
+        self.errors = 0
+        self.max_in_flight = 0
+        self.models = _FakeModels(self)
+        self.aio = _FakeAio(self)
+
+    def _begin(self, model: str) -> float:
+        with self._lock:
+            self.calls += 1
+            self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            latency = self.model_latency.get(model, self.latency)
+            base = latency(self._random) if callable(latency) else latency
+            return base + self._random.uniform(0, self.jitter)
+
+    def _finish(self, model: str, contents: Any, config: Optional[types.GenerateContentConfig]) -> types.GenerateContentResponse:
+        with self._lock:
+            roll = self._random.random()
+            invalid = self._random.random() < self.invalid_rate
+            if roll < self.error_rate + self.server_error_rate:
+                self.errors += 1
+        if roll < self.error_rate:
+            raise errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Simulated quota exhaustion."}})
+        if roll < self.error_rate + self.server_error_rate:
+            raise errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "Simulated overload."}})
+
+        text = "Sorry, I cannot help with that." if invalid else self.responder(model, contents, config)
+        prompt_tokens = estimate_tokens(contents)
+        output_tokens = len(text) // 4 + 1
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]), finish_reason="STOP")],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens
+            ),
+            model_version=model
+        )
+
+    def _end(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def generate(self, model: str, contents: Any, config: Optional[types.GenerateContentConfig] = None) -> types.GenerateContentResponse:
+        try:
+            time.sleep(self._begin(model))
+        finally:
+            self._end()
+        return self._finish(model, contents, config)
+
+    async def generate_async(self, model: str, contents: Any, config: Optional[types.GenerateContentConfig] = None) -> types.GenerateContentResponse:
+        try:
+            await asyncio.sleep(self._begin(model))
+        finally:
+            # Also reached when a hedged call is cancelled mid-flight.
+            self._end()
+        return self._finish(model, contents, config)
+
+
+class _FakeModels:
+    def __init__(self, client: FakeGenAIClient):
+        self._client = client
+
+    def generate_content(self, *, model: str, contents: Any, config: Optional[types.GenerateContentConfig] = None):
+        return self._client.generate(model, contents, config)
+
+    def generate_content_stream(self, *, model: str, contents: Any, config: Optional[types.GenerateContentConfig] = None) -> Iterator[types.GenerateContentResponse]:
+        """Yields the full response text in a few chunks; only the last one carries usage_metadata."""
+        response = self._client.generate(model, contents, config)
+        text = response.text or ""
+        size = max(1, len(text) // 4)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        for index, piece in enumerate(pieces):
+            last = index == len(pieces) - 1
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=piece)]))],
+                usage_metadata=response.usage_metadata if last else None
+            )
+
+    def get(self, *, model: str, config=None) -> types.Model:
+        return types.Model(name=f"models/{model}")
+
+
+class _FakeAsyncModels:
+    def __init__(self, client: FakeGenAIClient):
+        self._client = client
+
+    async def generate_content(self, *, model: str, contents: Any, config: Optional[types.GenerateContentConfig] = None):
+        return await self._client.generate_async(model, contents, config)
+
+    async def get(self, *, model: str, config=None) -> types.Model:
+        return types.Model(name=f"models/{model}")
+
+
+class _FakeAio:
+    def __init__(self, client: FakeGenAIClient):
+        self.models = _FakeAsyncModels(client)
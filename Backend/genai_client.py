@@ -0,0 +1,198 @@
+import os
+import asyncio
+import threading
+from typing import Optional, AsyncIterator
+
+import httpx
+from google import genai
+from google.genai import types
+from dotenv import load_dotenv
+
+from llm_backend import build_backend
+
+load_dotenv()
+
+
+def _with_pool_timeouts(request: httpx.Request, connect_timeout: float, pool_timeout: float) -> None:
+    request.extensions["timeout"] = {**request.extensions.get("timeout", {}), "connect": connect_timeout, "pool": pool_timeout}
+
+
+class ConnectTimeoutTransport(httpx.HTTPTransport):
+    """
+    Pooled sync transport with its own connect/pool timeouts.
+
+    The genai SDK passes one timeout per request (HttpOptions.timeout) that
+    httpx applies to every phase; this keeps that value as the read/write
+    timeout but fails fast when a connection cannot be opened or borrowed.
+    """
+
+    def __init__(self, connect_timeout: float, pool_timeout: float, **kwargs):
+        super().__init__(**kwargs)
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        _with_pool_timeouts(request, self.connect_timeout, self.pool_timeout)
+        return super().handle_request(request)
+
+
+class ConnectTimeoutAsyncTransport(httpx.AsyncHTTPTransport):
+    """Async counterpart of ConnectTimeoutTransport."""
+
+    def __init__(self, connect_timeout: float, pool_timeout: float, **kwargs):
+        super().__init__(**kwargs)
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _with_pool_timeouts(request, self.connect_timeout, self.pool_timeout)
+        return await super().handle_async_request(request)
+
+
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool_loop_lock = threading.Lock()
+
+
+def _get_pool_loop() -> asyncio.AbstractEventLoop:
+    """The process-wide event loop that owns the async connection pool, started on first use."""
+    global _pool_loop
+    with _pool_loop_lock:
+        if _pool_loop is None:
+            _pool_loop = asyncio.new_event_loop()
+            threading.Thread(target=_pool_loop.run_forever, name="genai-http-loop", daemon=True).start()
+        return _pool_loop
+
+
+async def _on_pool_loop(coroutine):
+    """Runs `coroutine` on the pool loop and awaits it from the caller's loop; cancelling the caller cancels it."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, _get_pool_loop()))
+
+
+async def _next_chunk(chunks: AsyncIterator[bytes]) -> Optional[bytes]:
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class _PoolLoopByteStream(httpx.AsyncByteStream):
+    """Streams a response owned by the pool loop to the caller's loop, one chunk at a time."""
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        chunks = self.response.stream.__aiter__()
+        while True:
+            chunk = await _on_pool_loop(_next_chunk(chunks))
+            if chunk is None:
+                return
+            yield chunk
+
+    async def aclose(self) -> None:
+        await _on_pool_loop(self.response.aclose())
+
+
+class SharedPoolAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    Async transport whose connections live on one long-lived event loop.
+
+    Flask runs each async view (and each background job) on a fresh event loop,
+    and asyncio connections cannot outlive their loop, so a per-call pool would
+    never reuse a keep-alive connection. Instead every request is handed to a
+    real httpx.AsyncHTTPTransport running on a process-wide background loop, and
+    awaited from the caller's loop. Requests are not bound to threads: the
+    number in flight is limited only by the pool's connection limit.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        pool_request = httpx.Request(request.method, request.url, headers=request.headers, content=body,
+                                     extensions=request.extensions)
+        response = await _on_pool_loop(self.transport.handle_async_request(pool_request))
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=_PoolLoopByteStream(response), extensions=response.extensions)
+
+    async def aclose(self) -> None:
+        # The pool belongs to the process-wide loop; closing one async client must not tear it down.
+        pass
+
+
+def build_http_options(connect_timeout: float = 5.0, read_timeout: float = 120.0, pool_timeout: float = 10.0,
+                       max_connections: int = 20, max_keepalive_connections: int = 10,
+                       keepalive_expiry: float = 60.0) -> types.HttpOptions:
+    """
+    HTTP settings for the shared client, with explicit timeouts: one bounded keep-alive
+    pool for sync calls and one, with the same limits, for async calls (see SharedPoolAsyncTransport).
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry
+    )
+    return types.HttpOptions(
+        # Milliseconds; applied per request by the SDK (read/write), connect/pool are overridden by the transports.
+        timeout=int(read_timeout * 1000),
+        client_args={"transport": ConnectTimeoutTransport(connect_timeout, pool_timeout, limits=limits)},
+        async_client_args={"transport": SharedPoolAsyncTransport(ConnectTimeoutAsyncTransport(connect_timeout, pool_timeout, limits=limits))}
+    )
+
+
+_client: Optional[genai.Client] = None
+_client_lock = threading.Lock()
+
+
+def build_live_client() -> genai.Client:
+    """
+    The real Gemini client, tuned with GENAI_CONNECT_TIMEOUT, GENAI_READ_TIMEOUT,
+    GENAI_POOL_TIMEOUT (seconds), GENAI_MAX_CONNECTIONS, GENAI_MAX_KEEPALIVE and GENAI_KEEPALIVE_EXPIRY.
+    """
+    return genai.Client(
+        api_key=os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY", ""),
+        http_options=build_http_options(
+            connect_timeout=float(os.getenv("GENAI_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("GENAI_READ_TIMEOUT", "120")),
+            pool_timeout=float(os.getenv("GENAI_POOL_TIMEOUT", "10")),
+            max_connections=int(os.getenv("GENAI_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("GENAI_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=float(os.getenv("GENAI_KEEPALIVE_EXPIRY", "60"))
+        )
+    )
+
+
+def get_client() -> genai.Client:
+    """
+    Returns the process-wide Gemini client, creating it on first use.
+    LLM_BACKEND selects live (default), record, replay or fake (see llm_backend.build_backend).
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = build_backend(build_live_client)
+        return _client
+
+
+def warm_up(client: genai.Client, model: str = "gemini-2.0-flash") -> bool:
+    """
+    Opens the first pooled TLS connection of the sync and the async pool with a
+    cheap metadata call (no tokens), so the first user request does not pay
+    DNS + TCP + TLS setup.
+    """
+    try:
+        client.models.get(model=model)
+        asyncio.run(client.aio.models.get(model=model))
+        print("[GenAI] Client warmed up.")
+        return True
+    except Exception as e:
+        print(f"[GenAI] Warm-up failed (continuing): {e}")
+        return False
+
+
+def warm_up_in_background(client: genai.Client, model: str = "gemini-2.0-flash") -> threading.Thread:
+    """Runs warm_up() on a daemon thread so startup is never blocked by the network."""
+    thread = threading.Thread(target=warm_up, args=(client, model), name="genai-warmup", daemon=True)
+    thread.start()
+    return thread
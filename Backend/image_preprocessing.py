@@ -0,0 +1,129 @@
+import io
+import threading
+from typing import Dict, Any
+
+from PIL import Image, ImageOps
+
+# Output formats the normalizer can re-encode to, with their mime types.
+OUTPUT_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def format_bytes(size: int) -> str:
+    """Human-readable size for log lines."""
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
+
+class ImageNormalizer:
+    """
+    Preprocessing stage for images sent to Gemini Vision.
+
+    Phone photos of reports and prescriptions are usually far larger than the
+    model needs. Each image is rotated upright from its EXIF orientation,
+    downscaled so its longest side is at most `max_dimension`, optionally
+    converted to grayscale and auto-contrasted (useful for paper documents),
+    and re-encoded at `quality`. When nothing had to change and re-encoding
+    would not make the file smaller (e.g. a small PNG screenshot), the original
+    bytes are kept. Totals across all requests are available from stats().
+    """
+
+    def __init__(self, max_dimension: int = 2048, quality: int = 85, grayscale: bool = False,
+                 autocontrast: bool = False, output_format: str = "JPEG"):
+        output_format = output_format.upper()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.grayscale = grayscale
+        self.autocontrast = autocontrast
+        self.output_format = output_format
+        self._lock = threading.Lock()
+        self._images = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+    def settings(self) -> Dict[str, Any]:
+        """The options that shape the normalized output (anything derived from them must change with them)."""
+        return {
+            "max_dimension": self.max_dimension,
+            "quality": self.quality,
+            "grayscale": self.grayscale,
+            "autocontrast": self.autocontrast,
+            "output_format": self.output_format,
+        }
+
+    def normalize(self, data: bytes, name: str = "image") -> Dict[str, Any]:
+        """
+        Returns {"data", "mime_type", "original_bytes", "normalized_bytes", "bytes_saved", "width", "height"}.
+        Raises if `data` is not a readable image.
+        """
+        with Image.open(io.BytesIO(data)) as original:
+            original.load()
+            original_mime = Image.MIME.get(original.format, "image/jpeg")
+
+            # Orientation 1 is "upright"; anything else needs the pixels rotated before the EXIF is dropped.
+            changed = original.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1
+            image = ImageOps.exif_transpose(original)
+
+            if max(image.size) > self.max_dimension:
+                image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+                changed = True
+
+            if self.grayscale and image.mode != "L":
+                image = image.convert("L")
+                changed = True
+            if self.autocontrast:
+                image = ImageOps.autocontrast(image if image.mode in ("L", "RGB") else image.convert("RGB"), cutoff=1)
+                changed = True
+
+            if image.mode not in ("L", "RGB"):
+                # JPEG has no alpha: flatten transparent scans onto white paper.
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.split()[-1])
+
+            buffer = io.BytesIO()
+            image.save(buffer, format=self.output_format, quality=self.quality, optimize=True)
+            encoded = buffer.getvalue()
+            width, height = image.size
+
+        if changed or len(encoded) < len(data):
+            output, mime_type = encoded, OUTPUT_FORMATS[self.output_format]
+        else:
+            output, mime_type = data, original_mime
+
+        saved = len(data) - len(output)
+        with self._lock:
+            self._images += 1
+            self._bytes_in += len(data)
+            self._bytes_out += len(output)
+
+        print(f"[Image] '{name}' {format_bytes(len(data))} -> {format_bytes(len(output))} "
+              f"({width}x{height}, saved {format_bytes(max(saved, 0))}).")
+        return {
+            "data": output,
+            "mime_type": mime_type,
+            "original_bytes": len(data),
+            "normalized_bytes": len(output),
+            "bytes_saved": saved,
+            "width": width,
+            "height": height
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = self._bytes_in - self._bytes_out
+            return {
+                "images": self._images,
+                "bytes_in": self._bytes_in,
+                "bytes_out": self._bytes_out,
+                "bytes_saved": saved,
+                "saved_ratio": round(saved / self._bytes_in, 4) if self._bytes_in else 0.0,
+                "max_dimension": self.max_dimension,
+                "quality": self.quality,
+                "grayscale": self.grayscale,
+                "autocontrast": self.autocontrast,
+                "output_format": self.output_format
+            }
@@ -0,0 +1,255 @@
+import json
+import uuid
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Callable
+
+from sqlalchemy import or_, and_
+
+from database import db, Job
+
+# A handler receives the job payload and its binary input and returns the result
+# dict. A result with an "error" key fails the job, unless it also has
+# "retryable": True (quota, overload), in which case it is retried like an exception.
+JobHandler = Callable[[Dict[str, Any], Optional[bytes]], Dict[str, Any]]
+
+
+class JobQueue:
+    """
+    Durable background jobs backed by the `jobs` table.
+
+    submit() stores the job (including its uploaded bytes) and returns its id
+    immediately; a pool of worker threads claims queued jobs with a
+    compare-and-set UPDATE, so several workers (or processes sharing the
+    database) never run the same job twice. A claim is a lease: if a worker
+    dies mid-job (process crash, restart), the lease expires and the job is
+    picked up again, up to max_attempts. While a job runs, its worker renews
+    the lease every heartbeat_seconds (a third of the lease by default), so
+    jobs longer than one lease are not taken over. Handler exceptions and
+    retryable error results are retried with a linear backoff; finished jobs
+    keep their result for result_ttl_seconds and are then purged.
+
+    Workers only run after start(), so importing a module that builds the
+    queue (tests, scripts, tooling) does not start claiming jobs.
+    """
+
+    def __init__(self, app, handlers: Dict[str, JobHandler], workers: int = 2, lease_seconds: int = 600,
+                 max_attempts: int = 3, result_ttl_seconds: int = 86400, poll_interval: float = 1.0,
+                 retry_delay_seconds: int = 5, purge_interval_seconds: int = 60, heartbeat_seconds: Optional[float] = None):
+        self.app = app
+        self.handlers = handlers
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds if heartbeat_seconds is not None else lease_seconds / 3
+        self.max_attempts = max_attempts
+        self.result_ttl_seconds = result_ttl_seconds
+        self.poll_interval = poll_interval
+        self.retry_delay_seconds = retry_delay_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._purge_lock = threading.Lock()
+        self._last_purge = datetime.min
+        self.workers = max(1, workers)
+        self._threads = []
+        self._threads_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts the worker threads; calling it again is a no-op."""
+        with self._threads_lock:
+            if self._threads:
+                return
+            self._threads = [
+                threading.Thread(target=self._run, args=(f"job-worker-{uuid.uuid4().hex[:8]}",), name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, kind: str, payload: Dict[str, Any], input_data: Optional[bytes] = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = str(uuid.uuid4())
+        with self.app.app_context():
+            db.session.add(Job(
+                id=job_id,
+                kind=kind,
+                payload=json.dumps(payload),
+                input_data=input_data,
+                max_attempts=self.max_attempts
+            ))
+            db.session.commit()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the job as a dict, or None when it does not exist or its result has expired."""
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            if job is None or (job.expires_at is not None and job.expires_at < datetime.utcnow()):
+                return None
+            return job.to_dict()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Stops the workers. A job still running is left leased and is retried after its lease expires."""
+        self._stopping.set()
+        self._wakeup.set()
+        with self._threads_lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _run(self, worker_id: str) -> None:
+        while not self._stopping.is_set():
+            job = None
+            try:
+                with self.app.app_context():
+                    self._purge_expired_if_due()
+                    job = self._claim(worker_id)
+            except Exception as e:
+                print(f"[JobQueue] {worker_id} failed to claim a job: {e}")
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._execute(worker_id, job)
+
+    def _claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Leases the oldest runnable job: queued and due, or running with an expired lease."""
+        while True:
+            now = datetime.utcnow()
+            candidate = Job.query.filter(or_(
+                and_(Job.status == 'queued', Job.available_at <= now),
+                and_(Job.status == 'running', Job.lease_expires_at < now)
+            )).order_by(Job.available_at).first()
+            if candidate is None:
+                return None
+
+            if candidate.status == 'running' and candidate.attempts >= candidate.max_attempts:
+                # The worker holding it died on the final attempt.
+                Job.query.filter_by(id=candidate.id, status='running', attempts=candidate.attempts).update({
+                    'status': 'failed',
+                    'error': f"Job abandoned after {candidate.attempts} attempts (worker lease expired).",
+                    'input_data': None,
+                    'lease_expires_at': None,
+                    'finished_at': now,
+                    'expires_at': now + timedelta(seconds=self.result_ttl_seconds)
+                }, synchronize_session=False)
+                db.session.commit()
+                continue
+
+            reclaimed_from = candidate.worker_id if candidate.status == 'running' else None
+
+            # Snapshot before the commit expires the instance.
+            job = {
+                "id": candidate.id,
+                "kind": candidate.kind,
+                "payload": json.loads(candidate.payload or '{}'),
+                "input_data": candidate.input_data,
+                "attempts": candidate.attempts + 1,
+                "max_attempts": candidate.max_attempts
+            }
+            claimed = Job.query.filter_by(id=candidate.id, status=candidate.status, attempts=candidate.attempts).update({
+                'status': 'running',
+                'worker_id': worker_id,
+                'attempts': job["attempts"],
+                'lease_expires_at': now + timedelta(seconds=self.lease_seconds),
+                'started_at': now
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed == 1:
+                if reclaimed_from:
+                    print(f"[JobQueue] Reclaimed job {job['id']} from expired worker {reclaimed_from}.")
+                return job
+            # Another worker won the race; look again.
+
+    def _execute(self, worker_id: str, job: Dict[str, Any]) -> None:
+        handler = self.handlers.get(job["kind"])
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(worker_id, job, done), name=f"{worker_id}-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job['kind']}'")
+            result = handler(job["payload"], job["input_data"])
+        except Exception as e:
+            print(f"[JobQueue] Job {job['id']} attempt {job['attempts']} raised: {e}")
+            with self.app.app_context():
+                self._retry_or_fail(worker_id, job, str(e))
+            return
+        finally:
+            done.set()
+            heartbeat.join()
+
+        with self.app.app_context():
+            if "error" in result and result.get("retryable"):
+                print(f"[JobQueue] Job {job['id']} attempt {job['attempts']} failed transiently: {result['error']}")
+                self._retry_or_fail(worker_id, job, result["error"])
+            else:
+                self._finish(worker_id, job, result)
+
+    def _heartbeat(self, worker_id: str, job: Dict[str, Any], done: threading.Event) -> None:
+        """Extends the job's lease until `done` is set; stops if another worker has taken it over."""
+        while not done.wait(self.heartbeat_seconds):
+            try:
+                with self.app.app_context():
+                    renewed = Job.query.filter_by(id=job["id"], status='running', worker_id=worker_id).update({
+                        'lease_expires_at': datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+                    }, synchronize_session=False)
+                    db.session.commit()
+            except Exception as e:
+                print(f"[JobQueue] Failed to renew the lease of job {job['id']}: {e}")
+                continue
+            if renewed != 1:
+                print(f"[JobQueue] Job {job['id']} lease was taken over; heartbeat stopped.")
+                return
+
+    def _finish(self, worker_id: str, job: Dict[str, Any], result: Dict[str, Any]) -> None:
+        now = datetime.utcnow()
+        failed = "error" in result
+        updated = Job.query.filter_by(id=job["id"], status='running', worker_id=worker_id).update({
+            'status': 'failed' if failed else 'succeeded',
+            'result': None if failed else json.dumps(result),
+            'error': result["error"] if failed else None,
+            'input_data': None,
+            'lease_expires_at': None,
+            'finished_at': now,
+            'expires_at': now + timedelta(seconds=self.result_ttl_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+        if updated != 1:
+            print(f"[JobQueue] Job {job['id']} finished after its lease was taken over; result discarded.")
+
+    def _retry_or_fail(self, worker_id: str, job: Dict[str, Any], error: str) -> None:
+        now = datetime.utcnow()
+        if job["attempts"] < job["max_attempts"]:
+            changes = {
+                'status': 'queued',
+                'error': error,
+                'lease_expires_at': None,
+                'available_at': now + timedelta(seconds=self.retry_delay_seconds * job["attempts"])
+            }
+        else:
+            changes = {
+                'status': 'failed',
+                'error': error,
+                'input_data': None,
+                'lease_expires_at': None,
+                'finished_at': now,
+                'expires_at': now + timedelta(seconds=self.result_ttl_seconds)
+            }
+        Job.query.filter_by(id=job["id"], status='running', worker_id=worker_id).update(changes, synchronize_session=False)
+        db.session.commit()
+
+    def _purge_expired_if_due(self) -> None:
+        now = datetime.utcnow()
+        with self._purge_lock:
+            if (now - self._last_purge).total_seconds() < self.purge_interval_seconds:
+                return
+            self._last_purge = now
+        purged = Job.query.filter(Job.expires_at < now).delete(synchronize_session=False)
+        db.session.commit()
+        if purged:
+            print(f"[JobQueue] Purged {purged} expired jobs.")
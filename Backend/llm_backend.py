@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from typing import Optional, Dict, Any, List, Iterator
+
+from google.genai import errors, types
+
+from response_cache import fingerprint
+
+# Values accepted by LLM_BACKEND.
+BACKENDS = ("live", "record", "replay", "fake")
+
+
+def _content_parts(contents: Any) -> List[Any]:
+    """Flattens generate_content `contents` into hashable parts (text, or mime type + raw bytes)."""
+    if contents is None:
+        return []
+    if isinstance(contents, (list, tuple)):
+        return [part for item in contents for part in _content_parts(item)]
+    if isinstance(contents, (str, bytes)):
+        return [contents]
+    if getattr(contents, "parts", None) is not None:
+        return [getattr(contents, "role", None)] + _content_parts(contents.parts)
+    if getattr(contents, "inline_data", None) is not None:
+        return [contents.inline_data.mime_type, contents.inline_data.data]
+    if getattr(contents, "text", None) is not None:
+        return [contents.text]
+    if hasattr(contents, "model_dump"):
+        return [contents.model_dump(mode="json", exclude_none=True)]
+    return [str(contents)]
+
+
+def request_fingerprint(model: str, contents: Any, config: Optional[types.GenerateContentConfig] = None, stream: bool = False) -> str:
+    """
+    Stable key for one generate_content request: model, every content part
+    (uploaded bytes hashed raw) and the generation config, including the JSON
+    schema of a pydantic response_schema.
+    """
+    config_parts = None
+    if config is not None:
+        config_parts = config.model_dump(mode="json", exclude_none=True, exclude={"response_schema", "http_options"})
+        schema = config.response_schema
+        if schema is not None:
+            config_parts["response_schema"] = schema.model_json_schema() if hasattr(schema, "model_json_schema") else str(schema)
+    return fingerprint(model, "stream" if stream else "single", config_parts, *_content_parts(contents))
+
+
+class RecordingStore:
+    """
+    Append-only JSONL file of recorded model responses keyed by request
+    fingerprint. One line per request:
+    {"key", "model", "latency", "response"} or, for streams, {"key", "model", "latency", "chunks"}.
+    The whole file is loaded into memory on start; a later recording of the
+    same request replaces the earlier one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+        print(f"[LLMBackend] {len(self._entries)} recorded responses in '{path}'.")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(key)
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _dump(response: types.GenerateContentResponse) -> Dict[str, Any]:
+    # HTTP headers and the parsed pydantic object are not needed to rebuild the response.
+    return response.model_dump(mode="json", exclude_none=True, exclude={"sdk_http_response", "parsed"})
+
+
+def _load(data: Dict[str, Any]) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse.model_validate(data)
+
+
+class RecordingClient:
+    """
+    Passes every generate_content call (sync, async and streamed) to the live
+    client and stores the response, with its observed latency, under the
+    request fingerprint. Everything else is passed through.
+    """
+
+    def __init__(self, client, store: RecordingStore):
+        self.client = client
+        self.store = store
+        self.models = _RecordingModels(self)
+        self.aio = _RecordingAio(self)
+
+    def _save(self, request: Dict[str, Any], started: float, **recorded) -> None:
+        try:
+            self.store.add({
+                "key": request_fingerprint(request["model"], request.get("contents"), request.get("config"), stream="chunks" in recorded),
+                "model": request["model"],
+                "latency": round(time.monotonic() - started, 4),
+                **recorded
+            })
+        except Exception as e:
+            print(f"[LLMBackend] Failed to record response: {e}")
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class _RecordingModels:
+    def __init__(self, recording: RecordingClient):
+        self._recording = recording
+
+    def generate_content(self, **request):
+        started = time.monotonic()
+        response = self._recording.client.models.generate_content(**request)
+        self._recording._save(request, started, response=_dump(response))
+        return response
+
+    def generate_content_stream(self, **request):
+        started = time.monotonic()
+        chunks = []
+        for chunk in self._recording.client.models.generate_content_stream(**request):
+            chunks.append(_dump(chunk))
+            yield chunk
+        self._recording._save(request, started, chunks=chunks)
+
+    def __getattr__(self, name):
+        return getattr(self._recording.client.models, name)
+
+
+class _RecordingAsyncModels:
+    def __init__(self, recording: RecordingClient):
+        self._recording = recording
+
+    async def generate_content(self, **request):
+        started = time.monotonic()
+        response = await self._recording.client.aio.models.generate_content(**request)
+        self._recording._save(request, started, response=_dump(response))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._recording.client.aio.models, name)
+
+
+class _RecordingAio:
+    def __init__(self, recording: RecordingClient):
+        self._recording = recording
+        self.models = _RecordingAsyncModels(recording)
+
+    def __getattr__(self, name):
+        return getattr(self._recording.client.aio, name)
+
+
+class ReplayClient:
+    """
+    Serves recorded responses without touching the network.
+
+    Each replayed call sleeps for its recorded latency times `latency_scale`,
+    with +/- `latency_jitter` (a fraction) of random variation, so load tests
+    see realistic timings. A request that was never recorded raises a 404
+    ClientError, or is answered by `miss_client` (e.g. a FakeGenAIClient) when
+    one is given. Hit and miss counts are kept in `hits` and `misses`.
+    """
+
+    def __init__(self, store: RecordingStore, latency_scale: float = 1.0, latency_jitter: float = 0.2,
+                 miss_client=None, seed: Optional[int] = None):
+        self.store = store
+        self.latency_scale = latency_scale
+        self.latency_jitter = latency_jitter
+        self.miss_client = miss_client
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.models = _ReplayModels(self)
+        self.aio = _ReplayAio(self)
+
+    def _lookup(self, request: Dict[str, Any], stream: bool = False) -> Optional[Dict[str, Any]]:
+        entry = self.store.get(request_fingerprint(request["model"], request.get("contents"), request.get("config"), stream=stream))
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                if self.miss_client is None:
+                    raise errors.ClientError(404, {"error": {"code": 404, "status": "NOT_FOUND",
+                                                             "message": f"No recorded response for this {request['model']} request (LLM_BACKEND=replay)."}})
+            else:
+                self.hits += 1
+            return entry
+
+    def _delay(self, entry: Dict[str, Any]) -> float:
+        with self._lock:
+            variation = self._random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter)
+        return max(0.0, entry.get("latency", 0.0) * self.latency_scale * variation)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"recorded": len(self.store), "hits": self.hits, "misses": self.misses}
+
+
+class _ReplayModels:
+    def __init__(self, replay: ReplayClient):
+        self._replay = replay
+
+    def generate_content(self, **request):
+        entry = self._replay._lookup(request)
+        if entry is None:
+            return self._replay.miss_client.models.generate_content(**request)
+        time.sleep(self._replay._delay(entry))
+        return _load(entry["response"])
+
+    def generate_content_stream(self, **request) -> Iterator[types.GenerateContentResponse]:
+        entry = self._replay._lookup(request, stream=True)
+        if entry is None:
+            yield from self._replay.miss_client.models.generate_content_stream(**request)
+            return
+        chunks = entry["chunks"]
+        # Spread the recorded latency over the chunks, as the live stream did.
+        delay = self._replay._delay(entry) / max(1, len(chunks))
+        for chunk in chunks:
+            time.sleep(delay)
+            yield _load(chunk)
+
+    def get(self, *, model: str, config=None) -> types.Model:
+        return types.Model(name=f"models/{model}")
+
+
+class _ReplayAsyncModels:
+    def __init__(self, replay: ReplayClient):
+        self._replay = replay
+
+    async def generate_content(self, **request):
+        entry = self._replay._lookup(request)
+        if entry is None:
+            return await self._replay.miss_client.aio.models.generate_content(**request)
+        await asyncio.sleep(self._replay._delay(entry))
+        return _load(entry["response"])
+
+    async def get(self, *, model: str, config=None) -> types.Model:
+        return types.Model(name=f"models/{model}")
+
+
+class _ReplayAio:
+    def __init__(self, replay: ReplayClient):
+        self.models = _ReplayAsyncModels(replay)
+
+
+def build_backend(live_client_factory, backend: Optional[str] = None):
+    """
+    Returns the client selected by LLM_BACKEND:
+      live   - the real Gemini client (default)
+      record - the real client, saving every response to LLM_RECORDINGS_PATH
+      replay - recorded responses only, with LLM_REPLAY_LATENCY_SCALE applied to the
+               recorded latencies; misses fall back to the fake backend when
+               LLM_REPLAY_MISS=fake, otherwise they fail with a 404
+      fake   - fake_llm.FakeGenAIClient with lognormal latency (median LLM_FAKE_LATENCY seconds)
+    `live_client_factory` is only called for live and record.
+    """
+    backend = (backend or os.getenv("LLM_BACKEND", "live")).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{backend}' (expected one of {', '.join(BACKENDS)})")
+
+    recordings_path = os.getenv("LLM_RECORDINGS_PATH", os.path.join(os.path.dirname(__file__), "recordings", "llm_responses.jsonl"))
+    if backend == "live":
+        return live_client_factory()
+    if backend == "record":
+        return RecordingClient(live_client_factory(), RecordingStore(recordings_path))
+
+    from fake_llm import FakeGenAIClient, lognormal_latency
+    fake = FakeGenAIClient(latency=lognormal_latency(float(os.getenv("LLM_FAKE_LATENCY", "1.0")), 0.4))
+    if backend == "fake":
+        return fake
+    return ReplayClient(
+        RecordingStore(recordings_path),
+        latency_scale=float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0")),
+        miss_client=fake if os.getenv("LLM_REPLAY_MISS", "error").lower() == "fake" else None
+    )
@@ -0,0 +1,522 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator, List, Callable
+
+import httpx
+from google.genai import errors
+
+# Lower rank is served first when callers are waiting for quota.
+PRIORITIES = {"interactive": 0, "standard": 1, "batch": 2}
+
+# HTTP status codes worth retrying: quota, timeouts and transient server errors.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Rough input-token estimate used before the call; corrected from usage_metadata afterwards.
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MEDIA_PART = 258
+DEFAULT_OUTPUT_TOKENS = 512
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the model while a model's circuit breaker is open."""
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+def is_transient_failure(error: Exception) -> bool:
+    """True for failures worth retrying later: quota, overload, timeouts or an open breaker."""
+    return is_retryable(error) or isinstance(error, CircuitOpenError)
+
+
+# LLM call failures caught by the agents, for the request being handled (see track_llm_failures).
+_llm_failures: contextvars.ContextVar[Optional[List[Exception]]] = contextvars.ContextVar("llm_failures", default=None)
+
+
+@contextmanager
+def track_llm_failures():
+    """
+    Collects, into the yielded list, the exceptions agents caught from LLM calls
+    while the block runs. Agents turn failures into error strings; this keeps the
+    exceptions, so callers classify a failed result by its status code rather
+    than by its message. asyncio tasks and threads started inside report too.
+    """
+    failures: List[Exception] = []
+    token = _llm_failures.set(failures)
+    try:
+        yield failures
+    finally:
+        _llm_failures.reset(token)
+
+
+def note_llm_failure(error: Exception) -> None:
+    """Reports an LLM call failure to the enclosing track_llm_failures() block, if any."""
+    failures = _llm_failures.get()
+    if failures is not None:
+        failures.append(error)
+
+
+def estimate_tokens(contents: Any) -> int:
+    """Estimates prompt tokens from text length and the number of media parts."""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return len(contents) // CHARS_PER_TOKEN + 1
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(item) for item in contents)
+    if getattr(contents, "text", None):
+        return len(contents.text) // CHARS_PER_TOKEN + 1
+    if getattr(contents, "inline_data", None) is not None or getattr(contents, "file_data", None) is not None:
+        return TOKENS_PER_MEDIA_PART
+    if getattr(contents, "parts", None):
+        return estimate_tokens(contents.parts)
+    return 0
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled continuously at capacity per `period` seconds."""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they already are)."""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker: opens after `failure_threshold` consecutive retryable
+    failures, fails fast for `reset_timeout` seconds, then lets exactly one
+    trial call through (half-open) and closes again on success. Other callers
+    keep failing fast while the trial is in flight.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.trial_in_flight = False
+
+    def allow(self, now: float) -> bool:
+        """Whether a caller may wait for admission; call start() once it is admitted."""
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open":
+            return not self.trial_in_flight
+        return self.state == "closed"
+
+    def start(self) -> None:
+        if self.state == "half_open":
+            self.trial_in_flight = True
+
+    def release_trial(self) -> None:
+        """The trial ended without telling anything about the model (cancelled, or a non-retryable error)."""
+        self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = now
+
+
+class ModelLimiter:
+    """Request and token buckets plus the circuit breaker for one model."""
+
+    def __init__(self, rpm: int, tpm: int, breaker: CircuitBreaker):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.breaker = breaker
+        self.waiters: List[tuple] = []
+        # Wakes the caller holding a ticket; only the head of `waiters` is ever woken.
+        self.wakers: Dict[tuple, Callable[[], None]] = {}
+
+    def wake_head(self) -> None:
+        if self.waiters:
+            self.wakers[self.waiters[0]]()
+
+
+class LLMScheduler:
+    """
+    Central gate for every generate_content call.
+
+    Each model has a requests-per-minute and a tokens-per-minute token bucket.
+    Callers that cannot be served immediately wait in a per-model priority
+    queue (interactive before standard before batch, FIFO within a class), so
+    under quota pressure symptom checks overtake batch report extraction.
+    Retryable failures (429, 5xx, timeouts) are retried with exponential
+    backoff and full jitter; repeated failures open the model's circuit
+    breaker so callers fail fast instead of piling onto an exhausted quota.
+    Sync and async callers share the same buckets and queues. Only the head of
+    a queue watches the buckets; the others sleep until the head changes.
+    """
+
+    def __init__(self, default_rpm: int = 1000, default_tpm: int = 1_000_000, model_limits: Optional[Dict[str, Dict[str, int]]] = None,
+                 max_retries: int = 4, base_backoff: float = 0.5, max_backoff: float = 20.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, output_tokens: int = DEFAULT_OUTPUT_TOKENS):
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.model_limits = model_limits or {}
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.output_tokens = output_tokens
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._stats = {"calls": 0, "retries": 0, "failures": 0, "rejected_open_circuit": 0, "throttled_seconds": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        """
+        LLM_DEFAULT_RPM / LLM_DEFAULT_TPM set the default limits; LLM_MODEL_LIMITS
+        overrides them per model as "model=rpm:tpm,model=rpm:tpm".
+        """
+        model_limits = {}
+        for entry in filter(None, (item.strip() for item in os.getenv("LLM_MODEL_LIMITS", "").split(","))):
+            model, _, limits = entry.partition("=")
+            rpm, _, tpm = limits.partition(":")
+            model_limits[model.strip()] = {"rpm": int(rpm), **({"tpm": int(tpm)} if tpm else {})}
+        return cls(
+            default_rpm=int(os.getenv("LLM_DEFAULT_RPM", "1000")),
+            default_tpm=int(os.getenv("LLM_DEFAULT_TPM", "1000000")),
+            model_limits=model_limits,
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+            base_backoff=float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+            max_backoff=float(os.getenv("LLM_BACKOFF_MAX", "20")),
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+        )
+
+    def _limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limits = self.model_limits.get(model, {})
+            limiter = ModelLimiter(
+                limits.get("rpm", self.default_rpm),
+                limits.get("tpm", self.default_tpm),
+                CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            )
+            self._limiters[model] = limiter
+        return limiter
+
+    # --- Admission -----------------------------------------------------------
+
+    def _enqueue(self, model: str, priority: str, waker: Callable[[], None]) -> tuple:
+        ticket = (PRIORITIES.get(priority, PRIORITIES["standard"]), next(self._sequence))
+        with self._lock:
+            limiter = self._limiter(model)
+            heapq.heappush(limiter.waiters, ticket)
+            limiter.wakers[ticket] = waker
+        return ticket
+
+    def _dequeue(self, model: str, ticket: tuple) -> None:
+        with self._lock:
+            limiter = self._limiter(model)
+            limiter.wakers.pop(ticket, None)
+            if ticket in limiter.waiters:
+                was_head = limiter.waiters[0] == ticket
+                limiter.waiters.remove(ticket)
+                heapq.heapify(limiter.waiters)
+                if was_head:
+                    limiter.wake_head()
+
+    def _try_admit(self, model: str, ticket: tuple, tokens: int) -> Optional[float]:
+        """
+        Takes quota for the ticket and returns 0, returns how long the head of the
+        queue should wait for the buckets, or None when another caller is ahead
+        (wait to be woken: the head changes only through admission or _dequeue).
+        """
+        with self._lock:
+            limiter = self._limiter(model)
+            now = time.monotonic()
+            if not limiter.breaker.allow(now):
+                self._stats["rejected_open_circuit"] += 1
+                raise CircuitOpenError(f"Circuit open for model '{model}' after repeated failures; retry later.")
+
+            if limiter.waiters[0] != ticket:
+                # Someone with higher priority (or earlier in the same class) goes first.
+                return None
+
+            limiter.requests.refill(now)
+            limiter.tokens.refill(now)
+            wait = max(limiter.requests.wait_time(1), limiter.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+
+            limiter.requests.tokens -= 1
+            limiter.tokens.tokens -= min(tokens, limiter.tokens.capacity)
+            heapq.heappop(limiter.waiters)
+            limiter.wakers.pop(ticket, None)
+            limiter.breaker.start()
+            limiter.wake_head()
+            return 0.0
+
+    def _acquire(self, model: str, priority: str, tokens: int) -> None:
+        woken = threading.Event()
+        ticket = self._enqueue(model, priority, woken.set)
+        started = time.monotonic()
+        try:
+            while True:
+                woken.clear()
+                wait = self._try_admit(model, ticket, tokens)
+                if wait == 0:
+                    break
+                woken.wait(None if wait is None else min(wait, 1.0))
+        finally:
+            self._dequeue(model, ticket)
+        self._record_throttle(started)
+
+    async def _acquire_async(self, model: str, priority: str, tokens: int) -> None:
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake() -> None:
+            try:
+                loop.call_soon_threadsafe(woken.set)
+            except RuntimeError:
+                pass  # The caller's loop is already closed.
+
+        ticket = self._enqueue(model, priority, wake)
+        started = time.monotonic()
+        try:
+            while True:
+                woken.clear()
+                wait = self._try_admit(model, ticket, tokens)
+                if wait == 0:
+                    break
+                try:
+                    await asyncio.wait_for(woken.wait(), None if wait is None else min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._dequeue(model, ticket)
+        self._record_throttle(started)
+
+    def _record_throttle(self, started: float) -> None:
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["throttled_seconds"] += time.monotonic() - started
+
+    # --- Outcome bookkeeping -------------------------------------------------
+
+    def _settle(self, model: str, estimated: int, response: Any) -> None:
+        """Corrects the token bucket with the real usage reported by the API."""
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None) if usage is not None else None
+        with self._lock:
+            limiter = self._limiter(model)
+            limiter.breaker.record_success()
+            if actual:
+                limiter.tokens.tokens -= actual - estimated
+
+    def _failed(self, model: str, error: Exception, attempt: int) -> Optional[float]:
+        """Records a failure; returns the backoff before the next attempt, or None to give up."""
+        retryable = is_retryable(error)
+        with self._lock:
+            if retryable:
+                limiter = self._limiter(model)
+                was_open = limiter.breaker.state == "open"
+                limiter.breaker.record_failure(time.monotonic())
+                if not was_open and limiter.breaker.state == "open":
+                    # Queued callers fail fast: the head raises CircuitOpenError and wakes the next.
+                    limiter.wake_head()
+            else:
+                self._limiter(model).breaker.release_trial()
+            if not retryable or attempt >= self.max_retries:
+                self._stats["failures"] += 1
+                return None
+            self._stats["retries"] += 1
+        backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+        print(f"[LLMScheduler] {model} attempt {attempt + 1} failed ({error}); retrying in {backoff:.2f}s.")
+        return backoff
+
+    def _abandoned(self, model: str) -> None:
+        """A call ended without an outcome (cancelled hedge, closed stream); frees the half-open trial slot."""
+        with self._lock:
+            self._limiter(model).breaker.release_trial()
+
+    def _estimate(self, request: Dict[str, Any]) -> int:
+        return estimate_tokens(request.get("contents")) + self.output_tokens
+
+    # --- Entry points ----------------------------------------------------------
+
+    def generate(self, client, priority: str = "standard", **request) -> Any:
+        model = request["model"]
+        estimated = self._estimate(request)
+        attempt = 0
+        while True:
+            self._acquire(model, priority, estimated)
+            try:
+                response = client.models.generate_content(**request)
+            except Exception as e:
+                backoff = self._failed(model, e, attempt)
+                if backoff is None:
+                    raise
+                time.sleep(backoff)
+                attempt += 1
+                continue
+            except BaseException:
+                self._abandoned(model)
+                raise
+            self._settle(model, estimated, response)
+            return response
+
+    async def generate_async(self, client, priority: str = "standard", **request) -> Any:
+        model = request["model"]
+        estimated = self._estimate(request)
+        attempt = 0
+        while True:
+            await self._acquire_async(model, priority, estimated)
+            try:
+                response = await client.aio.models.generate_content(**request)
+            except Exception as e:
+                backoff = self._failed(model, e, attempt)
+                if backoff is None:
+                    raise
+                await asyncio.sleep(backoff)
+                attempt += 1
+                continue
+            except BaseException:
+                self._abandoned(model)
+                raise
+            self._settle(model, estimated, response)
+            return response
+
+    def generate_stream(self, client, priority: str = "standard", **request) -> Iterator[Any]:
+        """Streams chunks; only failures before the first chunk are retried (later ones would duplicate output)."""
+        model = request["model"]
+        estimated = self._estimate(request)
+        attempt = 0
+        while True:
+            self._acquire(model, priority, estimated)
+            started = False
+            last = None
+            try:
+                for chunk in client.models.generate_content_stream(**request):
+                    started = True
+                    last = chunk
+                    yield chunk
+            except Exception as e:
+                if started:
+                    self._abandoned(model)
+                    raise
+                backoff = self._failed(model, e, attempt)
+                if backoff is None:
+                    raise
+                time.sleep(backoff)
+                attempt += 1
+                continue
+            except BaseException:
+                self._abandoned(model)
+                raise
+            self._settle(model, estimated, last)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            models = {}
+            for model, limiter in self._limiters.items():
+                limiter.requests.refill(now)
+                limiter.tokens.refill(now)
+                models[model] = {
+                    "rpm_limit": int(limiter.requests.capacity),
+                    "tpm_limit": int(limiter.tokens.capacity),
+                    "requests_available": round(limiter.requests.tokens, 2),
+                    "tokens_available": round(limiter.tokens.tokens),
+                    "waiting": len(limiter.waiters),
+                    "circuit": limiter.breaker.state,
+                    "circuit_trial_in_flight": limiter.breaker.trial_in_flight,
+                    "circuit_trips": limiter.breaker.trips
+                }
+            return {**self._stats, "throttled_seconds": round(self._stats["throttled_seconds"], 3), "models": models}
+
+
+class _ScheduledModels:
+    def __init__(self, scheduled: "ScheduledClient"):
+        self._scheduled = scheduled
+
+    def generate_content(self, **request):
+        return self._scheduled.scheduler.generate(self._scheduled.client, self._scheduled.priority, **request)
+
+    def generate_content_stream(self, **request):
+        return self._scheduled.scheduler.generate_stream(self._scheduled.client, self._scheduled.priority, **request)
+
+    def __getattr__(self, name):
+        return getattr(self._scheduled.client.models, name)
+
+
+class _ScheduledAsyncModels:
+    def __init__(self, scheduled: "ScheduledClient"):
+        self._scheduled = scheduled
+
+    async def generate_content(self, **request):
+        return await self._scheduled.scheduler.generate_async(self._scheduled.client, self._scheduled.priority, **request)
+
+    def __getattr__(self, name):
+        return getattr(self._scheduled.client.aio.models, name)
+
+
+class _ScheduledAio:
+    def __init__(self, scheduled: "ScheduledClient"):
+        self._scheduled = scheduled
+        self.models = _ScheduledAsyncModels(scheduled)
+
+    def __getattr__(self, name):
+        return getattr(self._scheduled.client.aio, name)
+
+
+class ScheduledClient:
+    """
+    Drop-in stand-in for genai.Client that routes client.models.generate_content,
+    client.models.generate_content_stream and client.aio.models.generate_content
+    through an LLMScheduler with a fixed priority class. Everything else is
+    passed through to the wrapped client.
+    """
+
+    def __init__(self, client, scheduler: LLMScheduler, priority: str = "standard"):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        self.client = client
+        self.scheduler = scheduler
+        self.priority = priority
+        self.models = _ScheduledModels(self)
+        self.aio = _ScheduledAio(self)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,175 @@
+import re
+import math
+import zlib
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple, Iterable
+
+import numpy as np
+from scipy import sparse
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def hashed_features(text: str, n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hashes word unigrams and bigrams into n_features buckets.
+    Returns (feature indices, sublinear term frequencies). crc32 keeps the
+    hashing stable across processes, unlike the builtin hash().
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    counts = Counter(zlib.crc32(gram.encode("utf-8")) % n_features for gram in grams)
+    if not counts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    tf = np.fromiter((1.0 + math.log(c) for c in counts.values()), dtype=np.float64, count=len(counts))
+    return indices, tf
+
+
+class TfidfMemoryIndex:
+    """
+    In-process TF-IDF index over one user's memories.
+
+    Terms are hashed into n_features buckets, and each bucket the user's
+    memories actually contain gets a column, so the matrix, the document
+    frequencies and the IDF weights are sized by the user's vocabulary rather
+    than by n_features. Rows are sublinear term-frequency vectors stacked into
+    a SciPy CSR matrix and IDF weights are applied at query time, so adding or
+    removing a memory only touches its own row and the df counts. IDF weights,
+    row norms and a column-major copy are refreshed once after writes; a query
+    then only touches the columns of its own terms plus one argpartition for
+    the top k.
+    """
+
+    def __init__(self, n_features: int = 2 ** 18):
+        self.n_features = n_features
+        self._columns_of: Dict[int, int] = {}
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float64)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self._df = np.zeros(64, dtype=np.float64)
+        self._pending: List[Tuple[int, np.ndarray, np.ndarray]] = []
+        self._row_of = {}
+        self._live_docs = 0
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._columns = None
+        self._idf = None
+        self._doc_norms = None
+
+    def __len__(self) -> int:
+        return self._live_docs
+
+    def _columns_for(self, buckets: np.ndarray) -> np.ndarray:
+        """Maps hash buckets to matrix columns, giving unseen buckets the next free ones."""
+        columns = np.fromiter((self._columns_of.setdefault(int(b), len(self._columns_of)) for b in buckets),
+                              dtype=np.int64, count=len(buckets))
+        if len(self._columns_of) > len(self._df):
+            self._df = np.concatenate([self._df, np.zeros(max(len(self._df), len(self._columns_of) - len(self._df)))])
+        return columns
+
+    def add(self, memory_id: int, text: str) -> None:
+        buckets, tf = hashed_features(text, self.n_features)
+        with self._lock:
+            if memory_id in self._row_of:
+                self._remove_locked(memory_id)
+            indices = self._columns_for(buckets)
+            self._pending.append((memory_id, indices, tf))
+            self._row_of[memory_id] = None
+            self._df[indices] += 1
+            self._live_docs += 1
+            self._dirty = True
+
+    def add_many(self, rows: Iterable[Tuple[int, str]]) -> None:
+        for memory_id, text in rows:
+            self.add(memory_id, text)
+
+    def remove(self, memory_id: int) -> bool:
+        with self._lock:
+            return self._remove_locked(memory_id)
+
+    def _remove_locked(self, memory_id: int) -> bool:
+        if memory_id not in self._row_of:
+            return False
+        row = self._row_of.pop(memory_id)
+        if row is None:
+            # Still pending: drop it before it ever reaches the matrix.
+            for i, (pending_id, indices, _) in enumerate(self._pending):
+                if pending_id == memory_id:
+                    self._df[indices] -= 1
+                    del self._pending[i]
+                    break
+        else:
+            self._alive[row] = False
+            start, end = self._matrix.indptr[row], self._matrix.indptr[row + 1]
+            self._df[self._matrix.indices[start:end]] -= 1
+        self._live_docs -= 1
+        self._dirty = True
+        return True
+
+    def _flush_pending(self) -> None:
+        """Appends pending rows in one vstack and compacts once most rows are dead."""
+        n_columns = len(self._columns_of)
+        if self._matrix.shape[1] < n_columns:
+            self._matrix.resize((self._matrix.shape[0], n_columns))
+        if self._pending:
+            indptr = np.zeros(len(self._pending) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(indices) for _, indices, _ in self._pending])
+            block = sparse.csr_matrix(
+                (
+                    np.concatenate([tf for _, _, tf in self._pending]),
+                    np.concatenate([indices for _, indices, _ in self._pending]),
+                    indptr
+                ),
+                shape=(len(self._pending), n_columns)
+            )
+            first_row = self._matrix.shape[0]
+            self._matrix = sparse.vstack([self._matrix, block], format="csr")
+            new_ids = np.fromiter((memory_id for memory_id, _, _ in self._pending), dtype=np.int64, count=len(self._pending))
+            self._ids = np.concatenate([self._ids, new_ids])
+            self._alive = np.concatenate([self._alive, np.ones(len(self._pending), dtype=bool)])
+            for offset, memory_id in enumerate(new_ids):
+                self._row_of[int(memory_id)] = first_row + offset
+            self._pending = []
+
+        dead = len(self._alive) - self._live_docs
+        if dead > 64 and dead > self._live_docs:
+            keep = np.flatnonzero(self._alive)
+            self._matrix = self._matrix[keep]
+            self._ids = self._ids[keep]
+            self._alive = np.ones(len(keep), dtype=bool)
+            self._row_of = {int(memory_id): row for row, memory_id in enumerate(self._ids)}
+
+    def _refresh(self) -> None:
+        """Recomputes IDF, IDF-weighted row norms and the CSC copy after writes."""
+        self._flush_pending()
+        self._idf = np.log((1.0 + self._live_docs) / (1.0 + self._df[:self._matrix.shape[1]])) + 1.0
+        self._doc_norms = np.sqrt(self._matrix.power(2) @ (self._idf ** 2))
+        self._doc_norms[~self._alive] = 0.0
+        self._columns = self._matrix.tocsc()
+        self._dirty = False
+
+    def query(self, text: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Returns up to k (memory_id, cosine score) pairs, best first, with score > 0."""
+        q_buckets, q_tf = hashed_features(text, self.n_features)
+        with self._lock:
+            if self._dirty:
+                self._refresh()
+            if self._live_docs == 0 or len(q_buckets) == 0:
+                return []
+
+            # Terms no memory contains have df 0: they add to the query norm but match no column.
+            q_indices = np.fromiter((self._columns_of.get(int(b), -1) for b in q_buckets), dtype=np.int64, count=len(q_buckets))
+            known = q_indices >= 0
+            q_idf = np.full(len(q_indices), math.log(1.0 + self._live_docs) + 1.0)
+            q_idf[known] = self._idf[q_indices[known]]
+            q_norm = np.sqrt(np.sum((q_tf * q_idf) ** 2))
+            dots = self._columns[:, q_indices[known]] @ (q_tf[known] * q_idf[known] ** 2)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scores = np.where(self._doc_norms > 0, dots / (self._doc_norms * q_norm), 0.0)
+
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(self._ids[row]), float(scores[row])) for row in top if scores[row] > 0]
@@ -1,12 +1,60 @@
+import re
 import json
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
+from flask import current_app
+from sqlalchemy import text
+
 from database import db, Memory, Session, Event
+from memory_index import TfidfMemoryIndex
 
 class DatabaseMemoryService:
-    def __init__(self, app_name: str = "medical_agent"):
+    """
+    Long-term memory storage and retrieval.
+
+    retrieval="fts" ranks with the SQLite FTS5 index (BM25); retrieval="tfidf"
+    ranks with an in-process hashed TF-IDF index per user, built lazily on the
+    first search and updated by add/delete through this service. At most
+    `max_tfidf_users` indexes are kept, least recently used first out; an
+    evicted user's index is rebuilt from the database on their next search.
+    The TF-IDF indexes are per process, so writes made by other processes are
+    not seen until the index is rebuilt.
+    """
+
+    def __init__(self, app_name: str = "medical_agent", retrieval: str = "fts", max_tfidf_users: int = 256):
+        if retrieval not in ("fts", "tfidf"):
+            raise ValueError(f"Unsupported retrieval mode: {retrieval}")
         self.app_name = app_name
+        self.retrieval = retrieval
+        self.max_tfidf_users = max_tfidf_users
+        self._tfidf_indexes: "OrderedDict[str, TfidfMemoryIndex]" = OrderedDict()
+        self._tfidf_lock = threading.Lock()
+
+    def _get_tfidf_index(self, user_id: str) -> TfidfMemoryIndex:
+        with self._tfidf_lock:
+            index = self._tfidf_indexes.get(user_id)
+            if index is None:
+                index = TfidfMemoryIndex()
+                rows = db.session.query(Memory.id, Memory.content).filter_by(app_name=self.app_name, user_id=user_id)
+                index.add_many(rows)
+                self._tfidf_indexes[user_id] = index
+                while len(self._tfidf_indexes) > self.max_tfidf_users:
+                    self._tfidf_indexes.popitem(last=False)
+            else:
+                self._tfidf_indexes.move_to_end(user_id)
+            return index
+
+    def _cached_tfidf_index(self, user_id: str) -> Optional[TfidfMemoryIndex]:
+        with self._tfidf_lock:
+            return self._tfidf_indexes.get(user_id)
+
+    def _index_memory(self, memory: Memory) -> None:
+        index = self._cached_tfidf_index(memory.user_id)
+        if index is not None:
+            index.add(memory.id, memory.content)
     
     def add_memory(self, user_id: str, content: str, memory_type: str = "general", source_session_id: Optional[str] = None) -> Memory:
         memory = Memory(
@@ -18,6 +66,7 @@ class DatabaseMemoryService:
         )
         db.session.add(memory)
         db.session.commit()
+        self._index_memory(memory)
         return memory
     
     def add_session_to_memory(self, user_id: str, session_id: str, summary: Optional[str] = None) -> Optional[Memory]:
@@ -25,7 +74,7 @@ class DatabaseMemoryService:
         if not session:
             return None
         
-        events = Event.query.filter_by(session_id=session_id).order_by(Event.timestamp).all()
+        events = Event.query.filter_by(session_id=session_id).order_by(Event.timestamp, Event.id).all()
         if not events:
             return None
         
@@ -46,9 +95,47 @@ class DatabaseMemoryService:
         )
         db.session.add(memory)
         db.session.commit()
+        self._index_memory(memory)
         return memory
     
     def search_memories(self, user_id: str, query: str, limit: int = 5) -> List[Memory]:
+        if self.retrieval == "tfidf":
+            return self._search_tfidf(user_id, query, limit)
+        if current_app.config.get('MEMORY_FTS_ENABLED'):
+            return self._search_fts(user_id, query, limit)
+        return self._search_scan(user_id, query, limit)
+
+    def _search_fts(self, user_id: str, query: str, limit: int) -> List[Memory]:
+        """BM25-ranked search on the memories_fts index, with filtering and the limit done in SQL."""
+        terms = re.findall(r"\w+", query.lower())
+        if not terms:
+            return []
+        # Prefix-match every term so partial words still hit, like the substring scan did.
+        match = " OR ".join(f'"{term}"*' for term in terms)
+
+        statement = text("""
+            SELECT memories.* FROM memories_fts
+            JOIN memories ON memories.id = memories_fts.rowid
+            WHERE memories_fts MATCH :match
+              AND memories.app_name = :app_name
+              AND memories.user_id = :user_id
+            ORDER BY memories_fts.rank
+            LIMIT :limit
+        """)
+        return db.session.query(Memory).from_statement(statement).params(
+            match=match, app_name=self.app_name, user_id=user_id, limit=limit
+        ).all()
+
+    def _search_tfidf(self, user_id: str, query: str, limit: int) -> List[Memory]:
+        """Cosine top-k over the user's TF-IDF matrix, then one query to load the winning rows."""
+        ranked_ids = [memory_id for memory_id, _ in self._get_tfidf_index(user_id).query(query, limit)]
+        if not ranked_ids:
+            return []
+        by_id = {m.id: m for m in Memory.query.filter(Memory.id.in_(ranked_ids)).all()}
+        return [by_id[memory_id] for memory_id in ranked_ids if memory_id in by_id]
+
+    def _search_scan(self, user_id: str, query: str, limit: int) -> List[Memory]:
+        """Fallback for databases without FTS5: keyword counts over every memory of the user."""
         query_lower = query.lower()
         keywords = query_lower.split()
         
@@ -75,6 +162,9 @@ class DatabaseMemoryService:
         if memory:
             db.session.delete(memory)
             db.session.commit()
+            index = self._cached_tfidf_index(user_id)
+            if index is not None:
+                index.remove(memory_id)
             return True
         return False
     
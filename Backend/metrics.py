@@ -0,0 +1,388 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple, Callable, Sequence
+
+from tracing import tracer
+from model_router import RoutedClient
+
+# Latency buckets (seconds) wide enough for both DB queries and multi-minute LLM calls.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels (Prometheus `counter`)."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (Prometheus `histogram`)."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return series[-1] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    """Values read at scrape time from `callback() -> {label values tuple: value}` (for existing stats() counters)."""
+
+    def __init__(self, name: str, help_text: str, metric_type: str, labelnames: Sequence[str], callback: Callable[[], Dict[Tuple, float]]):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"[Metrics] Failed to collect {self.name}: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name: str, help_text: str, metric_type: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple, float]]) -> CallbackMetric:
+        with self._lock:
+            # Re-registering replaces the callback (e.g. the app module imported twice).
+            self._metrics.pop(name, None)
+        return self._register(CallbackMetric(name, help_text, metric_type, labelnames, callback))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Time to produce the response (time to first byte for streamed routes).",
+    ["route", "method", "status"])
+STAGE_DURATION = registry.histogram(
+    "stage_duration_seconds", "Time spent in a processing stage (upload read, document loading).", ["stage"])
+LLM_CALL_DURATION = registry.histogram(
+    "llm_call_duration_seconds", "LLM call latency as seen by the agent, including queueing, retries and hedging.",
+    ["agent", "model", "priority", "outcome"])
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "LLM tokens from usage_metadata; direction is input, output or thinking.", ["agent", "model", "direction"])
+LOADER_PATHS = registry.counter(
+    "document_loader_path_total", "Documents handled by SmartLoader, by path taken.", ["path"])
+PROMPT_TOKENS = registry.counter(
+    "prompt_tokens_total", "Estimated tokens of the agents' prompt input, as built (raw) and as sent after compaction and budgeting.",
+    ["agent", "stage"])
+PROMPT_TRUNCATIONS = registry.counter(
+    "prompt_truncations_total", "Prompts whose input was shortened to fit the agent's token budget.", ["agent"])
+DB_QUERY_DURATION = registry.histogram(
+    "db_query_duration_seconds", "SQLAlchemy query duration by statement type.", ["statement"])
+DB_QUERIES_PER_REQUEST = registry.histogram(
+    "db_queries_per_request", "Number of SQLAlchemy queries run while serving one request.", ["route"], buckets=COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = registry.histogram(
+    "db_time_per_request_seconds", "Total SQLAlchemy query time while serving one request.", ["route"])
+
+
+@contextmanager
+def track_stage(stage: str, **attributes):
+    """Times a stage into stage_duration_seconds and records it as a trace span (yielded for annotations)."""
+    with STAGE_DURATION.time(stage=stage), tracer.span(stage, **attributes) as span:
+        yield span
+
+
+# --- Per-request DB accounting -------------------------------------------------
+
+# Set for the duration of a request; worker threads started with asyncio.to_thread
+# inherit the context, so their queries count towards the request as well.
+_request_db: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_db", default=None)
+
+
+def _statement_type(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+
+def instrument_sqlalchemy(engine) -> None:
+    """Times every query on `engine` and adds it to the current request's totals."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_DURATION.observe(elapsed, statement=_statement_type(statement))
+        totals = _request_db.get()
+        if totals is not None:
+            totals["queries"] += 1
+            totals["seconds"] += elapsed
+
+
+def instrument_app(app, engine) -> None:
+    """Records per-route latency and per-request DB totals for every Flask request."""
+    from flask import g, request
+
+    instrument_sqlalchemy(engine)
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_db_token = _request_db.set({"queries": 0, "seconds": 0.0})
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+        totals = _request_db.get()
+        if totals is not None:
+            DB_QUERIES_PER_REQUEST.observe(totals["queries"], route=route)
+            DB_TIME_PER_REQUEST.observe(totals["seconds"], route=route)
+        token = g.pop("metrics_db_token", None)
+        if token is not None:
+            try:
+                _request_db.reset(token)
+            except ValueError:
+                _request_db.set(None)
+        return response
+
+
+# --- LLM accounting ------------------------------------------------------------
+
+def answered_model(response: Any, requested: str, routed: bool) -> str:
+    """
+    The model name to label a call with. Without a router it is the model the call
+    was issued with (the API's model_version is a dated build like "...-001");
+    routed calls may have hedged to a fallback, which the router stamps on the response.
+    """
+    if not routed:
+        return requested
+    return getattr(response, "model_version", None) or requested
+
+
+def record_usage(agent: str, model: str, response: Any, span=None) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for direction, count in (("input", usage.prompt_token_count), ("output", usage.candidates_token_count),
+                             ("thinking", getattr(usage, "thoughts_token_count", None))):
+        if count:
+            LLM_TOKENS.inc(count, agent=agent, model=model, direction=direction)
+            if span is not None:
+                span.set(**{f"{direction}_tokens": count})
+
+
+class _MeteredModels:
+    def __init__(self, metered: "MeteredClient"):
+        self._metered = metered
+
+    def generate_content(self, **request):
+        metered = self._metered
+        started = time.perf_counter()
+        outcome = "error"
+        model = request["model"]
+        with tracer.span(f"llm.{metered.agent}", model=model, priority=metered.priority) as span:
+            try:
+                response = metered.client.models.generate_content(**request)
+                outcome = "ok"
+                model = answered_model(response, model, metered.routed)
+                if model != request["model"]:
+                    span.set(answered_model=model)
+                record_usage(metered.agent, model, response, span)
+                return response
+            finally:
+                LLM_CALL_DURATION.observe(time.perf_counter() - started, agent=metered.agent, model=model,
+                                          priority=metered.priority, outcome=outcome)
+
+    def generate_content_stream(self, **request):
+        metered = self._metered
+        started = time.perf_counter()
+        outcome = "error"
+        last = None
+        model = request["model"]
+        # Not made current: a generator resumes in its consumer's context.
+        span = tracer.start_span(f"llm.{metered.agent}", model=request["model"], priority=metered.priority, stream=True)
+        try:
+            for chunk in metered.client.models.generate_content_stream(**request):
+                last = chunk
+                yield chunk
+            outcome = "ok"
+            # Streams bypass the router, so they are always answered by the model requested.
+            record_usage(metered.agent, model, last, span)
+        finally:
+            LLM_CALL_DURATION.observe(time.perf_counter() - started, agent=metered.agent, model=model,
+                                      priority=metered.priority, outcome=outcome)
+            span.finish()
+
+    def __getattr__(self, name):
+        return getattr(self._metered.client.models, name)
+
+
+class _MeteredAsyncModels:
+    def __init__(self, metered: "MeteredClient"):
+        self._metered = metered
+
+    async def generate_content(self, **request):
+        metered = self._metered
+        started = time.perf_counter()
+        outcome = "error"
+        model = request["model"]
+        with tracer.span(f"llm.{metered.agent}", model=model, priority=metered.priority) as span:
+            try:
+                response = await metered.client.aio.models.generate_content(**request)
+                outcome = "ok"
+                model = answered_model(response, model, metered.routed)
+                if model != request["model"]:
+                    span.set(answered_model=model)
+                record_usage(metered.agent, model, response, span)
+                return response
+            finally:
+                LLM_CALL_DURATION.observe(time.perf_counter() - started, agent=metered.agent, model=model,
+                                          priority=metered.priority, outcome=outcome)
+
+    def __getattr__(self, name):
+        return getattr(self._metered.client.aio.models, name)
+
+
+class _MeteredAio:
+    def __init__(self, metered: "MeteredClient"):
+        self._metered = metered
+        self.models = _MeteredAsyncModels(metered)
+
+    def __getattr__(self, name):
+        return getattr(self._metered.client.aio, name)
+
+
+class MeteredClient:
+    """
+    Drop-in stand-in for genai.Client that records call latency and token usage
+    under the agent's name, and a trace span per call. Wrap it outermost so the latency includes queueing,
+    retries and hedging, i.e. what the agent actually waited.
+    """
+
+    def __init__(self, client, agent: str, priority: str = ""):
+        self.client = client
+        self.agent = agent
+        self.priority = priority
+        # Only a router can answer with another model than the one requested.
+        self.routed = isinstance(client, RoutedClient)
+        self.models = _MeteredModels(self)
+        self.aio = _MeteredAio(self)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,424 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional, Dict, Any, List, Tuple
+
+from pydantic import ValidationError
+
+from llm_scheduler import estimate_tokens
+
+# Fallback used for a hedged duplicate when a model is slow or failing.
+DEFAULT_FALLBACKS = {
+    "gemini-2.0-flash": "gemini-2.5-flash-lite",
+    "gemini-2.5-flash": "gemini-2.0-flash",
+    "gemini-2.5-flash-lite": "gemini-2.0-flash"
+}
+
+# USD per million (input, output) tokens, used for the cost overhead report.
+DEFAULT_PRICES = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40)
+}
+
+
+class InvalidResponseError(ValueError):
+    """The model answered, but not with content that matches the requested format."""
+
+    def __init__(self, message: str, response: Any = None):
+        super().__init__(message)
+        self.response = response
+
+
+def validate_response(response: Any, config: Any) -> None:
+    """
+    Raises InvalidResponseError unless the response text conforms to the request:
+    the pydantic response_schema when one is set, any JSON for application/json,
+    otherwise non-empty text.
+    """
+    text = getattr(response, "text", None)
+    if not text:
+        raise InvalidResponseError("Empty response", response)
+    schema = getattr(config, "response_schema", None)
+    try:
+        if schema is not None and hasattr(schema, "model_validate_json"):
+            schema.model_validate_json(text)
+        elif getattr(config, "response_mime_type", None) == "application/json":
+            json.loads(text.strip().replace('```json', '').replace('```', ''))
+    except (ValidationError, json.JSONDecodeError) as e:
+        raise InvalidResponseError(f"Response does not match the requested format: {e}", response) from e
+
+
+def percentile(sorted_values: List[float], quantile: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(quantile * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LatencyTracker:
+    """Rolling window of the last `window` call outcomes for one model."""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)  # (seconds, ok)
+
+    def record(self, seconds: float, ok: bool) -> None:
+        self.samples.append((seconds, ok))
+
+    def latencies(self) -> List[float]:
+        return sorted(seconds for seconds, ok in self.samples if ok)
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+
+class ModelRouter:
+    """
+    Latency-aware routing shared by all agents.
+
+    Tracks rolling latency and error rate per model. A request first goes to
+    the model the agent asked for (or straight to its fallback when that
+    model's recent error rate is above `max_error_rate`, except for every
+    `probe_every`-th request, which probes whether it has recovered). If it is still
+    running after the model's `hedge_quantile` latency (once `min_samples`
+    are known, never earlier than `min_hedge_delay`), a hedged duplicate is
+    sent to the fallback model. If it fails or returns something that does
+    not validate, the fallback is tried immediately (a failover). The first
+    valid answer wins and the other call is cancelled (async, its prompt
+    tokens are counted as wasted) or left to finish in the background (sync).
+    Sync calls with no hedge planned run on the caller's thread (a failover
+    follows on it too); only hedged calls use the `sync_workers` pool, since
+    the caller must be free to take whichever answer comes first.
+    When no answer validates, the last one received is returned so the agent
+    reports it as before. Hedge rate and the cost of losing calls are
+    reported by stats().
+    """
+
+    def __init__(self, fallbacks: Optional[Dict[str, str]] = None, prices: Optional[Dict[str, Tuple[float, float]]] = None,
+                 hedging: bool = True, hedge_quantile: float = 0.95, min_samples: int = 20, min_hedge_delay: float = 1.0,
+                 max_error_rate: float = 0.5, probe_every: int = 10, window: int = 200, sync_workers: int = 128):
+        self.fallbacks = DEFAULT_FALLBACKS if fallbacks is None else fallbacks
+        self.prices = {**DEFAULT_PRICES, **(prices or {})}
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.max_error_rate = max_error_rate
+        self.probe_every = probe_every
+        self.window = window
+        self._trackers: Dict[str, LatencyTracker] = {}
+        self._bypassed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=sync_workers, thread_name_prefix="llm-hedge")
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "failover_wins": 0, "invalid_responses": 0,
+                       "cost_usd": 0.0, "wasted_cost_usd": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """
+        LLM_FALLBACK_MODELS ("model=fallback,...") replaces the default fallbacks;
+        LLM_MODEL_PRICES ("model=input:output,...", USD per 1M tokens) adds prices.
+        LLM_ROUTER_SYNC_WORKERS sizes the sync hedging pool (default twice ASGI_THREADS:
+        a hedged call holds two workers until both attempts return).
+        """
+        fallbacks = None
+        if os.getenv("LLM_FALLBACK_MODELS"):
+            fallbacks = dict(
+                tuple(part.strip() for part in entry.split("=", 1))
+                for entry in os.getenv("LLM_FALLBACK_MODELS").split(",") if "=" in entry
+            )
+        prices = {}
+        for entry in filter(None, (item.strip() for item in os.getenv("LLM_MODEL_PRICES", "").split(","))):
+            model, _, price = entry.partition("=")
+            input_price, _, output_price = price.partition(":")
+            prices[model.strip()] = (float(input_price), float(output_price or input_price))
+        return cls(
+            fallbacks=fallbacks,
+            prices=prices,
+            hedging=os.getenv("LLM_HEDGING_ENABLED", "true").lower() == "true",
+            hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+            min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+            min_hedge_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0")),
+            max_error_rate=float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5")),
+            sync_workers=int(os.getenv("LLM_ROUTER_SYNC_WORKERS", str(2 * int(os.getenv("ASGI_THREADS", "64")))))
+        )
+
+    def _tracker(self, model: str) -> LatencyTracker:
+        tracker = self._trackers.get(model)
+        if tracker is None:
+            tracker = self._trackers[model] = LatencyTracker(self.window)
+        return tracker
+
+    def plan(self, model: str) -> Tuple[str, Optional[str], Optional[float]]:
+        """Returns (first model, fallback model or None, seconds before hedging or None for no hedge)."""
+        fallback = self.fallbacks.get(model)
+        if fallback == model:
+            fallback = None
+        with self._lock:
+            tracker = self._tracker(model)
+            unhealthy = len(tracker.samples) >= self.min_samples and tracker.error_rate() > self.max_error_rate
+            if unhealthy:
+                self._bypassed[model] = self._bypassed.get(model, 0) + 1
+                unhealthy = self._bypassed[model] % self.probe_every != 0
+            latencies = tracker.latencies()
+        if fallback and unhealthy:
+            return fallback, model, None
+        if not fallback or not self.hedging or len(latencies) < self.min_samples:
+            return model, fallback, None
+        return model, fallback, max(self.min_hedge_delay, percentile(latencies, self.hedge_quantile))
+
+    def _cost(self, model: str, response: Any) -> float:
+        usage = getattr(response, "usage_metadata", None)
+        input_price, output_price = self.prices.get(model, (0.0, 0.0))
+        if usage is None:
+            return 0.0
+        return ((usage.prompt_token_count or 0) * input_price + (usage.candidates_token_count or 0) * output_price) / 1_000_000
+
+    def record(self, model: str, seconds: float, ok: bool, response: Any = None) -> None:
+        cost = self._cost(model, response) if response is not None else 0.0
+        with self._lock:
+            self._tracker(model).record(seconds, ok)
+            self._stats["cost_usd"] += cost
+            if response is not None and not ok:
+                self._stats["invalid_responses"] += 1
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    # --- Attempts ------------------------------------------------------------
+
+    def _attempt(self, models, request: Dict[str, Any], model: str) -> Any:
+        started = time.monotonic()
+        response = None
+        try:
+            response = self._stamp(models.generate_content(**{**request, "model": model}), model)
+            validate_response(response, request.get("config"))
+        except Exception:
+            self.record(model, time.monotonic() - started, False, response)
+            raise
+        self.record(model, time.monotonic() - started, True, response)
+        return response
+
+    async def _attempt_async(self, models, request: Dict[str, Any], model: str) -> Any:
+        started = time.monotonic()
+        response = None
+        try:
+            response = self._stamp(await models.generate_content(**{**request, "model": model}), model)
+            validate_response(response, request.get("config"))
+        except asyncio.CancelledError:
+            # Lost the race: its elapsed time is cut short, so it is not a latency sample, but its prompt was billed.
+            input_price, _ = self.prices.get(model, (0.0, 0.0))
+            wasted = estimate_tokens(request.get("contents")) * input_price / 1_000_000
+            with self._lock:
+                self._stats["cost_usd"] += wasted
+                self._stats["wasted_cost_usd"] += wasted
+            raise
+        except Exception:
+            self.record(model, time.monotonic() - started, False, response)
+            raise
+        self.record(model, time.monotonic() - started, True, response)
+        return response
+
+    @staticmethod
+    def _stamp(response: Any, model: str) -> Any:
+        """
+        Marks which model answered, by its configured name, so usage is attributed to it rather
+        than to the model the agent asked for (and not to a dated build such as "...-001").
+        """
+        if response is not None:
+            response.model_version = model
+        return response
+
+    def _mark_wasted(self, model: str, response: Any) -> None:
+        with self._lock:
+            self._stats["wasted_cost_usd"] += self._cost(model, response)
+
+    # --- Entry points ----------------------------------------------------------
+
+    def generate(self, models, **request) -> Any:
+        """Sync routing over `models` (an object with generate_content, e.g. client.models)."""
+        self._count("requests")
+        first, fallback, hedge_after = self.plan(request["model"])
+        if hedge_after is None:
+            return self._generate_in_caller(models, request, first, fallback)
+        pending = {self._executor.submit(self._attempt, models, request, first): first}
+        second = None  # "hedged" or "failovers" once the fallback has been sent
+        error = None
+
+        while pending:
+            timeout = hedge_after if fallback and second is None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Still running past the hedge threshold.
+                second = "hedged"
+                self._count(second)
+                pending[self._executor.submit(self._attempt, models, request, fallback)] = fallback
+                continue
+
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e if error is None or isinstance(e, InvalidResponseError) else error
+                    continue
+                if model != first:
+                    self._count("hedge_wins" if second == "hedged" else "failover_wins")
+                for loser, loser_model in pending.items():
+                    loser.add_done_callback(lambda f, m=loser_model: None if f.exception() else self._mark_wasted(m, f.result()))
+                return response
+
+            if fallback and second is None:
+                second = "failovers"
+                self._count(second)
+                pending[self._executor.submit(self._attempt, models, request, fallback)] = fallback
+
+        if isinstance(error, InvalidResponseError):
+            return error.response
+        raise error
+
+    def _generate_in_caller(self, models, request: Dict[str, Any], first: str, fallback: Optional[str]) -> Any:
+        """generate() without a hedge: the first attempt, then any failover, run on the caller's thread."""
+        try:
+            return self._attempt(models, request, first)
+        except Exception as e:
+            error = e
+        if fallback:
+            self._count("failovers")
+            try:
+                response = self._attempt(models, request, fallback)
+            except Exception as e:
+                error = e if isinstance(e, InvalidResponseError) else error
+            else:
+                self._count("failover_wins")
+                return response
+
+        if isinstance(error, InvalidResponseError):
+            return error.response
+        raise error
+
+    async def generate_async(self, models, **request) -> Any:
+        """Async routing over `models` (an object with an async generate_content, e.g. client.aio.models)."""
+        self._count("requests")
+        first, fallback, hedge_after = self.plan(request["model"])
+        pending = {asyncio.ensure_future(self._attempt_async(models, request, first)): first}
+        second = None
+        error = None
+
+        try:
+            while pending:
+                timeout = hedge_after if fallback and second is None else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    second = "hedged"
+                    self._count(second)
+                    pending[asyncio.ensure_future(self._attempt_async(models, request, fallback))] = fallback
+                    continue
+
+                for task in done:
+                    model = pending.pop(task)
+                    if task.exception() is not None:
+                        e = task.exception()
+                        error = e if error is None or isinstance(e, InvalidResponseError) else error
+                        continue
+                    if model != first:
+                        self._count("hedge_wins" if second == "hedged" else "failover_wins")
+                    return task.result()
+
+                if fallback and second is None:
+                    second = "failovers"
+                    self._count(second)
+                    pending[asyncio.ensure_future(self._attempt_async(models, request, fallback))] = fallback
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if isinstance(error, InvalidResponseError):
+            return error.response
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {}
+            for model, tracker in self._trackers.items():
+                latencies = tracker.latencies()
+                models[model] = {
+                    "samples": len(tracker.samples),
+                    "error_rate": round(tracker.error_rate(), 4),
+                    "p50_seconds": percentile(latencies, 0.5),
+                    "p95_seconds": percentile(latencies, 0.95),
+                    "p99_seconds": percentile(latencies, 0.99),
+                    "fallback": self.fallbacks.get(model)
+                }
+            stats = dict(self._stats)
+        requests = stats["requests"]
+        useful_cost = stats["cost_usd"] - stats["wasted_cost_usd"]
+        return {
+            **stats,
+            "cost_usd": round(stats["cost_usd"], 6),
+            "wasted_cost_usd": round(stats["wasted_cost_usd"], 6),
+            "hedge_rate": round(stats["hedged"] / requests, 4) if requests else 0.0,
+            "cost_overhead_ratio": round(stats["wasted_cost_usd"] / useful_cost, 4) if useful_cost else 0.0,
+            "hedging": self.hedging,
+            "hedge_quantile": self.hedge_quantile,
+            "models": models
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class _RoutedModels:
+    def __init__(self, routed: "RoutedClient"):
+        self._routed = routed
+
+    def generate_content(self, **request):
+        return self._routed.router.generate(self._routed.client.models, **request)
+
+    def __getattr__(self, name):
+        # Streams are not hedged: a duplicate stream cannot be merged into the one already being sent.
+        return getattr(self._routed.client.models, name)
+
+
+class _RoutedAsyncModels:
+    def __init__(self, routed: "RoutedClient"):
+        self._routed = routed
+
+    async def generate_content(self, **request):
+        return await self._routed.router.generate_async(self._routed.client.aio.models, **request)
+
+    def __getattr__(self, name):
+        return getattr(self._routed.client.aio.models, name)
+
+
+class _RoutedAio:
+    def __init__(self, routed: "RoutedClient"):
+        self._routed = routed
+        self.models = _RoutedAsyncModels(routed)
+
+    def __getattr__(self, name):
+        return getattr(self._routed.client.aio, name)
+
+
+class RoutedClient:
+    """
+    Drop-in stand-in for genai.Client that sends generate_content (sync and
+    async) through a ModelRouter. Wrap the scheduled client with it so hedged
+    duplicates are rate limited like any other call.
+    """
+
+    def __init__(self, client, router: ModelRouter):
+        self.client = client
+        self.router = router
+        self.models = _RoutedModels(self)
+        self.aio = _RoutedAio(self)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
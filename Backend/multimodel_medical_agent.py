@@ -1,8 +1,9 @@
 import os
 import json
+import asyncio
 import datetime
 from enum import Enum
-from typing import List, Optional, Union
+from typing import List, Optional, Union, Dict, Any
 from pydantic import BaseModel, Field
 from google import genai
 from google.genai import types
@@ -11,7 +12,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import our loader
-from document_loader import SmartLoader
+from document_loader import SmartLoader, Source, read_source
+from response_cache import PersistentLRUCache, fingerprint
+from metrics import track_stage
+from prompt_builder import PromptBuilder, track_truncation, note_truncation
+from llm_scheduler import note_llm_failure
+
+# Layout of extraction cache entries ({"result", "prompt_truncated"}); bump when it changes.
+EXTRACTION_CACHE_FORMAT = 2
 
 # --- STRICT SCHEMA DEFINITION ---
 
@@ -74,12 +82,18 @@ class MedicalRecord(BaseModel):
 # --- AGENT ARCHITECTURE ---
 
 class MultimodalMedicalAgent:
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
+    def __init__(self, model_name: str = "gemini-2.0-flash", cache: Optional[PersistentLRUCache] = None, loader: Optional[SmartLoader] = None,
+                 client: Optional[genai.Client] = None, prompt_builder: Optional[PromptBuilder] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
-        self.client = genai.Client(api_key=self.api_key)
+        # A shared client (genai_client.get_client) pools connections across agents.
+        self.client = client or genai.Client(api_key=self.api_key)
         self.model_name = model_name
-        self.loader = SmartLoader()
+        self.loader = loader or SmartLoader()
+        self.cache = cache
+        # Caps the document text of very long reports at the extractor's token budget.
+        self.prompt_builder = prompt_builder or PromptBuilder.from_env("report_extractor", client=self.client, model=model_name)
 
+        # Sent with every extraction; JSON conformance is enforced by response_schema, not restated here.
         self.system_instruction = """
 ### ROLE
 You are an expert Medical AI Agent. You accept input as raw text, images (scans), or PDFs.
@@ -87,41 +101,129 @@ You are an expert Medical AI Agent. You accept input as raw text, images (scans)
 ### OBJECTIVE
 1. CLASSIFY the document (Diagnostic, Clinical, Procedural, Administrative).
 2. EXTRACT entities accurately into the provided schema.
-3. OUTPUT strict JSON that conforms exactly to the MedicalRecord schema.
 
 ### RULES
 - If the input is an image/PDF, visually analyze checkboxes, handwritten text, and layout.
 - If text is illegible or a field is not present, mark the field as null or omit it according to the schema.
 - Maintain patient privacy (Extract entities exactly).
-"""
-
-    def analyze_file(self, file_path: str) -> str:
-        print(f"--- Processing: {file_path} ---")
+""".strip()
+        # Any change to the output schema, the prompt, the token budget (long documents may be
+        # truncated) or the loader settings (PDF routing, image normalization) invalidates
+        # previously cached extractions.
+        self.schema_fingerprint = fingerprint(MedicalRecord.model_json_schema(), self.system_instruction, self.prompt_builder.budget,
+                                              self.loader.settings(), EXTRACTION_CACHE_FORMAT)
+
+    def _cache_key(self, data: bytes, filename: str) -> str:
+        """Content-addressed key: file bytes + extension (drives loader routing) + model + schema/prompt/loader settings."""
+        ext = os.path.splitext(filename)[1].lower()
+        return fingerprint(data, ext, self.model_name, self.schema_fingerprint)
+
+    def _store_in_cache(self, cache_key: str, response_text: str, prompt_truncated: bool = False) -> None:
+        """Only well-formed, error-free extractions are cached, with whether their document text was truncated."""
+        try:
+            parsed = json.loads(response_text)
+        except (TypeError, json.JSONDecodeError):
+            return
+        if isinstance(parsed, dict) and "error" not in parsed:
+            self.cache.set(cache_key, json.dumps({"result": response_text, "prompt_truncated": prompt_truncated}))
+
+    def _prepare(self, source: Source, filename: str) -> Dict[str, Any]:
+        """
+        Cache lookup and loading, shared by the sync and async paths.
+        Returns {"result": <json str>} when no LLM call is needed, otherwise
+        {"cache_key": ..., "request": <generate_content kwargs>, "prompt_truncated": bool}.
+        A cache hit whose document was truncated is reported to track_truncation() like a miss.
+        """
+        print(f"--- Processing: {filename} ---")
+
+        # The upload is read once; hashing, parsing and the Vision payload share these bytes.
+        try:
+            data = read_source(source)
+        except Exception as e:
+            return {"result": json.dumps({"error": f"Loader Error: {str(e)}"})}
+
+        # 0. Serve repeat uploads straight from the extraction cache
+        cache_key = None
+        if self.cache is not None:
+            try:
+                cache_key = self._cache_key(data, filename)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    entry = json.loads(cached)
+                    print(f"[Cache] Extraction cache hit for '{os.path.basename(filename)}'.")
+                    if entry["prompt_truncated"]:
+                        note_truncation(self.prompt_builder.agent)
+                    return {"result": entry["result"]}
+            except Exception as e:
+                print(f"[Cache] Extraction cache unavailable: {e}")
+                cache_key = None
         
         # 1. Load File using SmartLoader
         try:
-            content_payload: Union[str, types.Part, None] = self.loader.process_file(file_path)
+            with track_stage("loader", file=filename, bytes=len(data)):
+                content_payload: Union[str, types.Part, List[Union[str, types.Part]], None] = self.loader.process(data, filename)
             if content_payload is None:
-                return json.dumps({"error": "Failed to load file"})
+                return {"result": json.dumps({"error": "Failed to load file"})}
         except Exception as e:
-            return json.dumps({"error": f"Loader Error: {str(e)}"})
-
-        # 2. Call Gemini
-        try:
-            # content_payload can be a string (for text) or types.Part (for image/pdf bytes)
-            contents_list = [content_payload] 
-            
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=contents_list, 
-                config=types.GenerateContentConfig(
+            return {"result": json.dumps({"error": f"Loader Error: {str(e)}"})}
+
+        # content_payload can be a string (for text), types.Part (for image/pdf bytes)
+        # or a list of both (mixed PDFs: text pages and rendered scanned pages)
+        contents = content_payload if isinstance(content_payload, list) else [content_payload]
+        with track_truncation() as truncated:
+            contents = self.prompt_builder.fit_contents(contents, overhead=self.prompt_builder.count(self.system_instruction))
+        return {
+            "cache_key": cache_key,
+            "prompt_truncated": bool(truncated),
+            "request": {
+                "model": self.model_name,
+                "contents": contents,
+                "config": types.GenerateContentConfig(
                     system_instruction=self.system_instruction,
                     response_mime_type="application/json",
                     response_schema=MedicalRecord,
                     temperature=0.1
                 )
-            )
+            }
+        }
+
+    def analyze_bytes(self, source: Source, filename: str) -> str:
+        """Analyzes in-memory content (bytes, memoryview or stream); filename selects the loader."""
+        prepared = self._prepare(source, filename)
+        if "result" in prepared:
+            return prepared["result"]
+
+        # 2. Call Gemini
+        try:
+            response = self.client.models.generate_content(**prepared["request"])
+            if prepared["cache_key"] is not None:
+                self._store_in_cache(prepared["cache_key"], response.text, prepared["prompt_truncated"])
             return response.text
             
         except Exception as e:
-            return json.dumps({"error": f"API Error: {str(e)}"})
\ No newline at end of file
+            note_llm_failure(e)
+            return json.dumps({"error": f"API Error: {str(e)}"})
+
+    async def analyze_bytes_async(self, source: Source, filename: str) -> str:
+        """Async variant of analyze_bytes(); loading runs on a worker thread, the LLM call on the genai async client."""
+        prepared = await asyncio.to_thread(self._prepare, source, filename)
+        if "result" in prepared:
+            return prepared["result"]
+
+        try:
+            response = await self.client.aio.models.generate_content(**prepared["request"])
+            if prepared["cache_key"] is not None:
+                await asyncio.to_thread(self._store_in_cache, prepared["cache_key"], response.text, prepared["prompt_truncated"])
+            return response.text
+
+        except Exception as e:
+            note_llm_failure(e)
+            return json.dumps({"error": f"API Error: {str(e)}"})
+
+    def analyze_file(self, file_path: str) -> str:
+        """Analyzes a file on disk."""
+        return self.analyze_bytes(file_path, file_path)
+
+    async def analyze_file_async(self, file_path: str) -> str:
+        """Async variant of analyze_file()."""
+        return await self.analyze_bytes_async(file_path, file_path)
@@ -1,11 +1,15 @@
 import os
 import json
-from typing import Dict, Any, Union, Optional, List
+from typing import Dict, Any, Union, Optional, List, Iterator, Tuple
 from pydantic import BaseModel, Field
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 
+from tracing import tracer
+from prompt_builder import PromptBuilder, dedent_prompt
+from llm_scheduler import note_llm_failure
+
 load_dotenv()
 
 # --- Pydantic Schema for JSON Consultation Output (NEW) ---\n
@@ -27,6 +31,53 @@ class ConsultationSummaryJSON(BaseModel):
     disclaimer: str = Field(default="I am an AI assistant. This analysis is for informational purposes and does not replace professional medical advice.")
 
 
+CONSULTATION_MARKDOWN_HEADER = "## 🩺 Dr. AI Summary\n\n"
+CONSULTATION_SECTION_ORDER = ["overall_summary", "key_findings", "lifestyle_recommendations", "when_to_see_doctor", "disclaimer"]
+
+
+def render_key_finding(finding: Dict[str, Any]) -> str:
+    """Renders one KeyFinding as its bullet in the "Key Findings" section."""
+    md = f"- **{finding.get('parameter_name')}:** {finding.get('status')}\n"
+    md += f"  - *Interpretation:* {finding.get('interpretation')}\n"
+    if finding.get('image_tag'):
+        md += f"\n{finding['image_tag']}\n"
+    return md
+
+
+def render_consultation_section(field: str, value: Any) -> str:
+    """Renders one ConsultationSummaryJSON field as its block of the "Dr. AI Summary" layout."""
+    if field == "overall_summary":
+        return f"**1. The Big Picture**\n{value}\n\n"
+
+    if field == "key_findings":
+        md = "**2. Key Findings (Explained)**\n"
+        md += "".join(render_key_finding(finding) for finding in value) if value else "- No notable findings.\n"
+        return md + "\n"
+
+    if field == "lifestyle_recommendations":
+        md = "**3. 🥗 Lifestyle & Dietary Recommendations**\n"
+        md += "\n".join(f"- {tip}" for tip in value) if value else "- N/A"
+        return md + "\n\n"
+
+    if field == "when_to_see_doctor":
+        md = "**4. ⚠️ When to see a Human Doctor**\n"
+        md += "\n".join(f"- {flag}" for flag in value) if value else "- N/A"
+        return md + "\n\n"
+
+    if field == "disclaimer":
+        return f"---\n*Disclaimer: {value}*"
+
+    return ""
+
+
+def render_consultation_markdown(summary: ConsultationSummaryJSON) -> str:
+    """Renders a validated consultation into the same "Dr. AI Summary" Markdown layout the model produces."""
+    data = summary.model_dump()
+    md = CONSULTATION_MARKDOWN_HEADER
+    md += "".join(render_consultation_section(field, data[field]) for field in CONSULTATION_SECTION_ORDER)
+    return md
+
+
 class PatientConsultantAgent:
     """
     Agent 2: The Medical Consultant (Synthesizer).
@@ -37,13 +88,16 @@ class PatientConsultantAgent:
     and professional medical summary.
     """
     
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
+    def __init__(self, model_name: str = "gemini-2.0-flash", client: Optional[genai.Client] = None, prompt_builder: Optional[PromptBuilder] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
         if not self.api_key:
             print("WARNING: GOOGLE_API_KEY not found in environment variables.")
             
-        self.client = genai.Client(api_key=self.api_key)
+        # A shared client (genai_client.get_client) pools connections across agents.
+        self.client = client or genai.Client(api_key=self.api_key)
         self.model_name = model_name
+        # Compacts the report JSON and keeps the prompt within the consultant's token budget.
+        self.prompt_builder = prompt_builder or PromptBuilder.from_env("consultant", client=self.client, model=model_name)
 
         # System instruction for MARKDOWN output (default behavior)
         self.markdown_system_instruction = """
@@ -82,21 +136,15 @@ You are a senior, empathetic, and professional Medical Consultant AI. Your task
 ---
 *Disclaimer: I am an AI assistant. This analysis is for informational purposes and does not replace professional medical advice.*
 """
+        # Structured calls (the default route) are resent on every report: they keep the role and
+        # guidelines but not the Markdown layout, which response_schema and its field descriptions
+        # already carry and render_consultation_markdown() rebuilds locally.
+        self.json_system_instruction = self.markdown_system_instruction.split('### REQUIRED OUTPUT FORMAT')[0].strip()
 
 
-    def generate_consultation(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> str:
-        """
-        Generates the formatted consultation report.
+    def _prompt_parts(self, patient_profile: Optional[Dict[str, Any]], json_output: bool) -> Tuple[str, str, str]:
+        """(system instruction, prompt template, profile text): everything in the request except the report."""
 
-        Args:
-            report_analysis (dict or str): The structured JSON output from Agent 1 (MANDATORY).
-            patient_profile (dict, optional): Dict containing 'name', 'age', 'gender', 'history', 'complaints'. (OPTIONAL).
-            json_output (bool): If True, returns strict JSON conforming to ConsultationSummaryJSON schema.
-
-        Returns:
-            str: The Markdown formatted doctor's summary OR a JSON string.
-        """
-        
         # 1. Handle Optional Profile
         if patient_profile:
             age = patient_profile.get('age')
@@ -113,42 +161,131 @@ You are a senior, empathetic, and professional Medical Consultant AI. Your task
         else:
             profile_str = "No specific patient profile provided. Interpret the report based on general medical standards."
 
-        # 2. Ensure Report Data is a string for the prompt
-        if isinstance(report_analysis, dict):
-            report_str = json.dumps(report_analysis, indent=2)
-        else:
-            report_str = str(report_analysis)
-
-        # 3. Construct the Synthesizer Prompt
-        user_prompt = f"""
+        system_instruction = self.json_system_instruction if json_output else self.markdown_system_instruction
+        prompt_template = dedent_prompt("""
         Please generate a consultation summary based on the following context:
 
         ### PATIENT PROFILE
-        {profile_str}
+        {profile}
 
         ### INPUT DATA (From Report Analyser Agent)
-        {report_str}
-        """
+        {report}
+        """)
+        return system_instruction, prompt_template, dedent_prompt(profile_str)
+
+    def _request_for(self, system_instruction: str, prompt_template: str, profile_str: str, report_str: str, json_output: bool) -> Dict[str, Any]:
+        # 3. Construct the Synthesizer Prompt
+        user_prompt = prompt_template.format(profile=profile_str, report=report_str)
 
         config_args = {
-            "system_instruction": self.markdown_system_instruction,
+            "system_instruction": system_instruction,
             "temperature": 0.4
         }
 
         if json_output:
-            # Override system instruction and set JSON schema for strict output
-            config_args["system_instruction"] = self.markdown_system_instruction.replace('REQUIRED OUTPUT FORMAT (Markdown)', 'REQUIRED OUTPUT FORMAT (JSON)').replace('## 🩺 Dr. AI Summary', 'Generate the JSON strictly following the schema:')
+            # Set JSON schema for strict output
             config_args["response_mime_type"] = "application/json"
             config_args["response_schema"] = ConsultationSummaryJSON
 
+        return {
+            "model": self.model_name,
+            "contents": user_prompt,
+            "config": types.GenerateContentConfig(**config_args)
+        }
+
+    def _build_request(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> Dict[str, Any]:
+        """Builds the generate_content arguments for the sync paths."""
+        parts = self._prompt_parts(patient_profile, json_output)
+        # 2. Serialize the report compactly (no nulls/empties) within the token budget left by the rest of the prompt
+        overhead = self.prompt_builder.count(list(parts))
+        if isinstance(report_analysis, dict):
+            report_str = self.prompt_builder.fit_json(report_analysis, overhead=overhead)
+        else:
+            report_str = self.prompt_builder.fit_text(str(report_analysis), overhead=overhead)
+        return self._request_for(*parts, report_str, json_output)
+
+    async def _build_request_async(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> Dict[str, Any]:
+        """Async variant of _build_request(); exact token counts (if enabled) use the async client."""
+        parts = self._prompt_parts(patient_profile, json_output)
+        overhead = await self.prompt_builder.count_async(list(parts))
+        if isinstance(report_analysis, dict):
+            report_str = await self.prompt_builder.fit_json_async(report_analysis, overhead=overhead)
+        else:
+            report_str = await self.prompt_builder.fit_text_async(str(report_analysis), overhead=overhead)
+        return self._request_for(*parts, report_str, json_output)
+
+    def generate_consultation(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> str:
+        """
+        Generates the formatted consultation report.
+
+        Args:
+            report_analysis (dict or str): The structured JSON output from Agent 1 (MANDATORY).
+            patient_profile (dict, optional): Dict containing 'name', 'age', 'gender', 'history', 'complaints'. (OPTIONAL).
+            json_output (bool): If True, returns strict JSON conforming to ConsultationSummaryJSON schema.
+
+        Returns:
+            str: The Markdown formatted doctor's summary OR a JSON string.
+        """
         # 4. Call Gemini
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=user_prompt,
-                config=types.GenerateContentConfig(**config_args)
-            )
+            response = self.client.models.generate_content(**self._build_request(report_analysis, patient_profile, json_output))
             return response.text
             
         except Exception as e:
-            return f"Error generating consultation: {str(e)}"
\ No newline at end of file
+            note_llm_failure(e)
+            return f"Error generating consultation: {str(e)}"
+
+    async def generate_consultation_async(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> str:
+        """Async variant of generate_consultation() on the genai async client."""
+        try:
+            response = await self.client.aio.models.generate_content(**await self._build_request_async(report_analysis, patient_profile, json_output))
+            return response.text
+
+        except Exception as e:
+            note_llm_failure(e)
+            return f"Error generating consultation: {str(e)}"
+
+    def generate_consultation_stream(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Streaming variant of the structured (ConsultationSummaryJSON) call: yields the JSON
+        text chunk by chunk. Errors are raised to the caller, which owns the open stream.
+        """
+        request = self._build_request(report_analysis, patient_profile, json_output=True)
+        for chunk in self.client.models.generate_content_stream(**request):
+            if chunk.text:
+                yield chunk.text
+
+    @staticmethod
+    def parse_summary(json_str: str) -> Dict[str, Any]:
+        """Validates a ConsultationSummaryJSON response and pairs it with its locally rendered Markdown."""
+        if json_str.startswith("Error generating consultation:"):
+            return {"error": json_str}
+
+        with tracer.span("parse_summary", chars=len(json_str)) as span:
+            try:
+                summary = ConsultationSummaryJSON.model_validate_json(json_str)
+            except Exception as e:
+                span.set(valid=False)
+                return {"error": f"JSON parsing/validation failed: {str(e)}"}
+            span.set(valid=True)
+
+        with tracer.span("render_markdown"):
+            markdown = render_consultation_markdown(summary)
+        return {
+            "json": summary.model_dump(),
+            "markdown": markdown
+        }
+
+    def generate_consultation_summary(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Single-call consultation: requests only the structured ConsultationSummaryJSON
+        and renders the Markdown locally from the validated object.
+
+        Returns:
+            dict: {"json": <validated dict>, "markdown": <str>} or {"error": <message>} on failure.
+        """
+        return self.parse_summary(self.generate_consultation(report_analysis, patient_profile, json_output=True))
+
+    async def generate_consultation_summary_async(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Async variant of generate_consultation_summary()."""
+        return self.parse_summary(await self.generate_consultation_async(report_analysis, patient_profile, json_output=True))
@@ -1,14 +1,37 @@
 import os
+import re
 import json
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, Tuple, Optional, List
 from google import genai
 from google.genai import types
 from PIL import Image
 import io # NEW: Import io for in-memory byte buffer
 from dotenv import load_dotenv
 
+from document_loader import Source, read_source
+from image_preprocessing import ImageNormalizer
+from response_cache import PersistentLRUCache, fingerprint
+from metrics import track_stage
+from tracing import tracer
+from prompt_builder import PromptBuilder, dedent_prompt
+from llm_scheduler import note_llm_failure
+
 load_dotenv()
 
+MEDICINE_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalize_medicine_name(name: str) -> str:
+    """'  PARACETAMOL-500mg ' -> 'paracetamol 500mg'."""
+    return " ".join(MEDICINE_TOKEN_PATTERN.findall(str(name or "").lower()))
+
+def normalize_medicine_form(form: str) -> str:
+    """'Tablets' / 'tablet' -> 'tablet'; a trailing plural 's' is dropped."""
+    tokens = MEDICINE_TOKEN_PATTERN.findall(str(form or "").lower())
+    if tokens and len(tokens[-1]) > 3 and tokens[-1].endswith("s"):
+        tokens[-1] = tokens[-1][:-1]
+    return " ".join(tokens)
+
 class PrescriptionReaderAgent:
     """
     Agent responsible for analyzing prescription images.
@@ -16,113 +39,250 @@ class PrescriptionReaderAgent:
     and drug knowledge explanation (Medicine Knowledge Agent).
     """
 
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
+    def __init__(self, model_name: str = "gemini-2.0-flash", image_normalizer: Optional[ImageNormalizer] = None,
+                 knowledge_cache: Optional[PersistentLRUCache] = None, client: Optional[genai.Client] = None,
+                 prompt_builder: Optional[PromptBuilder] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
-        # Using a client for consistency with other agents
-        self.client = genai.Client(api_key=self.api_key)
+        # A shared client (genai_client.get_client) pools connections across agents.
+        self.client = client or genai.Client(api_key=self.api_key)
         self.vision_model = 'gemini-2.5-flash-lite'
         self.knowledge_model = 'gemini-2.5-flash-lite'
+        self.image_normalizer = image_normalizer
+        self.knowledge_cache = knowledge_cache
+        # Compacts the extracted medicine list sent to the knowledge model.
+        self.prompt_builder = prompt_builder or PromptBuilder.from_env("prescription_reader", client=self.client, model=self.knowledge_model)
+
+        # Dedented: the source indentation would otherwise be resent as prompt tokens on every call.
+        self.explanation_prompt = dedent_prompt("""
+        You are an expert Pharmacist.
+        INPUT: {input}
+
+        TASK: For each medicine, provide a patient-friendly summary.
+        OUTPUT JSON format:
+        {{"MedicineName": {{"purpose": "Brief reason for use", "side_effects": "2-3 common side effects", "interactions": "1 major warning"}}}}
+        """)
+        # Cached explanations are only reused with the same model and prompt.
+        self.explanation_fingerprint = fingerprint(self.knowledge_model, self.explanation_prompt)
         
-    def _extract_medicines(self, image_input: Image.Image) -> Dict[str, Any]:
+    def _load_image(self, source: Source) -> Tuple[bytes, str, Optional[Dict[str, Any]]]:
         """
-        [Agent 1: Prescription Reader Agent]
-        Scans the image and finds medicine names/forms using Gemini Vision.
-        Returns a dictionary with extracted data or an 'error' key on failure.
+        Reads the image once and validates it with PIL over the same buffer.
+        Returns (bytes, mime type, normalization stats). Without an ImageNormalizer the
+        upload is sent as-is; with one it is rotated, downscaled and re-encoded first.
         """
-        prompt = """
-        You are an expert Pharmacist. 
+        data = read_source(source)
+        if self.image_normalizer is not None:
+            with track_stage("image_normalize", bytes=len(data)) as span:
+                normalized = self.image_normalizer.normalize(data, "prescription")
+                span.set(normalized_bytes=len(normalized["data"]))
+            stats = {key: value for key, value in normalized.items() if key != "data"}
+            return normalized["data"], normalized["mime_type"], stats
+
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+            mime_type = Image.MIME.get(image.format, "image/jpeg")
+        return data, mime_type, None
+
+    def _build_extraction_request(self, image_data: bytes, mime_type: str) -> Dict[str, Any]:
+        """Builds the Vision request for _extract_medicines (shared by the sync and async paths)."""
+        prompt = dedent_prompt("""
+        You are an expert Pharmacist.
         1. Identify ONLY medicine names and forms from the image.
         2. Classify forms into: "Tablets", "Capsules", "Cream", "Syrup", "Drops", etc.
         3. Output strictly this JSON format and nothing else:
            {"medicines": [{"name": "MedName", "form": "MedForm"}]}
-        """
-        try:
-            # --- FIX: Convert PIL Image to Bytes in Memory for robust Part creation ---
-            img_byte_arr = io.BytesIO()
-            # Save the image as JPEG (adjust format based on input if necessary, but JPEG is usually robust)
-            image_input.save(img_byte_arr, format=image_input.format if image_input.format else 'JPEG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            # Create the Part from the byte stream
-            mime_type = f"image/{image_input.format.lower() if image_input.format else 'jpeg'}"
-            img_bytes = types.Part.from_bytes(data=img_byte_arr, mime_type=mime_type)
-            # -----------------------------------------------------------------------
-            
-            response = self.client.models.generate_content(
-                model=self.vision_model,
-                contents=[prompt, img_bytes], 
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=0.1
-                )
+        """)
+        img_bytes = types.Part.from_bytes(data=image_data, mime_type=mime_type)
+
+        return {
+            "model": self.vision_model,
+            "contents": [prompt, img_bytes],
+            "config": types.GenerateContentConfig(
+                response_mime_type="application/json",
+                temperature=0.1
             )
-            
-            clean_text = response.text.strip().replace('```json', '').replace('```', '')
-            
+        }
+
+    @staticmethod
+    def _parse_extraction(response_text: str) -> Dict[str, Any]:
+        with tracer.span("parse_extraction", chars=len(response_text)):
+            clean_text = response_text.strip().replace('```json', '').replace('```', '')
+
             try:
                 return json.loads(clean_text)
             except json.JSONDecodeError as json_e:
                 error_message = f"JSON Decode Error: Model returned malformed data. {json_e}. Raw: {clean_text[:100]}..."
                 print(f"Prescription Reader Agent (JSON Decode Error): {error_message}")
                 return {"error": error_message}
+
+    def _extract_medicines(self, image_data: bytes, mime_type: str) -> Dict[str, Any]:
+        """
+        [Agent 1: Prescription Reader Agent]
+        Scans the image and finds medicine names/forms using Gemini Vision.
+        Returns a dictionary with extracted data or an 'error' key on failure.
+        """
+        try:
+            response = self.client.models.generate_content(**self._build_extraction_request(image_data, mime_type))
+            return self._parse_extraction(response.text)
             
         except Exception as e:
+            note_llm_failure(e)
             error_message = f"API or Connection Error: {str(e)}"
             print(f"Prescription Reader Agent (Extraction) Error: {error_message}")
             return {"error": error_message}
 
-
-    def _explain_medicines(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        [Agent 2: Medicine Knowledge Agent]
-        Takes the list of medicines and explains them using Gemini Knowledge.
-        Returns a dictionary with analysis or an 'error' key on failure.
-        """
-        prompt = f"""
-        You are an expert Pharmacist. 
-        INPUT: {json.dumps(data)}
-        
-        TASK: For each medicine, provide a patient-friendly summary.
-        OUTPUT JSON format:
-        {{
-            "MedicineName": {{
-                "purpose": "Brief reason for use",
-                "side_effects": "2-3 common side effects",
-                "interactions": "1 major warning"
-            }}
-        }}
-        """
+    async def _extract_medicines_async(self, image_data: bytes, mime_type: str) -> Dict[str, Any]:
+        """Async variant of _extract_medicines()."""
         try:
-            response = self.client.models.generate_content(
-                model=self.knowledge_model,
-                contents=[prompt],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=0.4
-                )
+            response = await self.client.aio.models.generate_content(**self._build_extraction_request(image_data, mime_type))
+            return self._parse_extraction(response.text)
+
+        except Exception as e:
+            note_llm_failure(e)
+            error_message = f"API or Connection Error: {str(e)}"
+            print(f"Prescription Reader Agent (Extraction) Error: {error_message}")
+            return {"error": error_message}
+
+
+    def _explanation_request_for(self, medicines_json: str) -> Dict[str, Any]:
+        return {
+            "model": self.knowledge_model,
+            "contents": [self.explanation_prompt.format(input=medicines_json)],
+            "config": types.GenerateContentConfig(
+                response_mime_type="application/json",
+                temperature=0.4
             )
-            clean_text = response.text.strip().replace('```json', '').replace('```', '')
-            
+        }
+
+    def _build_explanation_request(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds the knowledge request for _explain_medicines."""
+        overhead = self.prompt_builder.count(self.explanation_prompt)
+        return self._explanation_request_for(self.prompt_builder.fit_json(data, overhead=overhead))
+
+    async def _build_explanation_request_async(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Async variant of _build_explanation_request()."""
+        overhead = await self.prompt_builder.count_async(self.explanation_prompt)
+        return self._explanation_request_for(await self.prompt_builder.fit_json_async(data, overhead=overhead))
+
+    @staticmethod
+    def _parse_explanation(response_text: str) -> Dict[str, Any]:
+        with tracer.span("parse_explanation", chars=len(response_text)):
+            clean_text = response_text.strip().replace('```json', '').replace('```', '')
+
             try:
                 return json.loads(clean_text)
             except json.JSONDecodeError as json_e:
                 error_message = f"JSON Decode Error: Explanation model returned malformed data. {json_e}. Raw: {clean_text[:100]}..."
                 print(f"Medicine Knowledge Agent (JSON Decode Error): {error_message}")
                 return {"error": error_message}
+
+    def _knowledge_key(self, medicine: Dict[str, Any]) -> str:
+        return fingerprint(self.explanation_fingerprint, normalize_medicine_name(medicine.get("name")), normalize_medicine_form(medicine.get("form")))
+
+    def _plan_explanation(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Splits the extracted medicines into cached explanations and misses.
+        Returns None when there is no cache (or the extraction has an unexpected shape),
+        in which case the whole list goes to the model as before.
+        """
+        medicines = data.get("medicines")
+        if self.knowledge_cache is None or not isinstance(medicines, list) or not medicines:
+            return None
+
+        try:
+            keyed = [(medicine, self._knowledge_key(medicine)) for medicine in medicines if isinstance(medicine, dict) and medicine.get("name")]
+            if not keyed:
+                return None
+            hits = self.knowledge_cache.get_many([key for _, key in keyed])
+        except Exception as e:
+            print(f"[Cache] Medicine knowledge cache unavailable: {e}")
+            return None
+
+        cached, misses, seen = {}, [], set()
+        for medicine, key in keyed:
+            if key in hits:
+                cached[medicine["name"]] = json.loads(hits[key])
+            elif key not in seen:
+                misses.append(medicine)
+            seen.add(key)
+
+        print(f"[Cache] Medicine knowledge: {len(cached)} cached, {len(misses)} to explain.")
+        return {"cached": cached, "misses": misses}
+
+    def _store_explanations(self, misses: List[Dict[str, Any]], explanation: Dict[str, Any]) -> None:
+        """Caches each new explanation under the medicine it answers (matched on the normalized name)."""
+        by_name = {normalize_medicine_name(medicine["name"]): medicine for medicine in misses}
+        items = {}
+        for name, details in explanation.items():
+            medicine = by_name.get(normalize_medicine_name(name))
+            if medicine is None and len(misses) == 1 and len(explanation) == 1:
+                medicine = misses[0]
+            if medicine is not None and isinstance(details, dict):
+                items[self._knowledge_key(medicine)] = json.dumps(details)
+        try:
+            self.knowledge_cache.set_many(items)
+        except Exception as e:
+            print(f"[Cache] Failed to store medicine knowledge: {e}")
+
+    def _explain_medicines(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        [Agent 2: Medicine Knowledge Agent]
+        Takes the list of medicines and explains them using Gemini Knowledge.
+        With a knowledge cache, only medicines not seen before are sent, in one batched call.
+        Returns a dictionary with analysis or an 'error' key on failure.
+        """
+        plan = self._plan_explanation(data)
+        if plan is not None and not plan["misses"]:
+            return plan["cached"]
+
+        try:
+            request_data = data if plan is None else {"medicines": plan["misses"]}
+            response = self.client.models.generate_content(**self._build_explanation_request(request_data))
+            explanation = self._parse_explanation(response.text)
                 
         except Exception as e:
+            note_llm_failure(e)
             error_message = f"API or Connection Error: {str(e)}"
             print(f"Medicine Knowledge Agent (Explanation) Error: {error_message}")
             return {"error": error_message}
+
+        return self._merge_explanations(plan, explanation)
+
+    async def _explain_medicines_async(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Async variant of _explain_medicines()."""
+        plan = await asyncio.to_thread(self._plan_explanation, data)
+        if plan is not None and not plan["misses"]:
+            return plan["cached"]
+
+        try:
+            request_data = data if plan is None else {"medicines": plan["misses"]}
+            response = await self.client.aio.models.generate_content(**await self._build_explanation_request_async(request_data))
+            explanation = self._parse_explanation(response.text)
+
+        except Exception as e:
+            note_llm_failure(e)
+            error_message = f"API or Connection Error: {str(e)}"
+            print(f"Medicine Knowledge Agent (Explanation) Error: {error_message}")
+            return {"error": error_message}
+
+        return await asyncio.to_thread(self._merge_explanations, plan, explanation)
+
+    def _merge_explanations(self, plan: Optional[Dict[str, Any]], explanation: Dict[str, Any]) -> Dict[str, Any]:
+        """Stores the new explanations and combines them with the cached ones (same output shape)."""
+        if plan is None or not isinstance(explanation, dict) or "error" in explanation:
+            return explanation
+        self._store_explanations(plan["misses"], explanation)
+        return {**plan["cached"], **explanation}
             
-    def analyze_prescription_image(self, file_path: str) -> Dict[str, Any]:
+    def analyze_prescription_image(self, source: Source) -> Dict[str, Any]:
         """
         Main orchestration function for the two-step analysis.
+        `source` may be a file path, raw bytes or a binary stream (e.g. an upload).
         """
         try:
-            image = Image.open(file_path)
+            image_data, mime_type, image_stats = self._load_image(source)
             
-            raw_data = self._extract_medicines(image)
+            raw_data = self._extract_medicines(image_data, mime_type)
             # Check for error key in the dictionary returned by _extract_medicines
             if "error" in raw_data:
                 return {"error": f"Failed to extract medicines from image: {raw_data['error']}"}
@@ -135,7 +295,30 @@ class PrescriptionReaderAgent:
             return {
                 "status": "success",
                 "raw_extraction": raw_data,
-                "analysis": final_report
+                "analysis": final_report,
+                "image_normalization": image_stats
+            }
+        except Exception as e:
+            return {"error": f"Internal Agent Error: {str(e)}"}
+
+    async def analyze_prescription_image_async(self, source: Source) -> Dict[str, Any]:
+        """Async variant of analyze_prescription_image() on the genai async client."""
+        try:
+            image_data, mime_type, image_stats = await asyncio.to_thread(self._load_image, source)
+
+            raw_data = await self._extract_medicines_async(image_data, mime_type)
+            if "error" in raw_data:
+                return {"error": f"Failed to extract medicines from image: {raw_data['error']}"}
+
+            final_report = await self._explain_medicines_async(raw_data)
+            if "error" in final_report:
+                return {"error": f"Failed to generate explanation report: {final_report['error']}"}
+
+            return {
+                "status": "success",
+                "raw_extraction": raw_data,
+                "analysis": final_report,
+                "image_normalization": image_stats
             }
         except Exception as e:
-            return {"error": f"Internal Agent Error: {str(e)}"}
\ No newline at end of file
+            return {"error": f"Internal Agent Error: {str(e)}"}
@@ -0,0 +1,277 @@
+import os
+import json
+import textwrap
+import contextvars
+from contextlib import contextmanager
+from typing import Any, List, Optional
+
+from llm_scheduler import estimate_tokens, CHARS_PER_TOKEN
+from metrics import PROMPT_TOKENS, PROMPT_TRUNCATIONS
+from tracing import tracer
+
+# Token counters accepted by PROMPT_TOKEN_COUNTER.
+COUNTERS = ("estimate", "api")
+
+# Default input budgets in tokens, per agent (PROMPT_BUDGET_<AGENT> overrides, 0 = unlimited).
+# The extractor's budget only caps document text; media parts are always sent whole.
+DEFAULT_BUDGETS = {
+    "report_extractor": 100000,
+    "consultant": 8000,
+    "prescription_reader": 2000,
+    "doctor_assistant": 1000
+}
+
+# Exact counts (PROMPT_TOKEN_COUNTER=api) are only requested when the local estimate
+# is within this fraction of the budget; far below or far above, the estimate decides.
+API_COUNT_MARGIN = 0.2
+
+# Shrinking steps for JSON input: longest string kept, in characters. Only free text is
+# shortened; list items, numbers and short values (every lab result and finding) are always sent.
+JSON_SHRINK_STEPS = (2000, 1000, 500, 200, 80)
+
+# Agents whose prompt input was shortened, for the request being handled (see track_truncation).
+_truncated_agents: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("truncated_agents", default=None)
+
+
+@contextmanager
+def track_truncation():
+    """
+    Collects, into the yielded list, the agents whose prompt input had to be
+    shortened while the block runs, so the response can say so. asyncio tasks
+    and asyncio.to_thread workers started inside the block report into it too.
+    Blocks may nest: on exit, an inner block's agents are passed on to the enclosing one.
+    """
+    outer = _truncated_agents.get()
+    agents: List[str] = []
+    token = _truncated_agents.set(agents)
+    try:
+        yield agents
+    finally:
+        try:
+            _truncated_agents.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. a streamed response's generator).
+            _truncated_agents.set(None)
+        if outer is not None:
+            outer.extend(agents)
+
+
+def note_truncation(agent: str) -> None:
+    """Reports `agent` to the enclosing track_truncation() block, if any (e.g. a cached result that was truncated)."""
+    truncated_agents = _truncated_agents.get()
+    if truncated_agents is not None:
+        truncated_agents.append(agent)
+
+
+def compact(value: Any) -> Any:
+    """Recursively drops None, empty strings, empty lists and empty dicts (0 and False are kept)."""
+    if isinstance(value, dict):
+        items = ((key, compact(item)) for key, item in value.items())
+        return {key: item for key, item in items if not _is_empty(item)}
+    if isinstance(value, (list, tuple)):
+        return [item for item in (compact(item) for item in value) if not _is_empty(item)]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, (str, list, dict)) and not value)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def to_prompt_json(value: Any) -> str:
+    """Compact JSON for prompts: empties stripped, no indentation or spaces after separators."""
+    return _dumps(compact(value))
+
+
+def dedent_prompt(text: str) -> str:
+    """Removes the common indentation of a triple-quoted prompt and its surrounding blank lines."""
+    return textwrap.dedent(text).strip()
+
+
+def _shrink(value: Any, max_chars: int) -> Any:
+    """Shortens every string longer than `max_chars`; lists keep all their items."""
+    if isinstance(value, dict):
+        return {key: _shrink(item, max_chars) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shrink(item, max_chars) for item in value]
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "..."
+    return value
+
+
+class PromptBuilder:
+    """
+    Compacts and budgets the variable part of an agent's prompt (report JSON,
+    document text, symptoms...).
+
+    Input is serialized compactly with nulls and empties stripped, measured in
+    tokens, and, when it exceeds `budget` tokens, shortened: JSON by trimming
+    long free-text strings step by step (every section and list item is kept,
+    so the prompt may stay over budget), text by keeping its beginning and end
+    around an omission marker. Tokens are estimated locally; with counter="api"
+    the model's count_tokens endpoint is asked instead whenever the estimate is
+    close to the budget (client.aio on the async variants). Every prompt logs
+    its input tokens before and after, feeds the prompt_tokens_total metric,
+    and reports shortened input to track_truncation().
+    """
+
+    def __init__(self, agent: str, budget: Optional[int] = None, counter: str = "estimate", client=None, model: Optional[str] = None):
+        if counter not in COUNTERS:
+            raise ValueError(f"Unknown token counter '{counter}' (expected one of {', '.join(COUNTERS)})")
+        self.agent = agent
+        self.budget = budget if budget and budget > 0 else None
+        self.counter = counter
+        self.client = client
+        self.model = model
+
+    @classmethod
+    def from_env(cls, agent: str, client=None, model: Optional[str] = None) -> "PromptBuilder":
+        """Budget from PROMPT_BUDGET_<AGENT> (default DEFAULT_BUDGETS), counter from PROMPT_TOKEN_COUNTER."""
+        budget = os.getenv(f"PROMPT_BUDGET_{agent.upper()}")
+        return cls(
+            agent,
+            budget=int(budget) if budget is not None else DEFAULT_BUDGETS.get(agent),
+            counter=os.getenv("PROMPT_TOKEN_COUNTER", "estimate").lower(),
+            client=client,
+            model=model
+        )
+
+    def _asks_api(self, estimate: int, model: Optional[str]) -> bool:
+        if self.counter != "api" or self.client is None or model is None or self.budget is None:
+            return False
+        return abs(estimate - self.budget) <= self.budget * API_COUNT_MARGIN
+
+    def count(self, contents: Any, model: Optional[str] = None) -> int:
+        """Prompt tokens of `contents`: the local estimate, or count_tokens near the budget (counter="api")."""
+        estimate = estimate_tokens(contents)
+        model = model or self.model
+        if not self._asks_api(estimate, model):
+            return estimate
+        try:
+            return self.client.models.count_tokens(model=model, contents=contents).total_tokens
+        except Exception as e:
+            print(f"[Prompt] count_tokens failed for {self.agent}, using the estimate: {e}")
+            return estimate
+
+    async def count_async(self, contents: Any, model: Optional[str] = None) -> int:
+        """Async variant of count() on the genai async client, so the event loop is never blocked."""
+        estimate = estimate_tokens(contents)
+        model = model or self.model
+        if not self._asks_api(estimate, model):
+            return estimate
+        try:
+            return (await self.client.aio.models.count_tokens(model=model, contents=contents)).total_tokens
+        except Exception as e:
+            print(f"[Prompt] count_tokens failed for {self.agent}, using the estimate: {e}")
+            return estimate
+
+    def _limit(self, overhead: int) -> Optional[int]:
+        return None if self.budget is None else max(self.budget - overhead, 0)
+
+    def _record(self, raw_tokens: int, sent_tokens: int, truncated: bool, over_budget: bool = False) -> None:
+        PROMPT_TOKENS.inc(raw_tokens, agent=self.agent, stage="raw")
+        PROMPT_TOKENS.inc(sent_tokens, agent=self.agent, stage="sent")
+        if truncated:
+            PROMPT_TRUNCATIONS.inc(agent=self.agent)
+            note_truncation(self.agent)
+        tracer.annotate(prompt_tokens_raw=raw_tokens, prompt_tokens=sent_tokens, prompt_truncated=truncated, prompt_over_budget=over_budget)
+        budget = f"budget {self.budget}" if self.budget is not None else "no budget"
+        notes = (", truncated" if truncated else "") + (", still over budget" if over_budget else "")
+        print(f"[Prompt] {self.agent}: input {raw_tokens} -> {sent_tokens} tokens ({budget}{notes}).")
+
+    def _json_input(self, data: Any):
+        # The "before" count is the indented JSON the agents used to send.
+        compacted = compact(data)
+        return estimate_tokens(json.dumps(data, indent=2, ensure_ascii=False)), compacted, _dumps(compacted)
+
+    def fit_json(self, data: Any, overhead: int = 0) -> str:
+        """
+        Compact JSON for `data`, with long strings shortened until it fits the
+        budget minus `overhead` tokens (the rest of the prompt). Lists are never
+        cut: when only they remain, the JSON is sent over budget and logged.
+        """
+        raw_tokens, compacted, text = self._json_input(data)
+        tokens = self.count(text)
+        limit = self._limit(overhead)
+        truncated = limit is not None and tokens > limit
+        if truncated:
+            for max_chars in JSON_SHRINK_STEPS:
+                text = _dumps(_shrink(compacted, max_chars))
+                tokens = self.count(text)
+                if tokens <= limit:
+                    break
+        self._record(raw_tokens, tokens, truncated, over_budget=truncated and tokens > limit)
+        return text
+
+    async def fit_json_async(self, data: Any, overhead: int = 0) -> str:
+        """Async variant of fit_json()."""
+        raw_tokens, compacted, text = self._json_input(data)
+        tokens = await self.count_async(text)
+        limit = self._limit(overhead)
+        truncated = limit is not None and tokens > limit
+        if truncated:
+            for max_chars in JSON_SHRINK_STEPS:
+                text = _dumps(_shrink(compacted, max_chars))
+                tokens = await self.count_async(text)
+                if tokens <= limit:
+                    break
+        self._record(raw_tokens, tokens, truncated, over_budget=truncated and tokens > limit)
+        return text
+
+    @staticmethod
+    def _collapse(text: str) -> str:
+        return "\n".join(line.rstrip() for line in text.strip().splitlines() if line.strip())
+
+    def _finish_text(self, raw_tokens: int, fitted: str, tokens: int, overhead: int) -> str:
+        limit = self._limit(overhead)
+        truncated = limit is not None and tokens > limit
+        if truncated:
+            fitted = self._cut(fitted, limit)
+            tokens = estimate_tokens(fitted)
+        self._record(raw_tokens, tokens, truncated)
+        return fitted
+
+    def fit_text(self, text: str, overhead: int = 0) -> str:
+        """`text` with blank-line runs collapsed, cut to the budget minus `overhead` tokens."""
+        fitted = self._collapse(text)
+        return self._finish_text(estimate_tokens(text), fitted, self.count(fitted), overhead)
+
+    async def fit_text_async(self, text: str, overhead: int = 0) -> str:
+        """Async variant of fit_text()."""
+        fitted = self._collapse(text)
+        return self._finish_text(estimate_tokens(text), fitted, await self.count_async(fitted), overhead)
+
+    def fit_contents(self, contents: List[Any], overhead: int = 0) -> List[Any]:
+        """
+        Fits a multi-part request (text and media parts, e.g. a loaded document).
+        Media parts are kept as they are; the remaining budget is split over the
+        text parts in proportion to their length.
+        """
+        texts = [part for part in contents if isinstance(part, str)]
+        raw_tokens = estimate_tokens(contents)
+        limit = self._limit(overhead + estimate_tokens([part for part in contents if not isinstance(part, str)]))
+        text_tokens = self.count(texts) if texts else 0
+        if limit is None or text_tokens <= limit:
+            self._record(raw_tokens, raw_tokens, False)
+            return contents
+
+        fitted = [self._cut(part, limit * estimate_tokens(part) // max(text_tokens, 1)) if isinstance(part, str) else part
+                  for part in contents]
+        self._record(raw_tokens, estimate_tokens(fitted), True)
+        return fitted
+
+    @staticmethod
+    def _cut(text: str, tokens: int) -> str:
+        """Keeps the first two thirds and the last third of a `tokens`-sized window, marking the gap."""
+        max_chars = max(tokens, 1) * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        head = max_chars * 2 // 3
+        tail = max_chars - head
+        omitted = len(text) - head - tail
+        return f"{text[:head]}\n[... {omitted} characters omitted to fit the token budget ...]\n{text[len(text) - tail:]}"
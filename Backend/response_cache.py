@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Builds a stable SHA-256 hex digest over the given parts.
+    Bytes-like parts are hashed raw, everything else is hashed as canonical JSON.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(part)
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class PersistentLRUCache:
+    """
+    SQLite-backed string cache that survives process restarts.
+
+    Entries live in a single table partitioned by namespace, so several caches
+    can share one file. Once a namespace exceeds max_entries or max_bytes, the
+    least recently used entries are evicted first. With ttl_seconds, entries
+    older than the TTL count as misses and are dropped, so they get refreshed.
+    """
+
+    def __init__(self, path: str, namespace: str = "default", max_entries: int = 1000, max_bytes: int = 100 * 1024 * 1024,
+                 ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_lru ON cache_entries (namespace, last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """Looks up several keys in one query; returns only the live hits."""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        now = time.time()
+        with self._lock:
+            placeholders = ", ".join("?" for _ in keys)
+            rows = self._conn.execute(
+                f"SELECT key, value, created_at FROM cache_entries WHERE namespace = ? AND key IN ({placeholders})",
+                (self.namespace, *keys)
+            ).fetchall()
+
+            found = {}
+            stale = []
+            for key, value, created_at in rows:
+                if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                    stale.append((self.namespace, key))
+                else:
+                    found[key] = value
+
+            if stale:
+                self._conn.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", stale)
+                self.expired += len(stale)
+            if found:
+                self._conn.executemany(
+                    "UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                    [(now, self.namespace, key) for key in found]
+                )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return found
+
+    def set(self, key: str, value: str) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, str]) -> None:
+        """Stores several entries in one transaction."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.namespace, key, value, len(value.encode("utf-8")), now, now) for key, value in items.items()]
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            )
+            return cursor.rowcount > 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def _evict(self) -> None:
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+            (self.namespace,)
+        ).fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # Walk from the least recently used entry until both bounds hold again,
+        # reading rows off the LRU index only as far as needed.
+        doomed = []
+        cursor = self._conn.execute(
+            "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY last_access",
+            (self.namespace,)
+        )
+        try:
+            for key, size in cursor:
+                if count <= self.max_entries and total_bytes <= self.max_bytes:
+                    break
+                doomed.append((self.namespace, key))
+                count -= 1
+                total_bytes -= size
+        finally:
+            cursor.close()
+        self._conn.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", doomed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+                (self.namespace,)
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "entries": count,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class TTLCache:
+    """
+    In-process LRU cache with a per-entry TTL, for hot results that are cheap
+    to lose on restart. Lookups are a dict access under a lock.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
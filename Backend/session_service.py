@@ -1,13 +1,181 @@
 import json
+import time
 import uuid
+import queue
+import atexit
+import threading
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import aliased, selectinload
 
 from database import db, Session, Event
 
+LAST_EVENT_PREVIEW_CHARS = 120
+
+
+class EventWriteBehindQueue:
+    """
+    Background writer for session events.
+
+    Callers enqueue event batches and return immediately; a single writer
+    thread drains the queue and commits up to batch_size batches per
+    transaction in its own app context. If that transaction fails, it is
+    rolled back and each batch is written in a transaction of its own, so a
+    bad batch (e.g. an IntegrityError) only loses itself; transient errors (a
+    locked database, a dropped connection) are retried up to max_retries
+    times with exponential backoff. Because there is one writer consuming a
+    FIFO queue, events keep their submission order within every session.
+    The queue is bounded: when full, submit() blocks for up to put_timeout
+    seconds and then reports failure so the caller can write synchronously.
+    flush() waits at most flush_timeout seconds and then logs and returns, so a
+    stuck writer makes reads stale rather than hanging them; if the writer
+    thread dies, the queue stops accepting batches and releases every waiter.
+    """
+
+    def __init__(self, app, service: "DatabaseSessionService", max_queue_size: int = 10000, batch_size: int = 200, put_timeout: float = 1.0,
+                 max_retries: int = 3, retry_backoff: float = 0.1, flush_timeout: float = 30.0):
+        self.app = app
+        self.service = service
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.flush_timeout = flush_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # Batches submitted but not yet written (or given up on), per (user_id, session_id).
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._pending_changed = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id: str, session_id: str, events: List[Dict[str, Any]]) -> bool:
+        with self._pending_changed:
+            if self._stopped:
+                return False
+            self._pending[(user_id, session_id)] = self._pending.get((user_id, session_id), 0) + 1
+        try:
+            self._queue.put((user_id, session_id, events), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self._done([(user_id, session_id, events)])
+            return False
+
+    def flush(self, user_id: Optional[str] = None, session_id: Optional[str] = None) -> None:
+        """
+        Blocks until the batches submitted so far for one session of `user_id`
+        (all of the user's sessions without session_id, everything without
+        user_id) have been committed or given up on, or flush_timeout expires.
+        """
+        def waiting() -> List[Tuple[str, str]]:
+            return [key for key in self._pending if user_id is None or (key[0] == user_id and session_id in (None, key[1]))]
+
+        with self._pending_changed:
+            if not self._pending_changed.wait_for(lambda: not waiting(), timeout=self.flush_timeout):
+                batches = sum(self._pending[key] for key in waiting())
+                print(f"[EventWriter] Flush timed out after {self.flush_timeout}s with {batches} event batches still queued; reading without them.")
+
+    def shutdown(self) -> None:
+        """Flushes pending events and stops the writer thread."""
+        if self._stopped:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._stopped = True
+
+    def _run(self) -> None:
+        try:
+            self._drain()
+        finally:
+            # Drained at shutdown or killed by an unexpected error: either way nothing will
+            # write what is left, so refuse new batches and release anyone flushing.
+            with self._pending_changed:
+                self._stopped = True
+                if self._pending:
+                    print(f"[EventWriter] Writer thread stopped with {sum(self._pending.values())} event batches unwritten.")
+                    self._pending.clear()
+                self._pending_changed.notify_all()
+
+    def _drain(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            pending = [entry for entry in batch if entry is not None]
+            if pending:
+                with self.app.app_context():
+                    self._write(pending)
+                self._done(pending)
+
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _write(self, pending: List[Tuple[str, str, List[Dict[str, Any]]]]) -> None:
+        try:
+            self.service._write_events(pending)
+            return
+        except Exception as e:
+            self.service._rollback()
+            print(f"[EventWriter] Writing {len(pending)} event batches failed, retrying them one by one: {e}")
+        for entry in pending:
+            self._write_one(entry)
+
+    def _write_one(self, entry: Tuple[str, str, List[Dict[str, Any]]]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.service._write_events([entry])
+                return
+            except Exception as e:
+                self.service._rollback()
+                if not self._is_transient(e) or attempt == self.max_retries:
+                    print(f"[EventWriter] Dropped {len(entry[2])} events for session {entry[1]} after {attempt + 1} attempts: {e}")
+                    return
+            time.sleep(self.retry_backoff * 2 ** attempt)
+
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        """A locked or busy database, or a dropped connection, can succeed on retry; constraint violations cannot."""
+        return isinstance(error, OperationalError) or (isinstance(error, DBAPIError) and error.connection_invalidated)
+
+    def _done(self, entries: List[Tuple[str, str, List[Dict[str, Any]]]]) -> None:
+        with self._pending_changed:
+            for user_id, session_id, _ in entries:
+                key = (user_id, session_id)
+                if key not in self._pending:
+                    continue  # Already released when the writer thread stopped.
+                self._pending[key] -= 1
+                if not self._pending[key]:
+                    del self._pending[key]
+            self._pending_changed.notify_all()
+
+
 class DatabaseSessionService:
     def __init__(self, app_name: str = "medical_agent"):
         self.app_name = app_name
+        self._writer: Optional[EventWriteBehindQueue] = None
+
+    def enable_write_behind(self, app, max_queue_size: int = 10000, batch_size: int = 200, flush_timeout: float = 30.0) -> None:
+        """Switches log_events to the background writer; pending events are flushed at exit."""
+        if self._writer is None:
+            self._writer = EventWriteBehindQueue(app, self, max_queue_size=max_queue_size, batch_size=batch_size,
+                                                 flush_timeout=flush_timeout)
+            atexit.register(self._writer.shutdown)
+
+    def flush_pending_events(self, user_id: Optional[str] = None, session_id: Optional[str] = None) -> None:
+        """Waits for the queued write-behind events of one session (or user) so reads observe them."""
+        if self._writer is not None:
+            self._writer.flush(user_id, session_id)
     
     def create_session(self, user_id: str, session_id: Optional[str] = None, initial_state: Optional[Dict] = None) -> Session:
         if session_id is None:
@@ -28,10 +196,62 @@ class DatabaseSessionService:
         return session
     
     def get_session(self, user_id: str, session_id: str) -> Optional[Session]:
+        self.flush_pending_events(user_id, session_id)
         return Session.query.filter_by(id=session_id, app_name=self.app_name, user_id=user_id).first()
     
-    def list_sessions(self, user_id: str) -> List[Session]:
-        return Session.query.filter_by(app_name=self.app_name, user_id=user_id).order_by(Session.updated_at.desc()).all()
+    def list_sessions(self, user_id: str, include_events: bool = False) -> List[Session]:
+        self.flush_pending_events(user_id)
+        query = Session.query.filter_by(app_name=self.app_name, user_id=user_id)
+        if include_events:
+            # One extra IN query for all events instead of one lazy load per session.
+            query = query.options(selectinload(Session.events))
+        return query.order_by(Session.updated_at.desc()).all()
+
+    def list_session_summaries(self, user_id: str) -> List[Dict]:
+        """
+        Sidebar projection of a user's sessions (timestamps, event count and a
+        preview of the latest event) from one aggregated query, without loading events.
+        """
+        self.flush_pending_events(user_id)
+        event_stats = (
+            db.session.query(
+                Event.session_id.label('session_id'),
+                func.count(Event.id).label('event_count'),
+                func.max(Event.id).label('last_event_id')
+            )
+            .join(Session, Session.id == Event.session_id)
+            .filter(Session.app_name == self.app_name, Session.user_id == user_id)
+            .group_by(Event.session_id)
+            .subquery()
+        )
+        last_event = aliased(Event)
+
+        rows = (
+            db.session.query(
+                Session,
+                event_stats.c.event_count,
+                last_event.role,
+                func.substr(last_event.content, 1, LAST_EVENT_PREVIEW_CHARS),
+                last_event.timestamp
+            )
+            .outerjoin(event_stats, event_stats.c.session_id == Session.id)
+            .outerjoin(last_event, last_event.id == event_stats.c.last_event_id)
+            .filter(Session.app_name == self.app_name, Session.user_id == user_id)
+            .order_by(Session.updated_at.desc())
+            .all()
+        )
+
+        summaries = []
+        for session, event_count, role, preview, timestamp in rows:
+            last = None
+            if role is not None:
+                last = {
+                    'role': role,
+                    'content_preview': preview,
+                    'timestamp': timestamp.isoformat() if timestamp else None
+                }
+            summaries.append(session.to_summary_dict(event_count or 0, last))
+        return summaries
     
     def delete_session(self, user_id: str, session_id: str) -> bool:
         session = self.get_session(user_id, session_id)
@@ -51,27 +271,69 @@ class DatabaseSessionService:
         return None
     
     def add_event(self, user_id: str, session_id: str, role: str, content: str, metadata: Optional[Dict] = None) -> Optional[Event]:
-        session = self.get_session(user_id, session_id)
-        if not session:
-            session = self.create_session(user_id, session_id)
-        
-        event = Event(
-            session_id=session_id,
-            role=role,
-            content=content,
-            event_metadata=json.dumps(metadata or {})
-        )
-        db.session.add(event)
-        session.updated_at = datetime.utcnow()
+        return self.add_events(user_id, session_id, [{"role": role, "content": content, "metadata": metadata}])[0]
+
+    def add_events(self, user_id: str, session_id: str, events: List[Dict[str, Any]]) -> List[Event]:
+        """
+        Appends events (dicts with 'role', 'content' and optional 'metadata'/'timestamp')
+        in order, creating the session if needed, in a single transaction.
+        """
+        self.flush_pending_events(user_id, session_id)
+        created = self._write_events([(user_id, session_id, events)])
+        return created[0]
+
+    def log_events(self, user_id: str, session_id: str, events: List[Dict[str, Any]]) -> None:
+        """
+        Fire-and-forget variant of add_events used on the request path: queued to the
+        write-behind writer when enabled (timestamps are taken now), otherwise written inline.
+        """
+        if self._writer is not None:
+            now = datetime.utcnow()
+            stamped = [{**event, "timestamp": event.get("timestamp") or now} for event in events]
+            if self._writer.submit(user_id, session_id, stamped):
+                return
+        self.add_events(user_id, session_id, events)
+
+    def _write_events(self, batches: List[Any]) -> List[List[Event]]:
+        """Writes (user_id, session_id, events) batches with one lookup per session and one commit."""
+        sessions = {}
+        created = []
+        for user_id, session_id, events in batches:
+            session = sessions.get((user_id, session_id))
+            if session is None:
+                session = Session.query.filter_by(id=session_id, app_name=self.app_name, user_id=user_id).first()
+                if session is None:
+                    session = Session(id=session_id, app_name=self.app_name, user_id=user_id, state=json.dumps({}))
+                    db.session.add(session)
+                sessions[(user_id, session_id)] = session
+
+            batch_events = []
+            for event_data in events:
+                event = Event(
+                    session_id=session_id,
+                    role=event_data["role"],
+                    content=event_data["content"],
+                    event_metadata=json.dumps(event_data.get("metadata") or {})
+                )
+                if event_data.get("timestamp"):
+                    event.timestamp = event_data["timestamp"]
+                db.session.add(event)
+                batch_events.append(event)
+            session.updated_at = datetime.utcnow()
+            created.append(batch_events)
+
         db.session.commit()
-        return event
+        return created
+
+    def _rollback(self) -> None:
+        db.session.rollback()
     
     def get_events(self, user_id: str, session_id: str, limit: Optional[int] = None) -> List[Event]:
         session = self.get_session(user_id, session_id)
         if not session:
             return []
         
-        query = Event.query.filter_by(session_id=session_id).order_by(Event.timestamp)
+        query = Event.query.filter_by(session_id=session_id).order_by(Event.timestamp, Event.id)
         if limit:
             query = query.limit(limit)
         return query.all()
@@ -91,7 +353,7 @@ class DatabaseSessionService:
         if not session:
             return
         
-        events = Event.query.filter_by(session_id=session_id).order_by(Event.timestamp).all()
+        events = Event.query.filter_by(session_id=session_id).order_by(Event.timestamp, Event.id).all()
         if len(events) > max_events:
             events_to_delete = events[:-max_events]
             for event in events_to_delete:
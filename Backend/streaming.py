@@ -0,0 +1,99 @@
+import json
+from typing import Any, List, Tuple
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class JsonFieldStream:
+    """
+    Incremental scanner for a streamed top-level JSON object.
+
+    Feed it raw text chunks as they arrive from the model; it reports each
+    top-level field as soon as its value is complete ("field" events) and each
+    element of a top-level array as soon as that element is complete ("item"
+    events), without waiting for the closing brace. The full text is kept in
+    `text` for final validation.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._expect_key = False
+        self._key = None
+        self._value_start = -1
+        self._item_start = -1
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        """Consumes a chunk and returns the (kind, key, value) events it completed."""
+        self.text += chunk
+        events = []
+        text = self.text
+
+        while self._pos < len(text):
+            i = self._pos
+            c = text[i]
+            self._pos += 1
+            depth = len(self._stack)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if depth == 1 and self._expect_key:
+                        self._key = json.loads(text[self._string_start:i + 1])
+                        self._expect_key = False
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                self._stack.append(c)
+                if len(self._stack) == 1:
+                    self._expect_key = True
+                elif len(self._stack) == 2 and c == "[":
+                    self._item_start = i + 1
+            elif c in "}]":
+                if depth == 2 and self._stack[-1] == "[":
+                    self._emit_item(text[self._item_start:i], events)
+                self._stack.pop()
+                if depth == 1:
+                    self._emit_field(text[self._value_start:i], events)
+            elif c == ":" and depth == 1:
+                self._value_start = i + 1
+            elif c == ",":
+                if depth == 1:
+                    self._emit_field(text[self._value_start:i], events)
+                    self._expect_key = True
+                elif depth == 2 and self._stack[-1] == "[":
+                    self._emit_item(text[self._item_start:i], events)
+                    self._item_start = i + 1
+
+        return events
+
+    def _emit_field(self, raw: str, events: List[Tuple[str, str, Any]]) -> None:
+        if self._key is None or not raw.strip():
+            return
+        try:
+            events.append(("field", self._key, json.loads(raw)))
+        except json.JSONDecodeError:
+            pass
+        self._key = None
+
+    def _emit_item(self, raw: str, events: List[Tuple[str, str, Any]]) -> None:
+        if self._key is None or not raw.strip():
+            return
+        try:
+            events.append(("item", self._key, json.loads(raw)))
+        except json.JSONDecodeError:
+            pass
@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+# Agents and the app read these at import time; keep the suite offline and out of the real data files.
+_DATA_DIR = tempfile.mkdtemp(prefix="medical-agent-tests-")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_FAKE_LATENCY", "0.01")
+os.environ.setdefault("GENAI_WARMUP", "false")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_DATA_DIR, 'agent_data.db')}")
+os.environ.setdefault("EXTRACTION_CACHE_PATH", os.path.join(_DATA_DIR, "extraction_cache.db"))
+os.environ.setdefault("JOB_WORKERS", "0")
+
+import pytest
+
+from fake_llm import FakeGenAIClient
+
+
+@pytest.fixture
+def fake_client():
+    return FakeGenAIClient(latency=0.0, seed=0)
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """The `app` module, imported once against the temporary database and caches."""
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,64 @@
+import json
+import time
+import asyncio
+
+
+async def _post(asgi_app, path, payload):
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 5001)
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    return sent[0]["status"]
+
+
+def _burst(asgi_app):
+    async def burst():
+        return await asyncio.gather(*(
+            _post(asgi_app, "/doctor_assistant", {"symptoms": f"fever for {day} days", "use_cache": False})
+            for day in range(6)
+        ))
+
+    started = time.perf_counter()
+    statuses = asyncio.run(burst())
+    return statuses, time.perf_counter() - started
+
+
+def test_concurrent_requests_run_on_separate_threads(app_module, monkeypatch):
+    import asgi
+
+    monkeypatch.setattr(app_module.genai_client, "latency", 0.3)
+    monkeypatch.setattr(app_module.genai_client, "jitter", 0.0)
+
+    statuses, elapsed = _burst(asgi.asgi_app)
+
+    assert statuses == [200] * 6
+    # Serialized on one thread this takes 6 x 0.3s.
+    assert 0.3 <= elapsed < 1.2
+
+
+def test_requests_beyond_the_thread_limit_wait(app_module, monkeypatch):
+    import asgi
+
+    monkeypatch.setattr(app_module.genai_client, "latency", 0.3)
+    monkeypatch.setattr(app_module.genai_client, "jitter", 0.0)
+
+    statuses, elapsed = _burst(asgi.PooledWsgiToAsgi(app_module.app, max_threads=2))
+
+    assert statuses == [200] * 6
+    # Three rounds of two requests.
+    assert elapsed >= 0.9
@@ -0,0 +1,50 @@
+import io
+import time
+import uuid
+
+
+def _files(*names):
+    # Unique content per run, so the extraction cache never answers for the agent.
+    run = uuid.uuid4().hex
+    return [(io.BytesIO(f"{name} {run}: hemoglobin 13.5 g/dL".encode()), name) for name in names]
+
+
+def test_batch_extracts_concurrently_and_keeps_upload_order(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module.genai_client, "latency", 0.2)
+    monkeypatch.setattr(app_module.genai_client, "jitter", 0.0)
+
+    started = time.perf_counter()
+    response = client.post("/analyze_reports/batch", data={
+        "files": _files("a.txt", "b.txt", "c.txt", "d.txt", "broken.zip"),
+        "concurrency": "4"
+    }, content_type="multipart/form-data")
+    elapsed = time.perf_counter() - started
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert [result["filename"] for result in body["results"]] == ["a.txt", "b.txt", "c.txt", "d.txt", "broken.zip"]
+    assert [result["status"] for result in body["results"]] == ["success"] * 4 + ["error"]
+    assert (body["succeeded"], body["failed"]) == (4, 1)
+    assert "consultation_summary_markdown" in body
+    # Four extractions at 0.2s each plus one consultation: sequential would take at least 1s.
+    assert elapsed < 0.9
+
+
+def test_batch_validates_its_input(client, app_module):
+    assert client.post("/analyze_reports/batch", data={}, content_type="multipart/form-data").status_code == 400
+
+    too_many = _files(*[f"{n}.txt" for n in range(app_module.BATCH_MAX_FILES + 1)])
+    response = client.post("/analyze_reports/batch", data={"files": too_many}, content_type="multipart/form-data")
+    assert response.status_code == 400
+
+    response = client.post("/analyze_reports/batch", data={"files": _files("a.txt"), "concurrency": "many"},
+                           content_type="multipart/form-data")
+    assert response.status_code == 400
+
+
+def test_batch_without_consultation(client):
+    response = client.post("/analyze_reports/batch", data={"files": _files("a.txt"), "consultation": "false"},
+                           content_type="multipart/form-data")
+    body = response.get_json()
+    assert body["succeeded"] == 1
+    assert "consultation_summary_markdown" not in body
@@ -0,0 +1,61 @@
+import json
+
+from patient_advisor import (
+    CONSULTATION_MARKDOWN_HEADER, ConsultationSummaryJSON, PatientConsultantAgent, render_consultation_markdown
+)
+
+SUMMARY = {
+    "overall_summary": "Mostly normal results. Vitamin D is low.",
+    "key_findings": [
+        {"parameter_name": "Vitamin D", "status": "Low", "interpretation": "Below the normal range.", "image_tag": "[Image of sun exposure]"},
+        {"parameter_name": "Hemoglobin", "status": "Normal", "interpretation": "Within range."}
+    ],
+    "lifestyle_recommendations": ["Get morning sunlight", "Eat oily fish", "Walk daily"],
+    "when_to_see_doctor": ["Bone pain"],
+    "disclaimer": "Not medical advice."
+}
+
+
+def test_markdown_is_rendered_in_section_order():
+    markdown = render_consultation_markdown(ConsultationSummaryJSON.model_validate(SUMMARY))
+
+    assert markdown.startswith(CONSULTATION_MARKDOWN_HEADER)
+    positions = [markdown.index(title) for title in ("The Big Picture", "Key Findings", "Lifestyle", "When to see", "Disclaimer")]
+    assert positions == sorted(positions)
+    assert "- **Vitamin D:** Low" in markdown
+    assert "[Image of sun exposure]" in markdown
+    assert markdown.endswith("*Disclaimer: Not medical advice.*")
+
+
+def test_empty_findings_render_a_placeholder():
+    markdown = render_consultation_markdown(ConsultationSummaryJSON.model_validate({**SUMMARY, "key_findings": []}))
+    assert "- No notable findings." in markdown
+
+
+def test_parse_summary_pairs_json_with_markdown():
+    parsed = PatientConsultantAgent.parse_summary(json.dumps(SUMMARY))
+    assert parsed["json"]["key_findings"][0]["parameter_name"] == "Vitamin D"
+    assert "Vitamin D" in parsed["markdown"]
+
+
+def test_parse_summary_reports_invalid_and_failed_calls():
+    assert "error" in PatientConsultantAgent.parse_summary('{"overall_summary": "missing fields"}')
+    assert PatientConsultantAgent.parse_summary("Error generating consultation: boom") == {"error": "Error generating consultation: boom"}
+
+
+def test_consultation_summary_uses_one_structured_call(fake_client):
+    agent = PatientConsultantAgent(client=fake_client)
+    result = agent.generate_consultation_summary({"document_type": "Diagnostic"}, {"name": "A", "age": 40})
+
+    assert fake_client.calls == 1
+    assert set(result) == {"json", "markdown"}
+
+
+def test_structured_calls_send_the_guidelines_without_the_markdown_layout():
+    agent = PatientConsultantAgent(client=object())
+    request = agent._build_request({"lab_results": []}, json_output=True)
+
+    instruction = request["config"].system_instruction
+    assert "### RESPONSE GUIDELINES" in instruction
+    assert "Dr. AI Summary" not in instruction and "OUTPUT FORMAT" not in instruction
+    assert request["config"].response_schema is ConsultationSummaryJSON
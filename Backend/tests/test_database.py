@@ -0,0 +1,62 @@
+from flask import Flask
+from sqlalchemy import create_engine, inspect, select, text
+
+from database import db, Event, engine_options_for, init_db, run_migrations
+
+
+def _composite_indexes(engine):
+    inspector = inspect(engine)
+    return {index["name"] for table in ("sessions", "events", "memories") for index in inspector.get_indexes(table)}
+
+
+def test_migrations_add_missing_indexes_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    db.metadata.create_all(engine)
+    declared = _composite_indexes(engine)
+    assert "ix_events_session_timestamp" in declared
+
+    # A database created before the indexes were declared.
+    with engine.begin() as conn:
+        for name in declared:
+            conn.execute(text(f"DROP INDEX {name}"))
+    assert _composite_indexes(engine) == set()
+
+    assert run_migrations(engine) == ["0001_composite_indexes"]
+    assert _composite_indexes(engine) == declared
+    assert run_migrations(engine) == []
+
+
+def test_session_event_reads_use_the_composite_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plan.db'}")
+    db.metadata.create_all(engine)
+    run_migrations(engine)
+
+    query = select(Event).where(Event.session_id == "s").order_by(Event.timestamp)
+    statement = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        plan = " ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {statement}")))
+    assert "ix_events_session_timestamp" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_engine_options_per_backend(monkeypatch):
+    monkeypatch.setenv("DB_SQLITE_BUSY_TIMEOUT_MS", "2500")
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    assert engine_options_for("sqlite:///x.db") == {"connect_args": {"timeout": 2.5, "check_same_thread": False}}
+
+    options = engine_options_for("postgresql+psycopg://user:pass@db/agent")
+    assert options["pool_size"] == 3
+    assert options["pool_pre_ping"] is True
+
+
+def test_init_db_uses_the_given_url_and_tunes_sqlite(tmp_path):
+    app = Flask(__name__)
+    init_db(app, f"sqlite:///{tmp_path / 'tuned.db'}")
+
+    with app.app_context():
+        assert db.engine.url.database == str(tmp_path / "tuned.db")
+        with db.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        assert app.config["MEMORY_FTS_ENABLED"]
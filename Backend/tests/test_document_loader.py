@@ -0,0 +1,200 @@
+import io
+import os
+import signal
+import time
+import warnings
+
+import docx
+import pymupdf
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from google.genai import types
+
+from document_loader import PdfPageExtractor, SmartLoader, extract_page_texts, read_source
+
+
+def _docx_bytes(*paragraphs):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def test_read_source_accepts_every_source_kind(tmp_path):
+    data = b"hemoglobin 13.5 g/dL"
+    path = tmp_path / "report.txt"
+    path.write_bytes(data)
+    stream = io.BytesIO(data)
+    stream.read()
+
+    assert read_source(data) is data
+    assert read_source(bytearray(data)) == data
+    assert read_source(memoryview(data)) == data
+    assert read_source(str(path)) == data
+    # Streams are rewound first, so a buffer someone already read is still complete.
+    assert read_source(stream) == data
+
+
+def test_process_reads_bytes_streams_and_paths_alike(tmp_path):
+    loader = SmartLoader()
+    content = _docx_bytes("Glucose: 95 mg/dL", "Cholesterol: 180 mg/dL")
+    path = tmp_path / "labs.docx"
+    path.write_bytes(content)
+
+    expected = "Glucose: 95 mg/dL\nCholesterol: 180 mg/dL"
+    assert loader.process(content, "labs.docx") == expected
+    assert loader.process(io.BytesIO(content), "labs.docx") == expected
+    assert loader.process_file(str(path)) == expected
+    assert loader.process(memoryview(b"plain text"), "notes.txt") == "plain text"
+
+
+def test_process_rejects_unsupported_formats():
+    with pytest.raises(ValueError):
+        SmartLoader().process(b"", "archive.zip")
+
+
+def test_small_uploads_stay_in_memory(app_module):
+    limit = app_module.UPLOAD_SPOOL_MAX_BYTES
+    stream = app_module.SpooledUploadRequest({})._get_file_stream(0, "application/pdf")
+    stream.write(b"x" * (limit // 2))
+    assert not stream._rolled
+    stream.write(b"x" * limit)
+    assert stream._rolled
+
+
+TEXT_LINE = "Hemoglobin 13.5 g/dL, reference range 13.0 - 17.0 g/dL, within limits."
+
+
+def _pdf_bytes(kinds):
+    """A PDF with one page per entry: "text" pages have a text layer, "scan" pages only an image."""
+    document = pymupdf.open()
+    image = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, 32, 32), False)
+    image.clear_with(200)
+    for number, kind in enumerate(kinds):
+        page = document.new_page()
+        if kind == "text":
+            page.insert_text((72, 72), f"Page {number + 1}: {TEXT_LINE}", fontsize=9)
+        else:
+            page.insert_image(pymupdf.Rect(72, 72, 300, 300), pixmap=image)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def test_text_pdf_is_returned_as_text():
+    result = SmartLoader().load_pdf(_pdf_bytes(["text", "text"]))
+    assert isinstance(result, str)
+    assert "Page 1:" in result and "Page 2:" in result
+
+
+def test_scanned_pdf_goes_to_vision_whole():
+    data = _pdf_bytes(["scan"] * 3)
+    result = SmartLoader().load_pdf(data)
+    assert isinstance(result, types.Part)
+    assert result.inline_data.mime_type == "application/pdf"
+    assert result.inline_data.data == data
+
+
+def test_mixed_pdf_renders_only_scanned_pages_in_order():
+    result = SmartLoader().load_pdf(_pdf_bytes(["text", "text", "scan", "text"]))
+
+    assert isinstance(result, list)
+    assert result[0].startswith("[Page 1]") and "[Page 2]" in result[0]
+    assert result[1] == "[Page 3: scanned image]"
+    assert result[2].inline_data.mime_type == "image/jpeg"
+    assert result[3].startswith("[Page 4]")
+    assert len(result) == 4
+
+
+@pytest.fixture
+def extractor():
+    extractor = PdfPageExtractor(workers=2, min_pages=1, timeout=30)
+    yield extractor
+    extractor.shutdown()
+
+
+def test_parallel_extraction_matches_in_process(extractor):
+    data = _pdf_bytes(["text"] * 20)
+    assert extractor._context.get_start_method() in ("forkserver", "spawn")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        texts = extractor.extract(data, 20)
+    assert texts == extract_page_texts(data, 0, 20)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def _wait_until_dead(pids, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while any(_is_alive(pid) for pid in pids) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return not any(_is_alive(pid) for pid in pids)
+
+
+def test_timeout_retires_the_pool_without_breaking_other_documents(extractor):
+    extractor.timeout = 0.0
+    other = extractor._checkout()  # Another request's document, still running on the pool.
+    running = other.executor.submit(time.sleep, 0.5)
+
+    with pytest.raises(TimeoutError):
+        extractor.extract(_pdf_bytes(["text"] * 20), 20)
+    assert extractor._checkout() is not other
+
+    assert running.result(timeout=5) is None
+    pids = other.worker_pids()
+    assert pids and all(_is_alive(pid) for pid in pids)
+    extractor._checkin(other)
+    assert _wait_until_dead(pids)
+
+
+def test_killed_worker_is_replaced_on_the_next_extraction(extractor):
+    data = _pdf_bytes(["text"] * 20)
+    assert extractor.extract(data, 20) == extract_page_texts(data, 0, 20)
+    pool = extractor._pool
+
+    pid = next(iter(pool.worker_pids()))
+    os.kill(pid, signal.SIGKILL)
+    # The worker is reaped once the pool has noticed the death and marked itself broken.
+    assert _wait_until_dead([pid])
+    assert extractor.extract(data, 20) == extract_page_texts(data, 0, 20)
+    assert extractor._pool is not pool
+
+
+class _TimingOutExtractor:
+    def enabled_for(self, page_count):
+        return True
+
+    def extract(self, data, page_count):
+        raise TimeoutError("PDF text extraction exceeded 0.1s")
+
+
+def test_extraction_timeout_falls_back_to_vision():
+    data = _pdf_bytes(["text"] * 3)
+    result = SmartLoader(page_extractor=_TimingOutExtractor()).load_pdf(data)
+    assert isinstance(result, types.Part)
+    assert result.inline_data.mime_type == "application/pdf"
+
+
+class _BrokenPoolExtractor(_TimingOutExtractor):
+    def extract(self, data, page_count):
+        raise BrokenProcessPool("A child process terminated abruptly")
+
+
+def test_repeatedly_broken_pool_falls_back_to_vision():
+    data = _pdf_bytes(["text"] * 3)
+    result = SmartLoader(page_extractor=_BrokenPoolExtractor()).load_pdf(data)
+    assert isinstance(result, types.Part)
+    assert result.inline_data.mime_type == "application/pdf"
+
+
+def test_unreadable_pdf_fails_instead_of_returning_empty_text():
+    assert SmartLoader().process(b"not a pdf", "report.pdf") is None
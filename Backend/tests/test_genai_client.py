@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from genai_client import build_http_options
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.peers.append(self.client_address)
+        chunks = [b"echo:", body, b":done"]
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.peers = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_async_calls_on_fresh_loops_reuse_the_shared_pool(server):
+    options = build_http_options(max_connections=4)
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    async def call(payload):
+        async with httpx.AsyncClient(**options.async_client_args) as client:
+            return (await client.post(url, content=payload)).text
+
+    # Like Flask async views: every request runs on its own event loop.
+    assert asyncio.run(call(b"first")) == "echo:first:done"
+    assert asyncio.run(call(b"second")) == "echo:second:done"
+    assert asyncio.run(call(b"third")) == "echo:third:done"
+
+    assert len(server.peers) == 3
+    assert len(set(server.peers)) == 1
+
+
+def test_async_responses_stream_in_chunks(server):
+    options = build_http_options()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    async def stream():
+        async with httpx.AsyncClient(**options.async_client_args) as client:
+            async with client.stream("POST", url, content=b"x") as response:
+                return [chunk async for chunk in response.aiter_raw()]
+
+    assert b"".join(asyncio.run(stream())) == b"echo:x:done"
+
+
+class _SlowHandler(_Handler):
+    def do_POST(self):
+        time.sleep(0.2)
+        super().do_POST()
+
+
+def test_more_concurrent_async_calls_than_connections_do_not_time_out():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+    server.peers = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        options = build_http_options(max_connections=4, pool_timeout=2.0)
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+        async def burst():
+            async with httpx.AsyncClient(**options.async_client_args) as client:
+                responses = await asyncio.gather(*(client.post(url, content=b"%d" % i) for i in range(16)))
+                return [response.text for response in responses]
+
+        # 16 calls over 4 connections at 0.2s each take ~0.8s; a stalled pool would raise PoolTimeout after 2s.
+        assert asyncio.run(burst()) == [f"echo:{i}:done" for i in range(16)]
+        # Calls are awaited on the pool loop, not parked on worker threads.
+        assert [thread.name for thread in threading.enumerate() if thread.name.startswith("genai-http")] == ["genai-http-loop"]
+    finally:
+        server.shutdown()
+        server.server_close()
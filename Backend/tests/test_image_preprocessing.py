@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_preprocessing import ImageNormalizer, EXIF_ORIENTATION_TAG
+
+
+def _image_bytes(size, format="JPEG", mode="RGB", orientation=None):
+    image = Image.new(mode, size, (250, 250, 240) if mode == "RGB" else (250, 250, 240, 0))
+    buffer = io.BytesIO()
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION_TAG] = orientation
+        image.save(buffer, format=format, exif=exif)
+    else:
+        image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def _decoded(result):
+    return Image.open(io.BytesIO(result["data"]))
+
+
+def test_large_images_are_downscaled_and_reencoded():
+    normalizer = ImageNormalizer(max_dimension=1000)
+    data = _image_bytes((4000, 3000), format="PNG")
+
+    result = normalizer.normalize(data, "scan.png")
+    assert (result["width"], result["height"]) == (1000, 750)
+    assert result["mime_type"] == "image/jpeg"
+    assert _decoded(result).format == "JPEG"
+    assert result["bytes_saved"] == len(data) - len(result["data"]) > 0
+
+
+def test_exif_orientation_is_applied():
+    result = ImageNormalizer().normalize(_image_bytes((300, 100), orientation=6))
+    assert (result["width"], result["height"]) == (100, 300)
+    assert _decoded(result).getexif().get(EXIF_ORIENTATION_TAG, 1) == 1
+
+
+def test_small_unchanged_images_keep_their_original_bytes():
+    # A tiny flat PNG compresses far better than any JPEG re-encode would.
+    data = _image_bytes((20, 20), format="PNG")
+    result = ImageNormalizer().normalize(data)
+    assert result["data"] is data
+    assert result["mime_type"] == "image/png"
+    assert result["bytes_saved"] == 0
+
+
+def test_transparency_is_flattened_and_grayscale_applied():
+    data = _image_bytes((50, 50), format="PNG", mode="RGBA")
+    result = ImageNormalizer(grayscale=True, autocontrast=True).normalize(data)
+    assert _decoded(result).mode == "L"
+
+    result = ImageNormalizer(max_dimension=40).normalize(data)
+    assert _decoded(result).getpixel((0, 0)) == pytest.approx((255, 255, 255), abs=2)
+
+
+def test_stats_accumulate_and_bad_input_raises():
+    normalizer = ImageNormalizer(max_dimension=100)
+    normalizer.normalize(_image_bytes((400, 400)))
+    normalizer.normalize(_image_bytes((400, 400)))
+
+    stats = normalizer.stats()
+    assert stats["images"] == 2
+    assert stats["bytes_saved"] == stats["bytes_in"] - stats["bytes_out"] > 0
+
+    with pytest.raises(Exception):
+        normalizer.normalize(b"not an image")
+    with pytest.raises(ValueError):
+        ImageNormalizer(output_format="GIF")
@@ -0,0 +1,131 @@
+import json
+import time
+import threading
+
+import pytest
+
+from database import db, Job
+from job_queue import JobQueue
+from fake_llm import FakeGenAIClient
+from google.genai import errors
+from llm_scheduler import CircuitOpenError, is_transient_failure, track_llm_failures
+from multimodel_medical_agent import MultimodalMedicalAgent
+
+
+def _wait_for(queue, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish: {queue.get(job_id)}")
+
+
+@pytest.fixture
+def make_queue(app_module):
+    queues = []
+
+    def make(handlers, **options):
+        options = {"workers": 1, "poll_interval": 0.05, "retry_delay_seconds": 0, **options}
+        queue = JobQueue(app_module.app, handlers, **options)
+        queue.start()
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.shutdown()
+
+
+def _lease_expires_at(app_module, job_id):
+    with app_module.app.app_context():
+        return db.session.get(Job, job_id).lease_expires_at
+
+
+def test_workers_run_only_after_start(app_module):
+    queue = JobQueue(app_module.app, {"echo": lambda payload, data: payload}, workers=1, poll_interval=0.05)
+    try:
+        job_id = queue.submit("echo", {"value": 1})
+        time.sleep(0.2)
+        assert queue.get(job_id)["status"] == "queued"
+
+        queue.start()
+        assert _wait_for(queue, job_id)["status"] == "succeeded"
+    finally:
+        queue.shutdown()
+
+
+def test_heartbeat_keeps_long_jobs_leased(app_module, make_queue):
+    started = threading.Event()
+    calls = []
+
+    def slow(payload, data):
+        calls.append(payload)
+        started.set()
+        time.sleep(2.5)
+        return {"status": "success"}
+
+    queue = make_queue({"slow": slow}, lease_seconds=1, heartbeat_seconds=0.2)
+    job_id = queue.submit("slow", {"n": 1})
+    assert started.wait(5)
+    first_lease = _lease_expires_at(app_module, job_id)
+    time.sleep(0.5)
+    assert _lease_expires_at(app_module, job_id) > first_lease
+
+    # A second worker polling the table must not take the job over while it runs.
+    make_queue({"slow": slow}, lease_seconds=1)
+    job = _wait_for(queue, job_id)
+
+    assert job["status"] == "succeeded"
+    assert job["attempts"] == 1
+    assert len(calls) == 1
+
+
+def test_transient_error_results_are_retried(make_queue):
+    results = [{"error": "Extraction Agent Failed: API Error: 429 RESOURCE_EXHAUSTED", "retryable": True},
+               {"status": "success"}]
+    queue = make_queue({"flaky": lambda payload, data: results.pop(0)})
+
+    job = _wait_for(queue, queue.submit("flaky", {}))
+    assert job["status"] == "succeeded"
+    assert job["attempts"] == 2
+
+
+def test_permanent_error_results_fail_at_once(make_queue):
+    calls = []
+
+    def invalid(payload, data):
+        calls.append(1)
+        return {"error": "Extraction Error: The AI failed to generate valid JSON data."}
+
+    queue = make_queue({"invalid": invalid})
+    job = _wait_for(queue, queue.submit("invalid", {}))
+    assert job["status"] == "failed"
+    assert job["attempts"] == 1
+    assert len(calls) == 1
+
+
+def _client_error(code, status, message):
+    return errors.ClientError(code, {"error": {"code": code, "status": status, "message": message}})
+
+
+def test_transient_failures_are_judged_by_status_code():
+    assert is_transient_failure(_client_error(429, "RESOURCE_EXHAUSTED", "Quota exceeded."))
+    assert is_transient_failure(errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "Overloaded."}}))
+    assert is_transient_failure(CircuitOpenError("Circuit open for model 'gemini-2.5-flash'"))
+    # Numbers that only look like retryable statuses do not count.
+    assert not is_transient_failure(_client_error(400, "INVALID_ARGUMENT", "Request of 429 bytes: potassium 503 mmol/L"))
+    assert not is_transient_failure(ValueError("Timeout of 504 ms exceeded"))
+
+
+def test_mark_retryable_uses_the_failures_agents_caught(app_module):
+    with track_llm_failures() as failures:
+        result = json.loads(MultimodalMedicalAgent(client=FakeGenAIClient(latency=0.0, error_rate=1.0)).analyze_bytes(b"text", "report.txt"))
+    assert "error" in result and len(failures) == 1
+    assert app_module.mark_retryable(result, failures)["retryable"] is True
+
+    permanent = [_client_error(400, "INVALID_ARGUMENT", "429 RESOURCE_EXHAUSTED quoted from the document")]
+    assert "retryable" not in app_module.mark_retryable({"error": "API Error: 400 INVALID_ARGUMENT ... 429 ..."}, permanent)
+    assert "retryable" not in app_module.mark_retryable({"error": "Loader Error: bad file"}, [])
+    assert "retryable" not in app_module.mark_retryable({"status": "success"}, failures)
@@ -0,0 +1,82 @@
+import time
+import random
+import asyncio
+
+import pytest
+from google.genai import errors, types
+
+from benchmarks.loadtest import InProcessTarget, make_call, parse_mix
+from fake_llm import FakeGenAIClient
+from llm_backend import RecordingClient, RecordingStore, ReplayClient, build_backend, request_fingerprint
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "recordings" / "responses.jsonl")
+
+
+def _record(store_path):
+    recording = RecordingClient(FakeGenAIClient(latency=0.1), RecordingStore(store_path))
+    config = types.GenerateContentConfig(response_mime_type="application/json")
+    single = recording.models.generate_content(model="m", contents=["report", b"\x89PNG"], config=config)
+    chunks = list(recording.models.generate_content_stream(model="m", contents="stream me"))
+    awaited = asyncio.run(recording.aio.models.generate_content(model="m", contents="async"))
+    return config, single, chunks, awaited
+
+
+def test_recorded_responses_are_replayed_from_disk(store_path):
+    config, single, chunks, awaited = _record(store_path)
+
+    replay = ReplayClient(RecordingStore(store_path), latency_scale=0.0)
+    assert replay.models.generate_content(model="m", contents=["report", b"\x89PNG"], config=config).text == single.text
+    assert [chunk.text for chunk in replay.models.generate_content_stream(model="m", contents="stream me")] == [chunk.text for chunk in chunks]
+    assert asyncio.run(replay.aio.models.generate_content(model="m", contents="async")).text == awaited.text
+    assert replay.stats() == {"recorded": 3, "hits": 3, "misses": 0}
+
+
+def test_replay_applies_scaled_latency(store_path):
+    _record(store_path)
+    replay = ReplayClient(RecordingStore(store_path), latency_scale=2.0, latency_jitter=0.0)
+
+    started = time.monotonic()
+    asyncio.run(replay.aio.models.generate_content(model="m", contents="async"))
+    assert time.monotonic() - started >= 0.2
+
+
+def test_misses_fail_or_fall_back(store_path):
+    replay = ReplayClient(RecordingStore(store_path))
+    with pytest.raises(errors.ClientError) as raised:
+        replay.models.generate_content(model="m", contents="never recorded")
+    assert raised.value.code == 404
+
+    fallback = FakeGenAIClient(latency=0.0)
+    replay = ReplayClient(RecordingStore(store_path), miss_client=fallback)
+    assert replay.models.generate_content(model="m", contents="never recorded").text
+    assert (replay.misses, fallback.calls) == (1, 1)
+
+
+def test_fingerprint_covers_model_content_and_config():
+    base = request_fingerprint("m", ["text", b"bytes"])
+    assert base == request_fingerprint("m", ["text", b"bytes"])
+    assert base != request_fingerprint("other", ["text", b"bytes"])
+    assert base != request_fingerprint("m", ["text", b"other bytes"])
+    assert base != request_fingerprint("m", ["text", b"bytes"], types.GenerateContentConfig(temperature=0.1))
+    assert base != request_fingerprint("m", ["text", b"bytes"], stream=True)
+
+
+def test_backend_selection(store_path, monkeypatch):
+    monkeypatch.setenv("LLM_RECORDINGS_PATH", store_path)
+    assert isinstance(build_backend(lambda: None, "fake"), FakeGenAIClient)
+    assert isinstance(build_backend(lambda: None, "replay"), ReplayClient)
+    assert isinstance(build_backend(FakeGenAIClient, "record"), RecordingClient)
+    with pytest.raises(ValueError):
+        build_backend(lambda: None, "cloud")
+
+
+def test_load_test_drives_the_app_in_process(app_module):
+    assert parse_mix("reports=2,symptoms") == {"reports": 2.0, "symptoms": 1.0}
+    with pytest.raises(SystemExit):
+        parse_mix("videos=1")
+
+    call = make_call(InProcessTarget(), "symptoms", [], random.Random(0))
+    assert call() == 200
@@ -0,0 +1,116 @@
+import asyncio
+import time
+import threading
+
+import pytest
+
+from fake_llm import FakeGenAIClient
+from llm_scheduler import CircuitBreaker, CircuitOpenError, LLMScheduler
+
+
+def _open_scheduler(reset_timeout=0.1):
+    scheduler = LLMScheduler(failure_threshold=1, reset_timeout=reset_timeout, max_retries=0)
+    breaker = scheduler._limiter("m").breaker
+    breaker.record_failure(time.monotonic())
+    assert breaker.state == "open"
+    return scheduler, breaker
+
+
+def test_half_open_admits_a_single_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure(now=0)
+    assert not breaker.allow(now=5)
+
+    assert breaker.allow(now=10)
+    breaker.start()
+    assert not breaker.allow(now=11)
+
+    breaker.record_failure(now=12)
+    assert breaker.state == "open"
+    assert not breaker.allow(now=13)
+
+    assert breaker.allow(now=22)
+    breaker.start()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow(now=23)
+
+
+def test_concurrent_callers_during_half_open_fail_fast():
+    scheduler, breaker = _open_scheduler()
+    time.sleep(0.15)
+    client = FakeGenAIClient(latency=0.2)
+
+    async def call():
+        return await scheduler.generate_async(client, model="m", contents="hi")
+
+    async def burst():
+        return await asyncio.gather(*(call() for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+    assert client.calls == 1
+    assert sum(isinstance(result, CircuitOpenError) for result in results) == 4
+    assert breaker.state == "closed"
+    assert not breaker.trial_in_flight
+
+
+def test_cancelled_trial_frees_the_slot():
+    scheduler, breaker = _open_scheduler()
+    time.sleep(0.15)
+    client = FakeGenAIClient(latency=1.0)
+
+    async def cancel_trial():
+        task = asyncio.create_task(scheduler.generate_async(client, model="m", contents="hi"))
+        await asyncio.sleep(0.05)
+        assert breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert breaker.state == "half_open"
+    assert not breaker.trial_in_flight
+
+    client.latency = 0.0
+    scheduler.generate(client, model="m", contents="hi")
+    assert breaker.state == "closed"
+
+
+def test_queued_callers_wait_to_be_woken_instead_of_polling():
+    scheduler = LLMScheduler(default_rpm=600)  # One request every 0.1s once the bucket is empty.
+    scheduler._limiter("m").requests.tokens = 0
+    client = FakeGenAIClient(latency=0.0)
+    admissions = []
+    try_admit = scheduler._try_admit
+
+    def counting_try_admit(*args):
+        admissions.append(1)
+        return try_admit(*args)
+
+    scheduler._try_admit = counting_try_admit
+    threads = [threading.Thread(target=scheduler.generate, args=(client,), kwargs={"model": "m", "contents": "hi"})
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert client.calls == 5
+    # About one check per wake-up; polling every 10ms would take hundreds over the ~0.5s.
+    assert len(admissions) < 40
+
+
+def test_interrupted_sync_trial_frees_the_slot():
+    scheduler, breaker = _open_scheduler()
+    time.sleep(0.15)
+
+    class _Interrupting:
+        class models:
+            @staticmethod
+            def generate_content(**request):
+                raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.generate(_Interrupting(), model="m", contents="hi")
+    assert breaker.state == "half_open"
+    assert not breaker.trial_in_flight
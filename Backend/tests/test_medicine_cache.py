@@ -0,0 +1,71 @@
+import re
+import json
+import asyncio
+
+import pytest
+
+from fake_llm import FakeGenAIClient
+from prescription_reader import PrescriptionReaderAgent, normalize_medicine_form, normalize_medicine_name
+from response_cache import PersistentLRUCache
+
+
+def explain_requested_medicines(model, contents, config):
+    """Explains exactly the medicines named in the prompt's input JSON."""
+    names = re.findall(r'"name":"([^"]+)"', contents[0])
+    return json.dumps({name: {"purpose": f"{name} purpose", "side_effects": "none", "interactions": "none"} for name in names})
+
+
+@pytest.fixture
+def agent(tmp_path):
+    client = FakeGenAIClient(latency=0.0, responder=explain_requested_medicines)
+    cache = PersistentLRUCache(str(tmp_path / "knowledge.db"), namespace="medicine_knowledge")
+    return PrescriptionReaderAgent(knowledge_cache=cache, client=client)
+
+
+def test_normalization():
+    assert normalize_medicine_name("  PARACETAMOL-500mg ") == "paracetamol 500mg"
+    assert normalize_medicine_form("Tablets") == normalize_medicine_form("tablet") == "tablet"
+    assert normalize_medicine_form("Gas") == "gas"
+
+
+def test_only_unseen_medicines_are_sent(agent):
+    first = agent._explain_medicines({"medicines": [
+        {"name": "Paracetamol", "form": "Tablets"},
+        {"name": "Amoxicillin", "form": "Capsule"}
+    ]})
+    assert set(first) == {"Paracetamol", "Amoxicillin"}
+    assert agent.client.calls == 1
+
+    second = agent._explain_medicines({"medicines": [
+        {"name": "PARACETAMOL", "form": "tablet"},
+        {"name": "Ibuprofen", "form": "Tablet"}
+    ]})
+    assert agent.client.calls == 2
+    assert second["PARACETAMOL"]["purpose"] == "Paracetamol purpose"
+    assert second["Ibuprofen"]["purpose"] == "Ibuprofen purpose"
+
+    third = asyncio.run(agent._explain_medicines_async({"medicines": [
+        {"name": "ibuprofen", "form": "tablets"},
+        {"name": "Amoxicillin", "form": "Capsule"}
+    ]}))
+    assert agent.client.calls == 2
+    assert set(third) == {"ibuprofen", "Amoxicillin"}
+
+
+def test_duplicates_in_one_prescription_are_sent_once(agent):
+    sent = []
+    responder = agent.client.responder
+    agent.client.responder = lambda model, contents, config: sent.append(contents[0]) or responder(model, contents, config)
+
+    agent._explain_medicines({"medicines": [{"name": "Cetirizine", "form": "Tablet"}, {"name": "cetirizine", "form": "tablets"}]})
+    assert sent[0].count("etirizine") == 1
+
+
+def test_failed_explanations_are_not_cached(agent):
+    agent.client.responder = lambda model, contents, config: "not json"
+    assert "error" in agent._explain_medicines({"medicines": [{"name": "Metformin", "form": "Tablet"}]})
+
+    agent.client.responder = explain_requested_medicines
+    result = agent._explain_medicines({"medicines": [{"name": "Metformin", "form": "Tablet"}]})
+    assert result["Metformin"]["purpose"] == "Metformin purpose"
+    assert agent.client.calls == 2
@@ -0,0 +1,91 @@
+import math
+import uuid
+
+import pytest
+
+from memory_index import TfidfMemoryIndex, hashed_features
+from memory_service import DatabaseMemoryService
+
+DOCUMENTS = {
+    1: "Patient reported migraine headaches with nausea.",
+    2: "Cholesterol was high, migraine again, diet changes advised.",
+    3: "Annual checkup, blood pressure normal.",
+    4: "High blood pressure, started on lisinopril.",
+}
+
+
+def _reference_scores(documents, query, n_features=2 ** 18):
+    """Dense cosine over IDF-weighted sublinear tf, computed the slow way."""
+    vectors = {memory_id: dict(zip(*(a.tolist() for a in hashed_features(text, n_features)))) for memory_id, text in documents.items()}
+    df = {}
+    for vector in vectors.values():
+        for bucket in vector:
+            df[bucket] = df.get(bucket, 0) + 1
+    idf = lambda bucket: math.log((1 + len(documents)) / (1 + df.get(bucket, 0))) + 1
+    q = {bucket: tf * idf(bucket) for bucket, tf in zip(*(a.tolist() for a in hashed_features(query, n_features)))}
+    q_norm = math.sqrt(sum(value ** 2 for value in q.values()))
+    scores = {}
+    for memory_id, vector in vectors.items():
+        weighted = {bucket: tf * idf(bucket) for bucket, tf in vector.items()}
+        dot = sum(value * q.get(bucket, 0.0) for bucket, value in weighted.items())
+        if dot > 0:
+            scores[memory_id] = dot / (math.sqrt(sum(value ** 2 for value in weighted.values())) * q_norm)
+    return scores
+
+
+@pytest.mark.parametrize("query", ["migraine", "high blood pressure", "blood pressure lisinopril unknownterm"])
+def test_scores_match_dense_reference(query):
+    index = TfidfMemoryIndex()
+    index.add_many(DOCUMENTS.items())
+
+    expected = _reference_scores(DOCUMENTS, query)
+    results = index.query(query, k=10)
+    assert [memory_id for memory_id, _ in results] == sorted(expected, key=expected.get, reverse=True)
+    for memory_id, score in results:
+        assert score == pytest.approx(expected[memory_id])
+
+
+def test_state_is_sized_by_vocabulary_not_hash_space():
+    index = TfidfMemoryIndex(n_features=2 ** 18)
+    index.add_many(DOCUMENTS.items())
+    index.query("migraine")
+
+    vocabulary = len(index._columns_of)
+    assert index._matrix.shape[1] == vocabulary
+    assert len(index._idf) == vocabulary
+    assert len(index._columns.indptr) == vocabulary + 1
+    assert len(index._df) < 4 * vocabulary
+
+
+def test_remove_and_re_add_update_scores():
+    index = TfidfMemoryIndex()
+    index.add_many(DOCUMENTS.items())
+    assert {memory_id for memory_id, _ in index.query("migraine")} == {1, 2}
+
+    assert index.remove(1)
+    assert not index.remove(1)
+    remaining = {k: v for k, v in DOCUMENTS.items() if k != 1}
+    assert dict(index.query("migraine")) == pytest.approx(_reference_scores(remaining, "migraine"))
+
+    index.add(2, "No complaints today.")
+    assert index.query("migraine") == []
+    assert len(index) == 3
+
+
+def test_service_keeps_a_bounded_lru_of_user_indexes(app_module):
+    service = DatabaseMemoryService(retrieval="tfidf", max_tfidf_users=2)
+    users = [f"user-{uuid.uuid4().hex[:8]}" for _ in range(3)]
+    with app_module.app.app_context():
+        for user in users:
+            service.add_memory(user, f"Memory about asthma for {user}")
+
+        service.search_memories(users[0], "asthma")
+        service.search_memories(users[1], "asthma")
+        service.search_memories(users[0], "asthma")
+        service.search_memories(users[2], "asthma")
+        assert list(service._tfidf_indexes) == [users[0], users[2]]
+
+        # An evicted user's index is rebuilt from the database, including writes made meanwhile.
+        service.add_memory(users[1], "Asthma inhaler refilled")
+        assert len(service.search_memories(users[1], "asthma inhaler")) == 2
+        assert list(service._tfidf_indexes) == [users[2], users[1]]
@@ -0,0 +1,59 @@
+import uuid
+
+import pytest
+
+from database import db, Memory
+from memory_service import DatabaseMemoryService
+
+
+@pytest.fixture
+def app_context(app_module):
+    with app_module.app.app_context():
+        yield app_module.app
+
+
+@pytest.fixture
+def user_id():
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+
+def test_fts_index_is_enabled_on_sqlite(app_context):
+    assert app_context.config["MEMORY_FTS_ENABLED"]
+
+
+def test_fts_ranks_by_relevance_and_scopes_to_the_user(app_context, user_id):
+    service = DatabaseMemoryService(retrieval="fts")
+    service.add_memory(user_id, "Patient reported migraine headaches with nausea.")
+    service.add_memory(user_id, "Cholesterol was high; migraine again; migraine diary started.")
+    service.add_memory(user_id, "Annual checkup, nothing unusual.")
+    service.add_memory("someone-else", "Migraine every morning.")
+
+    results = service.search_memories(user_id, "migraine", limit=5)
+    assert [m.content for m in results] == [
+        "Cholesterol was high; migraine again; migraine diary started.",
+        "Patient reported migraine headaches with nausea."
+    ]
+    assert service.search_memories(user_id, "migraine", limit=1)[0].user_id == user_id
+
+
+def test_fts_matches_prefixes_and_ignores_punctuation(app_context, user_id):
+    service = DatabaseMemoryService(retrieval="fts")
+    service.add_memory(user_id, "Prescribed amoxicillin for bronchitis.")
+
+    assert len(service.search_memories(user_id, "amoxi")) == 1
+    assert service.search_memories(user_id, "\"bronch\" OR (") != []
+    assert service.search_memories(user_id, "?!") == []
+
+
+def test_fts_index_follows_updates_and_deletes(app_context, user_id):
+    service = DatabaseMemoryService(retrieval="fts")
+    memory = service.add_memory(user_id, "Allergic to penicillin.")
+
+    memory.content = "Allergic to sulfa drugs."
+    db.session.commit()
+    assert service.search_memories(user_id, "penicillin") == []
+    assert [m.id for m in service.search_memories(user_id, "sulfa")] == [memory.id]
+
+    assert service.delete_memory(memory.id, user_id)
+    assert service.search_memories(user_id, "sulfa") == []
+    assert db.session.get(Memory, memory.id) is None
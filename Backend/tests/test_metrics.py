@@ -0,0 +1,90 @@
+import pytest
+
+import metrics
+from metrics import MetricsRegistry
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["route"])
+    latency = registry.histogram("latency_seconds", "Latency.", ["route"], buckets=(0.1, 1.0))
+    registry.callback("ratio", "Ratio.", "gauge", ["cache"], lambda: {("docs",): 0.5})
+
+    requests.inc(route='/a"b')
+    requests.inc(2, route='/a"b')
+    latency.observe(0.05, route="/a")
+    latency.observe(0.5, route="/a")
+    latency.observe(5.0, route="/a")
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 3',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3',
+        "# HELP ratio Ratio.",
+        "# TYPE ratio gauge",
+        'ratio{cache="docs"} 0.5',
+    ]
+
+
+def test_registration_rules():
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Jobs.")
+    with pytest.raises(ValueError):
+        registry.counter("jobs_total", "Jobs again.")
+
+    registry.callback("broken", "Broken.", "gauge", [], lambda: 1 / 0)
+    registry.callback("broken", "Replaced.", "gauge", [], lambda: {(): 1})
+    assert "broken 1" in registry.render().splitlines()
+
+    registry.callback("failing", "Failing.", "gauge", [], lambda: 1 / 0)
+    assert "# TYPE failing gauge" in registry.render()
+
+
+def test_endpoint_reports_route_llm_and_db_metrics(client):
+    assert client.post("/doctor_assistant", json={"symptoms": "metrics test cough", "use_cache": False}).status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+
+    assert 'http_request_duration_seconds_count{route="/doctor_assistant",method="POST",status="200"}' in text
+    assert 'llm_call_duration_seconds_count{agent="doctor_assistant"' in text
+    assert 'llm_tokens_total{agent="doctor_assistant"' in text
+    assert 'db_queries_per_request_count{route="/doctor_assistant"}' in text
+    assert "cache_hit_ratio" in text
+    assert "# TYPE document_loader_path_total counter" in text
+
+
+class _DatedBuildModels:
+    """Answers like the live API: model_version is a dated build of the requested model."""
+
+    def __init__(self, models):
+        self._models = models
+
+    def generate_content(self, **request):
+        response = self._models.generate_content(**request)
+        response.model_version = f"{request['model']}-001"
+        return response
+
+
+def test_model_label_is_the_model_name_with_or_without_the_router():
+    from types import SimpleNamespace
+    from fake_llm import FakeGenAIClient
+    from model_router import ModelRouter, RoutedClient
+
+    dated = SimpleNamespace(models=_DatedBuildModels(FakeGenAIClient(latency=0.0).models))
+    metrics.MeteredClient(dated, agent="label-plain").models.generate_content(model="gemini-2.0-flash", contents="hello")
+    routed = metrics.MeteredClient(RoutedClient(dated, ModelRouter(fallbacks={})), agent="label-routed")
+    routed.models.generate_content(model="gemini-2.0-flash", contents="hello")
+
+    for agent in ("label-plain", "label-routed"):
+        assert metrics.LLM_CALL_DURATION.count(agent=agent, model="gemini-2.0-flash", priority="", outcome="ok") == 1
+        assert metrics.LLM_TOKENS.value(agent=agent, model="gemini-2.0-flash-001", direction="input") == 0
@@ -0,0 +1,63 @@
+import time
+import asyncio
+import threading
+
+from fake_llm import FakeGenAIClient
+from metrics import LLM_CALL_DURATION, LLM_TOKENS, MeteredClient
+from model_router import ModelRouter, RoutedClient
+
+
+def _hedging_router():
+    router = ModelRouter(fallbacks={"slow-model": "fast-model"}, prices={"slow-model": (1.0, 1.0)},
+                         min_samples=5, min_hedge_delay=0.05)
+    for _ in range(5):
+        router.record("slow-model", 0.05, True)
+    return router
+
+
+def test_hedge_winner_is_credited_and_the_cancelled_loser_is_not_a_sample():
+    router = _hedging_router()
+    client = FakeGenAIClient(latency=0.0, model_latency={"slow-model": 1.0})
+    metered = MeteredClient(RoutedClient(client, router), agent="hedge-test")
+
+    response = asyncio.run(metered.aio.models.generate_content(model="slow-model", contents="hello"))
+
+    assert response.model_version == "fast-model"
+    assert client.calls_by_model == {"slow-model": 1, "fast-model": 1}
+    stats = router.stats()
+    assert stats["hedge_wins"] == 1
+    assert stats["wasted_cost_usd"] > 0
+    # Only the five seeded samples: the loser's cut-short time would pull p95 down.
+    assert stats["models"]["slow-model"]["samples"] == 5
+    assert stats["models"]["fast-model"]["samples"] == 1
+
+    assert LLM_TOKENS.value(agent="hedge-test", model="fast-model", direction="input") > 0
+    assert LLM_TOKENS.value(agent="hedge-test", model="slow-model", direction="input") == 0
+    assert LLM_CALL_DURATION.count(agent="hedge-test", model="fast-model", priority="", outcome="ok") == 1
+
+
+def test_unhedged_calls_keep_the_requested_model():
+    router = ModelRouter(fallbacks={})
+    metered = MeteredClient(RoutedClient(FakeGenAIClient(latency=0.0), router), agent="plain-test")
+
+    response = metered.models.generate_content(model="gemini-2.0-flash", contents="hello")
+
+    assert response.model_version == "gemini-2.0-flash"
+    assert LLM_TOKENS.value(agent="plain-test", model="gemini-2.0-flash", direction="output") > 0
+    assert router.stats()["models"]["gemini-2.0-flash"]["samples"] == 1
+
+
+def test_unhedged_sync_calls_run_on_the_callers_thread():
+    client = FakeGenAIClient(latency=0.3)
+    routed = RoutedClient(client, ModelRouter(sync_workers=2))
+    threads = [threading.Thread(target=routed.models.generate_content, kwargs={"model": "gemini-2.0-flash", "contents": "hi"})
+               for _ in range(32)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Not capped by the two-worker hedging pool.
+    assert client.max_in_flight == 32
+    assert time.monotonic() - started < 0.6
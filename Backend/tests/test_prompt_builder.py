@@ -0,0 +1,70 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+from prompt_builder import PromptBuilder, track_truncation
+
+
+def _report(results=60, note_chars=4000):
+    return {
+        "patient": {"name": "Test Patient", "notes": "x" * note_chars},
+        "lab_results": [{"test": f"Test {n}", "value": n, "unit": "mg/dL", "flag": "normal"} for n in range(results)]
+                       + [{"test": "Potassium", "value": 6.9, "unit": "mmol/L", "flag": "critical high"}]
+    }
+
+
+def test_json_shrinking_keeps_every_list_item():
+    builder = PromptBuilder("consultant", budget=1200)
+    with track_truncation() as truncated:
+        sent = json.loads(builder.fit_json(_report()))
+
+    assert len(sent["lab_results"]) == 61
+    assert sent["lab_results"][-1] == {"test": "Potassium", "value": 6.9, "unit": "mmol/L", "flag": "critical high"}
+    assert len(sent["patient"]["notes"]) < 4000
+    assert truncated == ["consultant"]
+
+
+def test_json_over_budget_is_sent_whole_and_flagged():
+    builder = PromptBuilder("consultant", budget=50)
+    with track_truncation() as truncated:
+        sent = json.loads(builder.fit_json(_report(results=100, note_chars=10)))
+    assert len(sent["lab_results"]) == 101
+    assert truncated == ["consultant"]
+
+    with track_truncation() as truncated:
+        PromptBuilder("consultant", budget=100000).fit_json(_report())
+    assert truncated == []
+
+
+class _BlockingModels:
+    def count_tokens(self, model, contents):
+        raise AssertionError("the async path must not make a blocking count_tokens call")
+
+
+class _AsyncCountingModels:
+    def __init__(self):
+        self.calls = 0
+
+    async def count_tokens(self, model, contents):
+        self.calls += 1
+        return SimpleNamespace(total_tokens=42)
+
+
+def test_api_counter_uses_the_async_client_on_the_async_path():
+    client = SimpleNamespace(models=_BlockingModels(), aio=SimpleNamespace(models=_AsyncCountingModels()))
+    builder = PromptBuilder("doctor_assistant", budget=100, counter="api", client=client, model="m")
+
+    text = "cough " * 70  # An estimate near the budget, so the exact count is requested.
+    assert asyncio.run(builder.count_async(text)) == 42
+    assert asyncio.run(builder.fit_text_async(text)) == text.strip()
+    assert client.aio.models.calls == 2
+
+
+def test_responses_report_prompt_truncation(client, app_module, monkeypatch):
+    body = client.post("/doctor_assistant", json={"symptoms": "mild cough", "use_cache": False}).get_json()
+    assert body["prompt_truncated"] is False
+
+    monkeypatch.setattr(app_module.symptom_agent.prompt_builder, "budget", 200)
+    body = client.post("/doctor_assistant", json={"symptoms": "persistent cough " * 200, "use_cache": False}).get_json()
+    assert body["status"] == "success"
+    assert body["prompt_truncated"] is True
@@ -0,0 +1,170 @@
+import json
+
+from response_cache import PersistentLRUCache, TTLCache, fingerprint
+from multimodel_medical_agent import MultimodalMedicalAgent
+from prompt_builder import PromptBuilder, track_truncation
+
+
+def test_fingerprint_is_stable_and_order_sensitive():
+    assert fingerprint(b"abc", "pdf", {"b": 1, "a": 2}) == fingerprint(b"abc", "pdf", {"a": 2, "b": 1})
+    assert fingerprint(b"abc", "pdf") != fingerprint("pdf", b"abc")
+    assert fingerprint(b"ab", b"c") != fingerprint(b"a", b"bc")
+
+
+def test_persistent_cache_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.db")
+    PersistentLRUCache(path, namespace="ns").set("k", "v")
+    reopened = PersistentLRUCache(path, namespace="ns")
+    assert reopened.get("k") == "v"
+    assert PersistentLRUCache(path, namespace="other").get("k") is None
+
+
+def test_persistent_cache_evicts_least_recently_used(tmp_path):
+    cache = PersistentLRUCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache._conn.execute("UPDATE cache_entries SET last_access = last_access - 10 WHERE key = 'b'")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+
+class _CountingConnection:
+    """Wraps a sqlite3 connection and counts the rows read back from its queries."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows_read = 0
+
+    def execute(self, *args):
+        cursor = self.conn.execute(*args)
+        counter = self
+
+        class Cursor:
+            def __iter__(self):
+                for row in cursor:
+                    counter.rows_read += 1
+                    yield row
+
+            def fetchall(self):
+                return list(self)
+
+            def fetchone(self):
+                return cursor.fetchone()
+
+            def close(self):
+                cursor.close()
+
+            @property
+            def rowcount(self):
+                return cursor.rowcount
+
+        return Cursor()
+
+    def executemany(self, *args):
+        return self.conn.executemany(*args)
+
+
+def test_persistent_cache_eviction_reads_only_the_evicted_rows(tmp_path):
+    cache = PersistentLRUCache(str(tmp_path / "cache.db"), max_entries=200)
+    cache.set_many({f"k{i}": "v" for i in range(200)})
+    cache._conn.execute("UPDATE cache_entries SET last_access = last_access - 10 WHERE key = 'k7'")
+    cache._conn = _CountingConnection(cache._conn)
+
+    cache.set("new", "v")
+
+    assert cache.get("k7") is None
+    assert cache.stats()["entries"] == 200
+    # The full namespace is 201 rows; only the oldest one has to be looked at.
+    assert cache._conn.rows_read <= 2
+
+
+def test_persistent_cache_enforces_byte_budget(tmp_path):
+    cache = PersistentLRUCache(str(tmp_path / "cache.db"), max_entries=100, max_bytes=10)
+    cache.set("a", "x" * 6)
+    cache.set("b", "y" * 6)
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] <= 10
+
+
+def test_persistent_cache_expires_entries(tmp_path):
+    cache = PersistentLRUCache(str(tmp_path / "cache.db"), ttl_seconds=60)
+    cache.set("a", "1")
+    cache._conn.execute("UPDATE cache_entries SET created_at = created_at - 120")
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_ttl_cache_lru_and_expiry(monkeypatch):
+    cache = TTLCache(max_entries=2, ttl_seconds=10)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    assert cache.get("b") is None
+
+    import response_cache
+    now = response_cache.time.monotonic()
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_extraction_is_served_from_cache_on_repeat_upload(tmp_path, fake_client):
+    cache = PersistentLRUCache(str(tmp_path / "cache.db"), namespace="medical_record_extraction")
+    agent = MultimodalMedicalAgent(cache=cache, client=fake_client)
+
+    first = agent.analyze_bytes(b"Hemoglobin 13.2 g/dL", "report.txt")
+    second = agent.analyze_bytes(b"Hemoglobin 13.2 g/dL", "report.txt")
+
+    assert first == second
+    assert "error" not in json.loads(first)
+    assert fake_client.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_cache_hits_report_truncation_like_the_original_miss(tmp_path, fake_client):
+    cache = PersistentLRUCache(str(tmp_path / "cache.db"))
+    agent = MultimodalMedicalAgent(cache=cache, client=fake_client, prompt_builder=PromptBuilder("report_extractor", budget=200))
+    document = ("Hemoglobin 13.2 g/dL. " * 200).encode()
+
+    results = []
+    for _ in range(2):
+        with track_truncation() as truncated:
+            results.append(agent.analyze_bytes(document, "report.txt"))
+        assert truncated == ["report_extractor"]
+    assert results[0] == results[1]
+    assert fake_client.calls == 1
+
+    with track_truncation() as truncated:
+        agent.analyze_bytes(b"Hemoglobin 13.2 g/dL", "short.txt")
+        agent.analyze_bytes(b"Hemoglobin 13.2 g/dL", "short.txt")
+    assert truncated == []
+
+
+def test_failed_extractions_are_not_cached(tmp_path):
+    from fake_llm import FakeGenAIClient
+    client = FakeGenAIClient(latency=0.0, error_rate=1.0)
+    cache = PersistentLRUCache(str(tmp_path / "cache.db"))
+    agent = MultimodalMedicalAgent(cache=cache, client=client)
+
+    assert "error" in json.loads(agent.analyze_bytes(b"text", "report.txt"))
+    assert cache.stats()["entries"] == 0
+
+
+def test_extraction_cache_key_tracks_loader_settings(tmp_path, fake_client, monkeypatch):
+    import document_loader
+    from document_loader import SmartLoader
+    from image_preprocessing import ImageNormalizer
+
+    def key(loader):
+        return MultimodalMedicalAgent(client=fake_client, loader=loader)._cache_key(b"scan", "report.pdf")
+
+    baseline = key(SmartLoader(image_normalizer=ImageNormalizer()))
+    assert key(SmartLoader(image_normalizer=ImageNormalizer())) == baseline
+    assert key(SmartLoader(image_normalizer=ImageNormalizer(max_dimension=1024))) != baseline
+    assert key(SmartLoader(image_normalizer=ImageNormalizer(grayscale=True))) != baseline
+    assert key(SmartLoader()) != baseline
+
+    monkeypatch.setattr(document_loader, "PDF_MIN_TEXT_CHARS", 10)
+    assert key(SmartLoader(image_normalizer=ImageNormalizer())) != baseline
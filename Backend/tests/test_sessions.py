@@ -0,0 +1,180 @@
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from database import db
+from session_service import DatabaseSessionService, EventWriteBehindQueue, LAST_EVENT_PREVIEW_CHARS
+
+
+@pytest.fixture
+def app_context(app_module):
+    with app_module.app.app_context():
+        yield app_module.app
+
+
+@pytest.fixture
+def user_id():
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+
+@contextmanager
+def count_queries():
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+
+def test_session_summaries_come_from_one_query(app_context, user_id):
+    service = DatabaseSessionService()
+    service.create_session(user_id, "empty")
+    service.add_events(user_id, "busy", [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "x" * 500}
+    ])
+    db.session.expire_all()
+
+    with count_queries() as statements:
+        summaries = service.list_session_summaries(user_id)
+    assert len(statements) == 1
+
+    by_id = {summary["id"]: summary for summary in summaries}
+    assert by_id["empty"]["event_count"] == 0
+    assert by_id["empty"]["last_event"] is None
+    assert by_id["busy"]["event_count"] == 2
+    assert by_id["busy"]["last_event"]["role"] == "assistant"
+    assert by_id["busy"]["last_event"]["content_preview"] == "x" * LAST_EVENT_PREVIEW_CHARS
+    assert summaries[0]["id"] == "busy"
+
+
+def test_list_sessions_with_events_avoids_n_plus_one(app_context, user_id):
+    service = DatabaseSessionService()
+    for number in range(5):
+        service.add_event(user_id, f"session-{number}", "user", f"message {number}")
+    db.session.expire_all()
+
+    with count_queries() as statements:
+        sessions = service.list_sessions(user_id, include_events=True)
+        assert sum(len(session.events) for session in sessions) == 5
+    assert len(statements) == 2
+
+
+def test_sessions_route_returns_summaries(client, app_module, user_id):
+    with app_module.app.app_context():
+        app_module.session_service.add_event(user_id, f"{user_id}-s1", "user", "hello")
+
+    body = client.get(f"/sessions/{user_id}").get_json()
+    assert body["sessions"][0]["event_count"] == 1
+    assert "events" not in body["sessions"][0]
+
+    body = client.get(f"/sessions/{user_id}?include_events=true").get_json()
+    assert body["sessions"][0]["events"][0]["content"] == "hello"
+
+
+@pytest.fixture
+def writer(app_module):
+    service = DatabaseSessionService()
+    writer = EventWriteBehindQueue(app_module.app, service, retry_backoff=0.0)
+    yield writer
+    writer.shutdown()
+
+
+def _contents(user_id, session_id):
+    return [event.content for event in DatabaseSessionService().get_events(user_id, session_id)]
+
+
+def test_a_failing_batch_only_loses_itself(app_context, writer, user_id):
+    # role is NOT NULL: this batch fails with an IntegrityError however often it is retried.
+    writer.submit(user_id, f"{user_id}-s1", [{"role": "user", "content": "before"}])
+    writer.submit(user_id, f"{user_id}-s2", [{"role": None, "content": "broken"}])
+    writer.submit(user_id, f"{user_id}-s1", [{"role": "assistant", "content": "after"}])
+    writer.flush()
+
+    assert _contents(user_id, f"{user_id}-s1") == ["before", "after"]
+    assert _contents(user_id, f"{user_id}-s2") == []
+
+
+def test_transient_errors_are_retried(app_context, writer, user_id, monkeypatch):
+    write_events = writer.service._write_events
+    failures = []
+
+    def flaky(batches):
+        if len(failures) < 2:
+            failures.append(1)
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return write_events(batches)
+
+    monkeypatch.setattr(writer.service, "_write_events", flaky)
+    writer.submit(user_id, f"{user_id}-s1", [{"role": "user", "content": "kept"}])
+    writer.flush()
+
+    assert len(failures) == 2
+    assert _contents(user_id, f"{user_id}-s1") == ["kept"]
+
+
+def test_flush_waits_only_for_the_requested_session(app_context, writer, user_id, monkeypatch):
+    write_events = writer.service._write_events
+    release = threading.Event()
+
+    def slow(batches):
+        release.wait(5)
+        return write_events(batches)
+
+    monkeypatch.setattr(writer.service, "_write_events", slow)
+    writer.submit(user_id, f"{user_id}-slow", [{"role": "user", "content": "queued"}])
+
+    started = time.monotonic()
+    writer.flush(user_id, f"{user_id}-other")
+    writer.flush("someone-else")
+    assert time.monotonic() - started < 1
+
+    release.set()
+    writer.flush(user_id, f"{user_id}-slow")
+    assert _contents(user_id, f"{user_id}-slow") == ["queued"]
+
+
+def test_flush_gives_up_after_the_timeout(app_context, writer, user_id, monkeypatch):
+    write_events = writer.service._write_events
+    release = threading.Event()
+
+    def stuck(batches):
+        release.wait(5)
+        return write_events(batches)
+
+    monkeypatch.setattr(writer.service, "_write_events", stuck)
+    writer.flush_timeout = 0.2
+    writer.submit(user_id, f"{user_id}-s1", [{"role": "user", "content": "queued"}])
+
+    started = time.monotonic()
+    writer.flush(user_id, f"{user_id}-s1")
+    writer.flush()
+    assert time.monotonic() - started < 1
+
+    release.set()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_a_dead_writer_releases_flush_and_refuses_batches(app_module, user_id):
+    service = DatabaseSessionService()
+    writer = EventWriteBehindQueue(app_module.app, service)
+
+    def crash(pending):
+        raise RuntimeError("writer crashed")
+
+    writer._write = crash
+    writer.submit(user_id, f"{user_id}-s1", [{"role": "user", "content": "lost"}])
+    writer._thread.join(5)
+
+    started = time.monotonic()
+    writer.flush(user_id, f"{user_id}-s1")
+    assert time.monotonic() - started < 1
+    assert writer.submit(user_id, f"{user_id}-s1", [{"role": "user", "content": "next"}]) is False
+    writer.shutdown()
@@ -0,0 +1,51 @@
+import json
+
+from streaming import JsonFieldStream, format_sse
+
+
+def _feed_in_chunks(text, size):
+    streamer = JsonFieldStream()
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(streamer.feed(text[start:start + size]))
+    return streamer, events
+
+
+def test_format_sse():
+    assert format_sse("field", {"a": 1}) == 'event: field\ndata: {"a": 1}\n\n'
+
+
+def test_fields_and_items_are_reported_as_they_complete():
+    document = {
+        "disclaimer": "Not medical advice, \"really\".",
+        "possible_conditions": [{"name": "Flu", "notes": "a, b}"}, {"name": "Cold"}],
+        "urgency": "low"
+    }
+    text = json.dumps(document)
+
+    for size in (1, 3, len(text)):
+        streamer, events = _feed_in_chunks(text, size)
+        assert streamer.text == text
+        assert [event for event in events if event[0] == "field"] == [
+            ("field", key, value) for key, value in document.items()
+        ]
+        assert [event for event in events if event[0] == "item"] == [
+            ("item", "possible_conditions", {"name": "Flu", "notes": "a, b}"}),
+            ("item", "possible_conditions", {"name": "Cold"})
+        ]
+
+
+def test_field_is_reported_before_the_object_closes():
+    streamer = JsonFieldStream()
+    assert streamer.feed('{"disclaimer": "x", "urg') == [("field", "disclaimer", "x")]
+    assert streamer.feed('ency": "high"}') == [("field", "urgency", "high")]
+
+
+def test_symptom_stream_route(client):
+    response = client.post("/doctor_assistant/stream", json={"symptoms": "headache", "use_cache": False})
+    assert response.mimetype == "text/event-stream"
+
+    events = [block.split("\n", 1)[0][len("event: "):] for block in response.get_data(as_text=True).strip().split("\n\n")]
+    assert events[0] == "start"
+    assert "field" in events and "markdown" in events
+    assert events[-1] == "result"
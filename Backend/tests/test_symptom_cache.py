@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from doctor_agent import DoctorAssistant, canonicalize_symptoms
+from response_cache import TTLCache
+
+
+@pytest.mark.parametrize("first, second", [
+    ("fever and headache", "Headache, fever"),
+    ("I have a fever. Also headache!", "headache; fever"),
+    ("Sore throat, sore throat", "sore throat"),
+])
+def test_rephrasings_share_a_key(first, second):
+    assert canonicalize_symptoms(first) == canonicalize_symptoms(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("pain in left arm, no pain in chest", "pain in chest, no pain in left arm"),
+    ("no fever and cough", "cough, no fever"),
+    ("no fever or headache", "headache, no fever"),
+    ("left knee swelling, right ankle pain", "right knee swelling, left ankle pain"),
+])
+def test_different_meanings_do_not_collide(first, second):
+    assert canonicalize_symptoms(first) != canonicalize_symptoms(second)
+
+
+def test_cache_serves_rephrasings_and_respects_use_cache(fake_client):
+    agent = DoctorAssistant(cache=TTLCache(max_entries=10), client=fake_client)
+
+    first = agent.analyze("fever and headache")
+    assert json.loads(agent.analyze("Headache, fever")) == json.loads(first)
+    assert fake_client.calls == 1
+
+    agent.analyze("pain in left arm, no pain in chest")
+    agent.analyze("pain in chest, no pain in left arm")
+    assert fake_client.calls == 3
+
+    agent.analyze("fever and headache", use_cache=False)
+    assert fake_client.calls == 4
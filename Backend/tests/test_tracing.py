@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from tracing import Tracer
+
+
+def test_spans_nest_across_tasks_and_threads():
+    tracer = Tracer(capacity=2)
+
+    def load(pages):
+        with tracer.span("loader", pages=pages):
+            pass
+
+    async def pipeline():
+        with tracer.trace("request", route="/x"):
+            await asyncio.gather(tracer.traced("llm", asyncio.sleep(0.01), tokens=10), asyncio.to_thread(load, 3))
+            tracer.annotate(status=200)
+
+    asyncio.run(pipeline())
+    trace = tracer.get(tracer.recent(1)[0]["trace_id"]).to_dict()
+
+    spans = {span["name"]: span for span in trace["spans"]}
+    root_id = spans["request"]["span_id"]
+    assert spans["llm"]["parent_id"] == spans["loader"]["parent_id"] == root_id
+    assert spans["llm"]["attributes"] == {"tokens": 10}
+    assert spans["loader"]["attributes"] == {"pages": 3}
+    assert trace["attributes"] == {"route": "/x", "status": 200}
+
+
+def test_ring_buffer_errors_and_noop_outside_a_trace():
+    tracer = Tracer(capacity=2)
+    with tracer.span("orphan") as span:
+        span.set(ignored=True)
+    assert tracer.recent() == []
+
+    for name in ("a", "b"):
+        with tracer.trace(name):
+            pass
+    with pytest.raises(ValueError):
+        with tracer.trace("c"):
+            raise ValueError("boom")
+
+    recent = tracer.recent()
+    assert [summary["name"] for summary in recent] == ["c", "b"]
+    assert recent[0]["error"] == "ValueError: boom"
+
+    tracer.configure(enabled=False)
+    with tracer.trace("d"):
+        pass
+    assert len(tracer.recent()) == 2
+
+
+def test_chrome_export():
+    tracer = Tracer()
+    with tracer.trace("request"):
+        with tracer.span("step", bytes=5):
+            pass
+
+    events = tracer.to_chrome()["traceEvents"]
+    assert events[0]["ph"] == "M"
+    complete = [event for event in events if event["ph"] == "X"]
+    assert [event["name"] for event in complete] == ["request", "step"]
+    assert complete[1]["args"] == {"bytes": 5}
+    assert complete[0]["dur"] >= complete[1]["dur"]
+
+
+def test_views_are_traced_and_exposed(client):
+    response = client.post("/doctor_assistant", json={"symptoms": "tracing test rash", "use_cache": False})
+    trace_id = response.headers["X-Trace-Id"]
+
+    body = client.get(f"/debug/traces/{trace_id}").get_json()
+    names = {span["name"] for span in body["trace"]["spans"]}
+    assert {"doctor_assistant", "symptom_analysis", "parse_analysis", "render_markdown"} <= names
+    assert body["trace"]["attributes"]["status"] == 200
+
+    assert trace_id in [summary["trace_id"] for summary in client.get("/debug/traces").get_json()["traces"]]
+    assert client.get(f"/debug/traces/{trace_id}?format=chrome").get_json()["traceEvents"]
+    assert client.get("/debug/traces/missing").status_code == 404
@@ -0,0 +1,253 @@
+import time
+import uuid
+import inspect
+import functools
+import threading
+import itertools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+
+class Span:
+    """One timed step of a trace. Attributes are free-form (sizes, page counts, token counts...)."""
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "end", "attributes", "error", "thread_id")
+
+    def __init__(self, trace: Optional["Trace"], name: str, parent_id: Optional[int], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = next(trace.span_ids) if trace is not None else 0
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = dict(attributes)
+        self.error: Optional[str] = None
+        self.thread_id = threading.get_ident()
+
+    def set(self, **attributes) -> "Span":
+        if self.trace is not None:
+            self.attributes.update(attributes)
+        return self
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.end is not None or self.trace is None:
+            return
+        self.end = time.perf_counter()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.add(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        origin = self.trace.start
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(((self.end or time.perf_counter()) - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class Trace:
+    """All spans recorded while handling one request (or background job)."""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.span_ids = itertools.count(1)
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> Dict[str, Any]:
+        root = self.root
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round((root.end - root.start) * 1000, 3) if root and root.end else None,
+            "span_count": len(self.spans),
+            "error": root.error if root else None,
+            "attributes": root.attributes if root else {}
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return {**self.summary(), "spans": [span.to_dict() for span in spans]}
+
+
+_NOOP_SPAN = Span(None, "noop", None, {})
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Lightweight request-scoped tracing.
+
+    trace() opens a root span and makes it current for the request; span()
+    opens a child of the current span. The current span lives in a
+    contextvar, so spans opened in asyncio tasks and asyncio.to_thread
+    workers nest under the step that started them. Outside a trace, span()
+    is a no-op, so instrumented library code costs nothing when called from
+    scripts. The last `capacity` finished traces are kept in a ring buffer
+    and can be exported as Chrome trace JSON (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, capacity: int = 100, enabled: bool = True):
+        self.enabled = enabled
+        self._traces = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def configure(self, capacity: Optional[int] = None, enabled: Optional[bool] = None) -> None:
+        with self._lock:
+            if capacity is not None and capacity != self._traces.maxlen:
+                self._traces = deque(self._traces, maxlen=capacity)
+            if enabled is not None:
+                self.enabled = enabled
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Starts a new trace (or just a span when already inside one)."""
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+        if _current_span.get() is not None:
+            with self.span(name, **attributes) as span:
+                yield span
+            return
+
+        trace = Trace(name)
+        root = trace.root = Span(trace, name, None, attributes)
+        token = _current_span.set(root)
+        error = None
+        try:
+            yield root
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            root.finish(error)
+            with self._lock:
+                self._traces.append(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get()
+        if parent is None or parent.trace is None:
+            yield _NOOP_SPAN
+            return
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish(error)
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """
+        A child of the current span that is not made current; call finish() on it.
+        For work whose start and end run in different contexts (e.g. generators).
+        """
+        parent = _current_span.get()
+        if parent is None or parent.trace is None:
+            return _NOOP_SPAN
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    async def traced(self, name: str, awaitable, **attributes):
+        """Awaits `awaitable` inside a span (handy for the branches of asyncio.gather)."""
+        with self.span(name, **attributes):
+            return await awaitable
+
+    def annotate(self, **attributes) -> None:
+        """Adds attributes to the current span, if any."""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def traced_view(self, name: str):
+        """
+        Decorator for Flask views (sync or async) that runs each request in its own
+        trace and returns the trace id in the X-Trace-Id response header.
+        """
+        def decorate(view):
+            def record_status(span, result):
+                response = result[0] if isinstance(result, tuple) else result
+                status = result[1] if isinstance(result, tuple) and len(result) > 1 else getattr(response, "status_code", 200)
+                span.set(status=status)
+                if span.trace is not None and hasattr(response, "headers"):
+                    response.headers["X-Trace-Id"] = span.trace.trace_id
+
+            if inspect.iscoroutinefunction(view):
+                @functools.wraps(view)
+                async def async_wrapper(*args, **kwargs):
+                    with self.trace(name) as span:
+                        result = await view(*args, **kwargs)
+                        record_status(span, result)
+                        return result
+                return async_wrapper
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                with self.trace(name) as span:
+                    result = view(*args, **kwargs)
+                    record_status(span, result)
+                    return result
+            return wrapper
+        return decorate
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self._traces)[-limit:]
+        return [trace.summary() for trace in reversed(traces)]
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            return next((trace for trace in self._traces if trace.trace_id == trace_id), None)
+
+    def to_chrome(self, trace_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Chrome trace-event JSON for the given (default: all buffered) traces: one
+        process per trace, one row per thread, one complete ("X") event per span.
+        """
+        with self._lock:
+            traces = [trace for trace in self._traces if trace_ids is None or trace.trace_id in trace_ids]
+        events = []
+        for pid, trace in enumerate(traces, start=1):
+            events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"{trace.name} {trace.trace_id}"}})
+            thread_rows: Dict[int, int] = {}
+            with trace._lock:
+                spans = list(trace.spans)
+            for span in sorted(spans, key=lambda s: s.start):
+                tid = thread_rows.setdefault(span.thread_id, len(thread_rows) + 1)
+                events.append({
+                    "name": span.name,
+                    "cat": trace.name,
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": round((trace.started_at + (span.start - trace.start)) * 1_000_000),
+                    "dur": round(((span.end or span.start) - span.start) * 1_000_000),
+                    "args": {**span.attributes, **({"error": span.error} if span.error else {})}
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+tracer = Tracer()